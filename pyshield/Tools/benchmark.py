@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the calculation time of the single cpu, multi process and multi
+thread engines (multi_cpu: False, True and threads).
+
+Two scenarios are timed: a small example scenario (a few rooms, two sources)
+and a large synthetic scenario with many barriers and sources. A config file
+can be timed as well. Run as a script:
+
+    python benchmark.py [config.yml]
+"""
+import logging
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+import pyshield as ps
+
+MODES = (False, True, ps.THREADS)
+
+
+def example_scenario():
+    """ Settings for a small scenario (5 barriers, 2 sources, 5 points) """
+    barriers = {
+        'wall 1': {ps.LOCATION: [0, 0, 400, 0], ps.MATERIAL: {'Lead': 0.2}},
+        'wall 2': {ps.LOCATION: [400, 0, 400, 300],
+                   ps.MATERIAL: {'Concrete': 20}},
+        'wall 3': {ps.LOCATION: [0, 150, 250, 150],
+                   ps.MATERIAL: {'Lead': 0.1, 'Brick': 10}},
+        'wall 4': {ps.LOCATION: [250, 150, 250, 300],
+                   ps.MATERIAL: {'Lead': 0.3}},
+        'wall 5': {ps.LOCATION: [50, 250, 350, 250],
+                   ps.MATERIAL: {'Concrete': 5}}}
+
+    sources = {
+        'source 1': {ps.LOCATION: [100, 100], ps.ISOTOPE: 'I-131',
+                     ps.ACTIVITY_H: 1000, ps.TYPE: ps.ISOTOPE},
+        'source 2': {ps.LOCATION: [320, 220], ps.ISOTOPE: 'Lu-177',
+                     ps.ACTIVITY_H: 5000, ps.TYPE: ps.ISOTOPE,
+                     ps.MATERIAL: {'Lead': 0.1}}}
+
+    points = dict([('point {0}'.format(i), {ps.LOCATION: location}) \
+                   for i, location in enumerate([[10, 10], [200, 200],
+                                                 [390, 290], [300, 100],
+                                                 [125, 80]])])
+
+    return {ps.BARRIERS: barriers, ps.SOURCES: sources, ps.POINTS: points,
+            ps.FLOOR_PLAN: np.zeros((300, 400)), ps.GRIDSIZE: 5}
+
+
+def synthetic_scenario(n_barriers=300, n_sources=40, n_points=100,
+                       size=(2000, 2000), seed=0):
+    """ Settings for a large scenario with randomly placed walls, sources
+    and points on a floor plan of size (width, height) cm. """
+    rng = np.random.RandomState(seed)
+    width, height = size
+    isotopes = ('I-131', 'Lu-177', 'F-18', 'Ga-68')
+    materials = ('Lead', 'Concrete', 'Brick')
+
+    barriers = {}
+    for i in range(n_barriers):
+        start = rng.uniform((0, 0), (width, height))
+        # horizontal or vertical walls of 1 - 5 m
+        direction = np.array((1, 0) if i % 2 else (0, 1))
+        step = rng.uniform(100, 500) * direction
+        end = np.minimum(start + step, (width, height))
+        material = materials[i % len(materials)]
+        thickness = {'Lead': 0.2, 'Concrete': 20, 'Brick': 10}[material]
+        barriers['wall {0}'.format(i)] = {
+            ps.LOCATION: [float(item) for item in np.append(start, end)],
+            ps.MATERIAL: {material: thickness}}
+
+    sources = {}
+    for i in range(n_sources):
+        location = rng.uniform((0, 0), (width, height))
+        sources['source {0}'.format(i)] = {
+            ps.LOCATION: [float(item) for item in location],
+            ps.ISOTOPE: isotopes[i % len(isotopes)],
+            ps.ACTIVITY_H: 1000, ps.TYPE: ps.ISOTOPE}
+
+    points = {}
+    for i in range(n_points):
+        location = rng.uniform((0, 0), (width, height))
+        points['point {0}'.format(i)] = {
+            ps.LOCATION: [float(item) for item in location]}
+
+    return {ps.BARRIERS: barriers, ps.SOURCES: sources, ps.POINTS: points,
+            ps.FLOOR_PLAN: np.zeros((height, width)), ps.GRIDSIZE: 20}
+
+
+def benchmark(modes=MODES, repeat=3, config='', **settings):
+    """ Time a run for each multi_cpu mode.
+
+    Args:
+        modes:    multi_cpu values to compare
+        repeat:   number of runs for each mode, the fastest run is reported
+                  (the first run includes starting the worker pool)
+        config:   config file, if empty only settings are used
+        settings: settings for the run (e.g. example_scenario())
+
+    Returns:
+        dictionary with the best and first time (s) for each mode
+    """
+    run_settings = {ps.SHOW: False, ps.EXPORT_EXCEL: False,
+                    ps.EXPORT_IMAGES: False, ps.LOG: logging.ERROR}
+    run_settings.update(settings)
+
+    times = {}
+    for mode in modes:
+        durations = []
+        for _ in range(repeat):
+            start = timer()
+            ps.run(config=config, multi_cpu=mode, **run_settings)
+            durations += [timer() - start]
+        times[mode] = (min(durations), durations[0])
+    ps.engine.shutdown()
+    return times
+
+
+def print_times(title, times):
+    """ Print the result of benchmark """
+    print('\n' + title)
+    print('{0:<10} {1:>10} {2:>10}'.format('multi_cpu', 'best [s]',
+                                           'first [s]'))
+    for mode, (best, first) in times.items():
+        print('{0:<10} {1:>10.3f} {2:>10.3f}'.format(str(mode), best, first))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print_times(sys.argv[1], benchmark(config=sys.argv[1]))
+    print_times('Example scenario', benchmark(**example_scenario()))
+    print_times('Synthetic scenario', benchmark(**synthetic_scenario()))
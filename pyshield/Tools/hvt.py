@@ -47,13 +47,29 @@ def shielding_factor(isotope = 'Lu-177', material = 'Lead' , thickness = 1, **kw
 
     return dose(isotope = isotope, barrier=barrier) / dose(isotope=isotope, **kwargs)
 
+def shielding_matrix(isotope = 'I-131', material = 'Lead'):
+  """ ObliquityMatrix for the setup of shielding_factor. The geometry is
+  calculated once, the dose for any thickness of the barrier follows from
+  matrix.dose({'barrier': {material: thickness}}). """
+  barrier = {'barrier' : {ps.MATERIAL: {material: 1},
+                          ps.LOCATION: [-50, 50, 50, 50]}}
+
+  # load the configuration of dose
+  dose(isotope = isotope, barrier = barrier)
+  scenario = ps.scenario.compile_scenario()
+
+  points = [location[ps.LOCATION] for location in scenario.points.values()]
+  return ps.obliquity.ObliquityMatrix(scenario.sources['source'], points,
+                                      scenario)
+
 def shielding_thickness(isotope, material, factor = 0.5):
   """ Find half value thickness for isotope and material by optimization """
 
+  matrix = shielding_matrix(isotope = isotope, material = material)
+  unshielded = matrix.dose({'barrier': {}})[0]
 
-  opt_func = lambda t: abs(factor - shielding_factor(isotope= isotope,
-                                                      material= material,
-                                                      thickness = t))
+  opt_func = lambda t: abs(factor - matrix.dose({'barrier': {material: t}})[0]
+                           / unshielded)
   r = optimize.fmin(opt_func , 0.3, xtol = 1e-3, ftol = 1e-12)
   return r[0]
 
@@ -6,10 +6,15 @@ from pyshield.constants import *
 from pyshield import io
 from pyshield.log import logger
 
-from pyshield.calculations import isotope, grid, barrier, line_intersect
+from pyshield.calculations import isotope, grid, barrier, line_intersect, \
+                                  spatial_index, physics_cache, sweep, \
+                                  resample, sets, scenario, map_cache, \
+                                  obliquity, incremental, point_dose, adaptive, \
+                                  contours, region, map_store
 
 
-from pyshield import log, config, calculations, tools, visualization, export
+from pyshield import log, config, calculations, tools, visualization, export, \
+                     engine
 from pyshield.execute import run_with_configuration as run
 
 
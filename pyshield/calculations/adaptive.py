@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive grid for dose maps.
+
+The dose is calculated on a coarse lattice of the display raster (the
+cartesian grid with spacing grid_size) with a spacing of 2 ** adaptive_levels
+grid points. Each cell is tested with the dose on the midpoints of its edges
+and its center: the cell is split in four if the bilinear interpolation from
+the corners deviates more than adaptive_tolerance (relative) from these
+doses, if an isocontour level (dose_map lines of the visualization settings)
+lies within the dose range of the cell, if the cell contains the source or
+if a barrier or a shadow edge (the line from the source through the end of
+a barrier) crosses the cell. This is repeated until cells are one grid point
+wide. Shadow edges, the surroundings of the source and the isocontours are
+resolved at the full resolution, the dose in smooth regions is interpolated
+bilinearly. Grid points outside the region of interest (see region) are not
+calculated.
+
+The refinement is done in the main process, the dose of each new set of
+points is calculated with the engine (see execute.adaptive_grid_calculations)
+or directly with adaptive_dose_map.
+"""
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.grid import calculate_dose_points, cartesian_grid
+from pyshield.calculations.region import region_mask
+
+
+class AdaptiveGrid():
+    """ Refinement of the dose map of source on the display raster.
+
+    Args:
+        source:   source definition
+        scenario: Scenario with the grid settings
+
+    Example:
+        grid = AdaptiveGrid(source, scenario)
+        points = grid.points()
+        while len(points):
+            points = grid.update(calculate_dose_points(source, points))
+        dose_map = grid.dose_map()
+    """
+    def __init__(self, source, scenario):
+        X, Y = cartesian_grid(area=scenario.area,
+                              spacing=scenario.get(ps.GRIDSIZE))
+        self.grid = (X, Y)
+        self.xi, self.yi = X[0, :], Y[:, 0]
+        self.shape = X.shape
+
+        self.tolerance = scenario.get(ps.ADAPTIVE_TOLERANCE)
+        self.levels = contour_levels(scenario)
+
+        # location of the source in grid point units
+        location = source[ps.LOCATION]
+        self.source = (np.interp(location[1], self.yi,
+                                 np.arange(len(self.yi))),
+                       np.interp(location[0], self.xi,
+                                 np.arange(len(self.xi))))
+
+        # number of grid cells crossed by a barrier or shadow edge in the
+        # lower left part of the grid, see _edges
+        self.edges = _edges(source, scenario.barriers.segments, self.xi,
+                            self.yi)
+
+        self.values = np.full(self.shape, np.nan)
+        self.known = np.zeros(self.shape, dtype=bool)
+
+        # grid points outside the region of interest are NaN, cells without
+        # any grid point in the region are left out (see _children)
+        self.mask = region_mask(scenario, X, Y)
+        self.inside = None
+        if self.mask is not None:
+            self.known[~self.mask] = True
+            self.inside = np.zeros((self.shape[0] + 1, self.shape[1] + 1),
+                                   dtype=int)
+            self.inside[1:, 1:] = self.mask.cumsum(axis=0).cumsum(axis=1)
+
+        # cells to test (first row and column) and the cells that are not
+        # refined any further with their step (in grid points)
+        self.step = 2 ** int(scenario.get(ps.ADAPTIVE_LEVELS) or 0)
+        rows = np.arange(0, max(self.shape[0] - 1, 1), self.step)
+        columns = np.arange(0, max(self.shape[1] - 1, 1), self.step)
+        rows, columns = np.meshgrid(rows, columns, indexing='ij')
+        self.cells = self._in_region((rows.ravel(), columns.ravel()),
+                                     self.step)
+        self.final = []
+
+        self.evaluations = 0
+        self._pending = self._nodes()
+
+    def points(self):
+        """ Points (N, 2) for which the dose is needed """
+        rows, columns = self._pending
+        return np.stack((self.xi[columns], self.yi[rows]), axis=1)
+
+    def update(self, dose_points):
+        """ Store the dose on the points and refine the cells. Returns the
+        points for which the dose is needed next (empty when finished). """
+        rows, columns = self._pending
+        self.values[rows, columns] = dose_points
+        self.known[rows, columns] = True
+        self.evaluations += len(rows)
+
+        if self.step <= 1:
+            self.final += [(self.cells, 1)]
+            self.cells = (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+            self._pending = self.cells
+            return self.points()
+
+        half = self.step // 2
+        refine = self._refine()
+
+        # cells that are not refined are interpolated from the 3 x 3 doses
+        # in each quarter
+        keep = tuple(index[~refine] for index in self.cells)
+        self.final += [(self._children(keep, half), half)]
+
+        self.cells = self._children(tuple(index[refine] \
+                                          for index in self.cells), half)
+        self.step = half
+        self._pending = self._nodes()
+        return self.points()
+
+    def dose_map(self):
+        """ Dose map on the display raster, dose of points that were not
+        calculated is interpolated bilinearly within their cell. """
+        dose_map = np.array(self.values)
+        for (rows, columns), step in self.final:
+            if step <= 1 or not len(rows):
+                continue
+            r0, r1 = rows, self._end(rows, step, 0)
+            c0, c1 = columns, self._end(columns, step, 1)
+
+            offsets = np.arange(step + 1)
+            grid_rows = np.minimum(r0[:, None] + offsets, r1[:, None])
+            grid_columns = np.minimum(c0[:, None] + offsets, c1[:, None])
+            tr = (grid_rows - r0[:, None]) / np.maximum(r1 - r0, 1)[:, None]
+            tc = (grid_columns - c0[:, None]) / \
+                 np.maximum(c1 - c0, 1)[:, None]
+
+            corners = [self.values[r, c] for r in (r0, r1) for c in (c0, c1)]
+            tr, tc = tr[:, :, None], tc[:, None, :]
+            interpolated = (1 - tr) * (1 - tc) * corners[0][:, None, None] + \
+                           (1 - tr) * tc * corners[1][:, None, None] + \
+                           tr * (1 - tc) * corners[2][:, None, None] + \
+                           tr * tc * corners[3][:, None, None]
+
+            grid_rows = np.broadcast_to(grid_rows[:, :, None],
+                                        interpolated.shape)
+            grid_columns = np.broadcast_to(grid_columns[:, None, :],
+                                           interpolated.shape)
+            dose_map[grid_rows, grid_columns] = interpolated
+
+        dose_map[self.known] = self.values[self.known]
+        return dose_map
+
+    def _in_region(self, cells, step):
+        # cells with at least one grid point in the region of interest
+        if self.inside is None:
+            return cells
+        rows, columns = cells
+        r1 = self._end(rows, step, 0) + 1
+        c1 = self._end(columns, step, 1) + 1
+        inside = self.inside
+        count = inside[r1, c1] - inside[rows, c1] - inside[r1, columns] + \
+                inside[rows, columns]
+        return rows[count > 0], columns[count > 0]
+
+    def _end(self, start, step, axis):
+        # last grid point of cells starting at start
+        return np.minimum(start + step, self.shape[axis] - 1)
+
+    def _nodes(self):
+        # grid points of the cells (corners, or 3 x 3 if the cells are
+        # tested) for which the dose is unknown
+        rows, columns = self.cells
+        if self.step > 1:
+            half = self.step // 2
+            rows = np.stack((rows, np.minimum(rows + half,
+                                              self._end(rows, self.step, 0)),
+                             self._end(rows, self.step, 0)), axis=1)
+            columns = np.stack((columns,
+                                np.minimum(columns + half,
+                                           self._end(columns, self.step, 1)),
+                                self._end(columns, self.step, 1)), axis=1)
+        else:
+            rows = np.stack((rows, self._end(rows, 1, 0)), axis=1)
+            columns = np.stack((columns, self._end(columns, 1, 1)), axis=1)
+
+        n = rows.shape[1]
+        rows = np.repeat(rows, n, axis=1).ravel()
+        columns = np.tile(columns, (1, n)).ravel()
+
+        index = np.unique(np.ravel_multi_index((rows, columns), self.shape))
+        index = index[~self.known.ravel()[index]]
+        return np.unravel_index(index, self.shape)
+
+    def _refine(self):
+        # cells to split: interpolation error above the tolerance, an
+        # isocontour level within the dose range or the source in the cell
+        rows, columns = self.cells
+        half = self.step // 2
+        r1 = self._end(rows, self.step, 0)
+        c1 = self._end(columns, self.step, 1)
+        grid_rows = np.stack((rows, np.minimum(rows + half, r1), r1), axis=1)
+        grid_columns = np.stack((columns, np.minimum(columns + half, c1), c1),
+                                axis=1)
+
+        values = self.values[grid_rows[:, :, None], grid_columns[:, None, :]]
+
+        tr = ((grid_rows - rows[:, None]) / \
+              np.maximum(r1 - rows, 1)[:, None])[:, :, None]
+        tc = ((grid_columns - columns[:, None]) / \
+              np.maximum(c1 - columns, 1)[:, None])[:, None, :]
+        interpolated = (1 - tr) * (1 - tc) * values[:, :1, :1] + \
+                       (1 - tr) * tc * values[:, :1, 2:] + \
+                       tr * (1 - tc) * values[:, 2:, :1] + \
+                       tr * tc * values[:, 2:, 2:]
+
+        values = values.reshape(len(rows), -1)
+        interpolated = interpolated.reshape(len(rows), -1)
+
+        low, high = values.min(axis=1), values.max(axis=1)
+        with np.errstate(invalid='ignore'):
+            error = np.abs(values - interpolated).max(axis=1)
+            refine = ~(error <= self.tolerance * np.abs(high))
+
+        for level in self.levels:
+            refine |= (low < level) & (high >= level)
+
+        source_row, source_column = self.source
+        refine |= (rows <= source_row) & (source_row <= r1) & \
+                  (columns <= source_column) & (source_column <= c1)
+
+        edges = self.edges
+        refine |= (edges[r1, c1] - edges[rows, c1] - edges[r1, columns] + \
+                   edges[rows, columns]) > 0
+        return refine
+
+    def _children(self, cells, step):
+        # the four quarters (with size step) of cells, quarters outside the
+        # grid are left out
+        rows, columns = cells
+        r1 = self._end(rows, 2 * step, 0)
+        c1 = self._end(columns, 2 * step, 1)
+
+        child_rows, child_columns = [], []
+        for dr in (0, step):
+            for dc in (0, step):
+                inside = ((rows + dr < r1) | (dr == 0)) & \
+                         ((columns + dc < c1) | (dc == 0))
+                child_rows += [rows[inside] + dr]
+                child_columns += [columns[inside] + dc]
+        return self._in_region((np.concatenate(child_rows),
+                                np.concatenate(child_columns)), step)
+
+
+def _edges(source, segments, xi, yi):
+    # summed area table (len(yi), len(xi)) of the grid cells crossed by the
+    # barriers and the shadow edges of source behind each barrier end, the
+    # number of crossed cells between grid points (r0, c0) and (r1, c1) is
+    # table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+    location = np.asarray(source[ps.LOCATION], dtype=float)
+    spacing = np.array((xi[-1] - xi[0], yi[-1] - yi[0])) / \
+              np.maximum((len(xi) - 1, len(yi) - 1), 1)
+    spacing[spacing == 0] = 1
+    origin = np.array((xi[0], yi[0]))
+    size = np.hypot(*(spacing * (len(xi), len(yi))))
+
+    ends = segments.reshape(-1, 2)
+    direction = ends - location
+    length = np.hypot(direction[:, 0], direction[:, 1])
+    direction = direction / np.where(length > 0, length, 1)[:, None]
+    lines = np.concatenate((segments.reshape(-1, 2, 2),
+                            np.stack((ends, ends + size * direction), axis=1)))
+
+    # sample each line at half the grid spacing, in grid units
+    lines = (lines - origin) / spacing
+    crossed = np.zeros((len(yi) - 1, len(xi) - 1), dtype=bool)
+    for start, end in lines:
+        n = int(np.ceil(2 * np.abs(end - start).max())) + 1
+        samples = start + np.linspace(0, 1, n)[:, None] * (end - start)
+        # lines on the border of the grid are inside
+        inside = np.all((samples > -0.5) & \
+                        (samples < (len(xi) - 0.5, len(yi) - 0.5)), axis=1)
+        samples = np.floor(samples[inside]).astype(int)
+        columns = np.clip(samples[:, 0], 0, crossed.shape[1] - 1)
+        rows = np.clip(samples[:, 1], 0, crossed.shape[0] - 1)
+        crossed[rows, columns] = True
+
+    table = np.zeros((len(yi), len(xi)), dtype=int)
+    table[1:, 1:] = crossed.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def contour_levels(scenario):
+    """ Sorted isocontour levels (mSv) of the dose map in the visualization
+    settings of scenario """
+    style = (scenario.get(ps.VISUALIZATION) or {}).get(ps.DOSE_MAP, {})
+    return sorted(float(level) for level in style.get(ps.LINES, {}).keys())
+
+
+def adaptive_dose_map(source, scenario):
+    """ Dose map of source on an adaptive grid, calculated in the current
+    process.
+
+    Returns:
+        dose_map:    dose map on the display raster
+        points:      array (N, 2) with the points that were calculated
+        grid:        cartesian grid (X, Y) of the dose map
+    """
+    grid = AdaptiveGrid(source, scenario)
+    points = grid.points()
+    calculated = []
+    while len(points):
+        calculated += [points]
+        points = grid.update(calculate_dose_points(source, points, None,
+                                                   scenario))
+    return grid.dose_map(), np.concatenate(calculated), grid.grid
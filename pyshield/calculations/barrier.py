@@ -6,12 +6,16 @@ Created on Fri 2 11:50:40 2016
 """
 
 import numpy as np
-import math
+from scipy import sparse
 
 
 import pyshield as ps
+from pyshield.calculations.sweep import sweep_thickness
 DEBUG = False # supress debugging, lots of text output
 
+# maximum number of elements in the (N, M) ray - barrier intersection matrices
+MAX_MATRIX_SIZE = 2**20
+
 def sum_shielding_line(source_location, location, shielding, intersection_thickness = True):
     """ Calculates the amount of shielding between two points source_location
         and location. Shielding is a dictopnary. If intersection_thickness is True the
@@ -23,62 +27,189 @@ def sum_shielding_line(source_location, location, shielding, intersection_thickn
         Thickness is the total (summed) thickness of the material between
         source_location and location
         """
-    # Line between the source location and the specified location
-    L0 = np.array((source_location, location))
-    # list of points with intersections
-    points = []
-
-    # total amount of shielding between location and   source location
-    shielding_line = {}
-
-    #iterate over shielding all defined barriers,
-    for name, barrier in shielding.items():
-        if DEBUG:
-            ps.logger.debug('Intersection %s?', name)
-        location = np.array(barrier[ps.LOCATION])
-
-
-        #line for barrier
-        L1 = np.array((location[0:2], location[2:4]))
-
-        #check for intersection
-        p = ps.line_intersect.intersect_line(L0, L1)
-
-
-        # None: no intersection
-        # NaN: parellel lines, no intersection
-        # if p already in points list disregard this intersection.
-        # example line ((0,0),(1,0)) and line ((0,0),(0,1)) if there is an
-        # intersection at (0,0) with another then only one should count. i.e.
-        # the point list should contain unique points
-
-
-        if not(None in p) and not(np.NaN in p) and not p in points:
-            points.append(p) # valid intersection at point p
-            if DEBUG:
-                ps.logger.debug('Intersection at: ' + str(p))
-
-            # calculate the angle of intersection or assume 90 degrees
-            if intersection_thickness:
-                theta = ps.line_intersect.angle_between_lines(L0, L1)
-            else:
-                theta = 0.5 * math.pi
-
-            # Add thickness and material to the sum of the total shielding
-            # shielding is summed for each material seperately
-            for material, thickness in barrier[ps.MATERIAL].items():
-                # check if material already was found if not so add
-                # material as key
-                if not material in shielding_line.keys():
-                    shielding_line[material] = 0
-
-                # add effective thickness for material
-                eff_thickness =  thickness / math.sin(theta)
-                shielding_line[material] += eff_thickness
-                if DEBUG:
-                    ps.logger.debug('Eff. Thickness of barrier: %s', eff_thickness)
-
-    return shielding_line
+    shielding_lines = sum_shielding_lines(source_location, [location],
+                                          shielding, intersection_thickness)
+
+    return dict([(material, float(thickness[0])) \
+                 for material, thickness in shielding_lines.items()])
+
+def sum_shielding_lines(source_location, locations, shielding,
+                        intersection_thickness = True, index = None,
+                        sweep = False):
+    """ Vectorized version of sum_shielding_line. Calculates the amount of
+        shielding between source_location and each of the N locations
+        (array with shape (N, 2)). Returns a dictionary:
+
+        {MATERIAL1: THICKNESS1, MATERIAL2: THICKNESS2,...}
+
+        THICKNESS is an array with the total (summed) thickness of the
+        material between source_location and each location.
+
+        If a spatial index (BarrierIndex) is given, each location is only
+        tested against the barriers that can be crossed. If sweep is True the
+        angular sweep engine is used instead (see sweep.py).
+        """
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+
+    segments, materials, thickness = barrier_arrays(shielding)
+
+    if sweep:
+        sum_thickness, used = sweep_thickness(source_location, locations,
+                                              segments, thickness,
+                                              intersection_thickness,
+                                              MAX_MATRIX_SIZE)
+        return dict([(material, sum_thickness[:, i]) \
+                     for i, material in enumerate(materials) if used[i]])
+
+    sum_thickness = np.zeros((len(locations), len(materials)))
+    # materials of barriers that were hit at least once
+    used = np.zeros(len(materials), dtype=bool)
+
+    # limit memory use of the (N, M) intersection matrices
+    step = max(1, MAX_MATRIX_SIZE // max(1, len(segments)))
+
+    if index is None:
+        chunks = ((slice(start, start + step), slice(None)) \
+                  for start in range(0, len(locations), step))
+    else:
+        chunks = index.ray_chunks(source_location, locations, max_rows=step)
+
+    for rows, cols in chunks:
+        hit, factor = ps.line_intersect.intersect_rays(source_location,
+                                                       locations[rows],
+                                                       segments[cols],
+                                                       intersection_thickness)
+        # effective thickness summed for each material seperately
+        sum_thickness[rows] = factor.dot(thickness[cols])
+        used |= (hit.any(axis=0)[:, np.newaxis] & \
+                 (thickness[cols] > 0)).any(axis=0)
+
+    return dict([(material, sum_thickness[:, i]) \
+                 for i, material in enumerate(materials) if used[i]])
+
+def crossing_matrix(source_location, locations, segments,
+                    intersection_thickness = True, index = None):
+    """ Barriers crossed by the line from source_location to each of the N
+        locations. segments is an array (M, 4) with the barrier locations.
+
+        Returns a sparse (N, M) matrix (csr) with the path length factor
+        through each crossed barrier (see intersect_rays), multiplying with
+        a (M, K) thickness matrix gives the effective thickness of each
+        material for each location.
+        """
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+
+    step = max(1, MAX_MATRIX_SIZE // max(1, len(segments)))
+    if index is None:
+        chunks = ((slice(start, start + step), slice(None)) \
+                  for start in range(0, len(locations), step))
+    else:
+        chunks = index.ray_chunks(source_location, locations, max_rows=step)
+
+    all_rows, all_cols, all_factors = [], [], []
+    for rows, cols in chunks:
+        hit, factor = ps.line_intersect.intersect_rays(source_location,
+                                                       locations[rows],
+                                                       segments[cols],
+                                                       intersection_thickness)
+        i, j = np.nonzero(hit)
+        all_rows += [np.arange(len(locations))[rows][i]]
+        all_cols += [np.arange(len(segments))[cols][j]]
+        all_factors += [factor[i, j]]
+
+    if not all_rows:
+        return sparse.csr_matrix((len(locations), len(segments)))
+
+    return sparse.csr_matrix((np.concatenate(all_factors),
+                              (np.concatenate(all_rows),
+                               np.concatenate(all_cols))),
+                             shape=(len(locations), len(segments)))
+
+def sum_shielding_rays(source_location, angles, ray_index, distances,
+                       shielding, intersection_thickness = True):
+    """ Calculates the amount of shielding between source_location and N
+        locations that lie on rays from the source (polar grid). Each ray
+        is intersected once with all barriers, the shielding for a location
+        is the cumulative shielding along its ray up to the location.
+
+        angles:     angle of each ray, the direction of a ray is
+                    (sin(angle), cos(angle))
+        ray_index:  array (N, ) index of the ray for each location
+        distances:  array (N, ) distance of each location to the source
+
+        Returns a dictionary as sum_shielding_lines.
+        """
+    source_location = np.asarray(source_location, dtype=float)
+    angles = np.asarray(angles, dtype=float)
+    ray_index = np.asarray(ray_index, dtype=int)
+    distances = np.asarray(distances, dtype=float)
+
+    segments, materials, thickness = barrier_arrays(shielding)
+
+    sum_thickness = np.zeros((len(distances), len(materials)))
+    used = np.zeros(len(materials), dtype=bool)
+
+    # rays end at the location furthest away from the source
+    length = np.zeros(len(angles))
+    np.maximum.at(length, ray_index, distances)
+    rays = np.flatnonzero(length > 0)
+
+    ends = source_location + length[rays, np.newaxis] * \
+           np.stack((np.sin(angles[rays]), np.cos(angles[rays])), axis=1)
+
+    step = max(1, MAX_MATRIX_SIZE // max(1, len(segments)))
+    for start in range(0, len(rays), step):
+        part = slice(start, start + step)
+        hit, factor, points = ps.line_intersect.intersect_rays(
+            source_location, ends[part], segments, intersection_thickness,
+            return_points=True)
+        used |= (hit.any(axis=0)[:, np.newaxis] & \
+                 (thickness > 0)).any(axis=0)
+
+        # effective thickness of each hit ordered by distance along the ray
+        rows, cols = np.nonzero(hit)
+        hit_distance = np.hypot(*(points[rows, cols] - source_location).T)
+        order = np.lexsort((hit_distance, rows))
+        rows, cols = rows[order], cols[order]
+        hit_distance = hit_distance[order]
+        cumulative = np.cumsum(factor[rows, cols, np.newaxis] * \
+                               thickness[cols], axis=0)
+        cumulative = np.concatenate((np.zeros((1, len(materials))),
+                                     cumulative))
+
+        # locations on the rays of this part
+        ray_of = np.full(len(angles), -1)
+        ray_of[rays[part]] = np.arange(len(rays[part]))
+        select = np.flatnonzero(ray_of[ray_index] >= 0)
+        local = ray_of[ray_index[select]]
+
+        # number of hits before each ray and up to each location
+        first = np.searchsorted(rows, local, side='left')
+        scale = length.max() * 2 + 1
+        last = np.searchsorted(rows * scale + hit_distance,
+                               local * scale + distances[select],
+                               side='right')
+        sum_thickness[select] = cumulative[last] - cumulative[first]
+
+    return dict([(material, sum_thickness[:, i]) \
+                 for i, material in enumerate(materials) if used[i]])
+
+def barrier_arrays(barriers):
+    """ Convert a dictionary with barriers to arrays. For a BarrierSet its
+    arrays are returned.
+
+    Returns:
+        segments:  array (M, 4) with the location (x0, y0, x1, y1) of each
+                   barrier
+        materials: tuple with all K materials used by the barriers
+        thickness: array (M, K) with the thickness of each material for
+                   each barrier
+    """
+    if not hasattr(barriers, 'segments'):
+        barriers = ps.sets.BarrierSet.from_dict(barriers)
+
+    return barriers.segments, barriers.materials, barriers.thickness
 
 
 
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Isocontours of the summed dose without a dose map.
+
+Rays are cast from each source location at number_of_angles equidistant
+angles. A ray ends at the floor plan border or halfway to another source
+location (the border of the Voronoi cell of the source), so each part of a
+contour is traced from the nearest source. The summed dose of all sources is
+calculated on a few radii per ray (geometric spacing), each interval where
+the dose crosses a level is bisected until it is smaller than tolerance.
+The cost is (rays x (samples + bisection steps)) dose evaluations, instead of
+one evaluation per pixel of a dose map.
+
+Crossings with the same index (counted from the source) on neighbouring rays
+are connected to polylines. A contour that crosses a ray more than once
+between two samples is missed for that ray.
+"""
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.adaptive import contour_levels
+from pyshield.calculations.point_dose import dose_matrix
+from pyshield.calculations.scenario import compile_scenario
+
+
+def trace_contours(levels=None, scenario=None, n_angles=None, n_samples=32,
+                   tolerance=1, dose=None):
+    """ Polylines where the summed dose of all sources equals each level.
+
+    Args:
+        levels:    dose levels in mSv, by default the isocontour levels of
+                   the dose map (dose_map lines in the visualization settings)
+        scenario:  Scenario, by default for the current configuration
+        n_angles:  rays per source location, default number_of_angles
+        n_samples: radii per ray on which the dose is calculated before
+                   bisection
+        tolerance: accuracy of the contour location in cm
+        dose:      function returning the summed dose (N, ) for points
+                   (N, 2), by default point_dose.dose_matrix is used
+
+    Returns:
+        dictionary with for each level a list of polylines (arrays (K, 2)),
+        closed polylines end with their first point.
+    """
+    if scenario is None:
+        scenario = compile_scenario()
+    if levels is None:
+        levels = contour_levels(scenario)
+    if n_angles is None:
+        n_angles = scenario.get(ps.NANGLES)
+    if dose is None:
+        dose = lambda points: dose_matrix(points, scenario).sum(axis=1)
+
+    levels = np.asarray(levels, dtype=float)
+    centers = np.unique(scenario.sources.locations, axis=0)
+    angles = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
+    directions = np.stack((np.sin(angles), np.cos(angles)), axis=1)
+
+    # rays (center, angle) with the largest radius
+    ray_center = np.repeat(np.arange(len(centers)), n_angles)
+    ray_direction = np.tile(directions, (len(centers), 1))
+    r_max = _ray_length(centers, directions, scenario.area).ravel()
+    r_min = np.minimum(tolerance, r_max)
+
+    # dose on geometrically spaced radii for each ray
+    fraction = np.linspace(0, 1, n_samples)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radii = r_min[:, None] * (r_max / r_min)[:, None] ** fraction
+    radii[r_max <= 0] = 0
+    samples = dose(_locations(centers, ray_center, ray_direction, radii))
+    samples = samples.reshape(radii.shape)
+
+    # intervals (ray, sample) in which a level is crossed
+    above = samples[:, :, None] >= levels
+    ray, sample, level = np.nonzero(above[:, :-1] != above[:, 1:])
+    low, high = radii[ray, sample], radii[ray, sample + 1]
+    inner_above = above[ray, sample, level]
+
+    # bisection of all intervals at once
+    while len(ray) and np.max(high - low) > tolerance:
+        middle = (low + high) / 2
+        middle_above = dose(_locations(centers, ray_center[ray],
+                                       ray_direction[ray], middle[:, None]))
+        middle_above = middle_above >= levels[level]
+        same = middle_above == inner_above
+        low = np.where(same, middle, low)
+        high = np.where(same, high, middle)
+
+    radius = (low + high) / 2
+    points = _locations(centers, ray_center[ray], ray_direction[ray],
+                        radius[:, None])
+
+    contours = {}
+    for i, value in enumerate(levels):
+        polylines = []
+        for center in range(len(centers)):
+            selected = (level == i) & (ray_center[ray] == center)
+            polylines += _polylines(ray[selected] % n_angles,
+                                    radius[selected], points[selected],
+                                    n_angles)
+        contours[float(value)] = polylines
+    return contours
+
+
+def _ray_length(centers, directions, area):
+    # (centers x directions) distance from each center to the floor plan
+    # border or the bisector with another center, whichever is nearest
+    lengths = np.full((len(centers), len(directions)), np.inf)
+    for axis in (0, 1):
+        low, high = area[axis]
+        step = directions[:, axis]
+        with np.errstate(divide='ignore'):
+            to_high = (high - centers[:, axis, None]) / step
+            to_low = (low - centers[:, axis, None]) / step
+        border = np.where(step > 0, to_high, np.where(step < 0, to_low,
+                                                      np.inf))
+        lengths = np.minimum(lengths, border)
+
+    for i, center in enumerate(centers):
+        offset = centers - center
+        distance = np.sum(offset ** 2, axis=1)
+        projection = directions.dot(offset.T)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bisector = np.where(projection > 0,
+                                distance / (2 * projection), np.inf)
+        lengths[i] = np.minimum(lengths[i], bisector.min(axis=1))
+    return np.maximum(lengths, 0)
+
+
+def _locations(centers, ray_center, ray_direction, radii):
+    # points (N * K, 2) on rays at radii (N, K)
+    points = centers[ray_center][:, None, :] + \
+             radii[:, :, None] * ray_direction[:, None, :]
+    return points.reshape(-1, 2)
+
+
+def _polylines(angle, radius, points, n_angles):
+    # connect the n-th crossing (ordered by radius) of neighbouring rays of
+    # a single center to polylines
+    order = np.lexsort((radius, angle))
+    angle, points = angle[order], points[order]
+    first = np.searchsorted(angle, angle)
+    index = np.arange(len(angle)) - first
+
+    polylines = []
+    for n in np.unique(index):
+        selected = index == n
+        line_angles, line_points = angle[selected], points[selected]
+        if len(line_angles) == n_angles:
+            polylines += [np.append(line_points, line_points[:1], axis=0)]
+            continue
+        # split where a ray has no n-th crossing, join the last and first
+        # part if they meet at angle 0
+        breaks = np.flatnonzero(np.diff(line_angles) > 1) + 1
+        parts = np.split(np.arange(len(line_angles)), breaks)
+        if len(parts) > 1 and line_angles[0] == 0 and \
+           line_angles[-1] == n_angles - 1:
+            parts = [np.append(parts[-1], parts[0])] + parts[1:-1]
+        polylines += [line_points[part] for part in parts if len(part) > 1]
+    return polylines
@@ -10,87 +10,280 @@ from scipy.interpolate import griddata
 
 import pyshield as ps
 
-from pyshield.calculations.isotope import calc_dose_source_at_location
+from pyshield.calculations.isotope import calc_dose_source_at_locations, \
+                                          dose_from_shielding, transmission_sum
+from pyshield.calculations.barrier import sum_shielding_rays, add_barriers
+from pyshield.calculations.spatial_index import get_barrier_index
+from pyshield.calculations.resample import get_resampler
+from pyshield.calculations.region import region_mask
+from pyshield.calculations.scenario import compile_scenario
 
 
-def calculate_dose_map_for_source(source):
+def calculate_dose_map_for_source(source, scenario=None):
     """ Calculate a dose map in mSv for a specified source. Dose map is
     calculated on a grid, grid type and size is specified in the application
-    configuration (data and prefs) """
-
+    configuration (data and prefs). By default the scenario is compiled from
+    the current configuration. """
 
     ps.logger.debug('Material:  %s', source.get(ps.MATERIAL, {}))
 
+    if scenario is None:
+        scenario = compile_scenario()
 
-    barriers = ps.config.get_setting(ps.BARRIERS)
+    if scenario.get(ps.GRID) == ps.ADAPTIVE:
+        # refined grid, the dose map is on the cartesian grid
+        from pyshield.calculations.adaptive import adaptive_dose_map
+        return adaptive_dose_map(source, scenario)
 
-    part_config_items = (ps.FLOOR,
-                         ps.HEIGHT,
-                         ps.DISABLE_BUILDUP,
-                         ps.INTERSECTION_THICKNESS)
+    # obtain grid points for the specified source
+    points, grid, polar, resampler = source_grid(source, scenario)
 
-    kwargs = dict([(key, ps.config.get_setting(key)) for key in part_config_items])
+    # calculate the dose for all grid points in a single pass
+    dose_points = calculate_dose_points(source, points, polar, scenario)
 
+    dose_map = dose_points_to_map(dose_points, points, grid, resampler,
+                                  scenario)
+
+    return (dose_map, points, grid)
 
+
+def source_grid(source, scenario):
+    """ Points for which the dose of source is needed to create a dose map.
+
+    Returns:
+        points:    array (N, 2) with the locations
+        grid:      cartesian grid (X, Y) of the dose map
+        polar:     for polar grids the ray index and radius of each point and
+                   the angle of each ray, None otherwise
+        resampler: PolarResampler if polar points are resampled bilinearly,
+                   None otherwise
+    """
     if not(isinstance(source[ps.TYPE], (list, tuple))):
        source[ps.TYPE] = [source[ps.TYPE]]
 
     if not(ps.ISOTOPE in source[ps.TYPE]):
         raise KeyError('Unknown source type: {0}'.format(source[ps.TYPE]))
 
-    calc_dose = lambda loc: calc_dose_source_at_location(source,
-                                                         loc,
-                                                         barriers,
-                                                         **kwargs)
-    # obtain grid points for the specified source
-    points, grid = grid_points(source)
+    resampler = None
+    if scenario.get(ps.GRID) == ps.POLAR and \
+       scenario.get(ps.POLAR_INTERPOLATION) == ps.BILINEAR:
+        # only polar samples needed for the cartesian grid are calculated
+        resampler, grid = polar_resampler(source, scenario)
+        mask = region_mask(scenario, *grid)
+        used = resampler.used(mask)
+        points = resampler.points(mask)
+        polar = (resampler.ray_index[used], resampler.radius[used],
+                 resampler.angles)
+    else:
+        points, grid, polar = grid_points(source, return_polar=True,
+                                          scenario=scenario)
+
+    return points, grid, polar, resampler
+
+
+def calculate_dose_points(source, points, polar=None, scenario=None):
+    """ Dose in mSv for source on points (array (N, 2)). For points on a polar
+    grid polar contains the ray index and radius of each point and the angle
+    of each ray (see source_grid), the polar_rays engine requires polar.
+
+    If dose_floor is set, points where the dose without barriers (see
+    dose_bound) is below the dose floor of a source (see source_floor) get
+    this upper bound as dose, the barriers are only intersected for the
+    other points. """
+    if scenario is None:
+        scenario = compile_scenario()
+
+    dose_floor = source_floor(scenario)
+    if not dose_floor:
+        return _dose_points(source, points, polar, scenario)
+
+    dose = dose_bound(source, points, scenario)
+    rows = np.flatnonzero(dose >= dose_floor)
+    ps.logger.debug('%s of %s points below dose floor',
+                    len(dose) - len(rows), len(dose))
+    if len(rows):
+        if polar is not None:
+            ray_index, radius, angles = polar
+            polar = (ray_index[rows], radius[rows], angles)
+        dose[rows] = _dose_points(source, points[rows], polar, scenario)
+    return dose
+
+
+def source_floor(scenario):
+    """ Dose floor in mSv for a single source: dose_floor divided by the
+    number of sources, so the summed dose map is at most dose_floor too
+    high. Returns 0 if dose_floor is not set. """
+    dose_floor = scenario.get(ps.DOSE_FLOOR)
+    if not dose_floor or not len(scenario.sources):
+        return 0
+    return dose_floor / len(scenario.sources)
+
+
+def dose_bound(source, points, scenario):
+    """ Upper bound of the dose in mSv for source on points: the dose
+    without barriers (shielding of the source and floor included). With
+    buildup a thin barrier can raise the dose, for each barrier material the
+    largest transmission through any thickness is used (see
+    PhysicsCache.max_transmission). """
+    physics = scenario.physics
+    isotope = source[ps.ISOTOPE]
+    disable_buildup = scenario.get(ps.DISABLE_BUILDUP)
+    materials = scenario.barriers.materials
+
+    # transmission for each photon energy, shielding of the source and floor
+    # in a barrier material is covered by the largest transmission
+    shielding = add_barriers(dict(source.get(ps.MATERIAL, {})),
+                             scenario.get(ps.FLOOR) or {})
+    shielding = dict([(material, thickness) for material, thickness \
+                      in shielding.items() if material not in materials])
+    t = transmission_sum(shielding, isotope, disable_buildup, physics)
+    for material in materials:
+        t = t * physics.max_transmission(isotope, material, disable_buildup)
+
+    unshielded = dose_from_shielding({**source, ps.MATERIAL: {}}, points, {},
+                                     height=scenario.get(ps.HEIGHT),
+                                     disable_buildup=disable_buildup,
+                                     physics=physics)
+    return unshielded * physics.dose_rate(isotope, t) / \
+        physics.dose_rate(isotope, np.ones(len(t)))
+
+
+def tile_bound(source, points, scenario):
+    """ Upper bound of the dose in mSv for source on all points: the dose
+    without barriers at the nearest location of the bounding box of the
+    points. """
+    location = np.asarray(source[ps.LOCATION], dtype=float)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    nearest = np.clip(location, points.min(axis=0), points.max(axis=0))
+    return float(dose_bound(source, nearest, scenario)[0])
+
+
+def _dose_points(source, points, polar, scenario):
+    # dose in mSv for source on points, see calculate_dose_points
+    barriers = scenario.barriers
 
-    # pre allocate memory for dose points
-    dose_points = np.zeros(len(points))
+    part_config_items = (ps.FLOOR,
+                         ps.HEIGHT,
+                         ps.DISABLE_BUILDUP,
+                         ps.INTERSECTION_THICKNESS)
+
+    kwargs = dict([(key, scenario.get(key)) for key in part_config_items])
+    kwargs['physics'] = scenario.physics
+
+    engine = scenario.get(ps.GRID_ENGINE)
+
+    if engine == ps.POLAR_RAYS and polar is not None:
+        # intersect each ray of the polar grid once with all barriers
+        ray_index, radius, angles = polar
+        sum_shielding = sum_shielding_rays(source[ps.LOCATION], angles,
+                                           ray_index, radius, barriers,
+                                           kwargs[ps.INTERSECTION_THICKNESS])
+
+        return dose_from_shielding(source, points, sum_shielding,
+                                   height=kwargs[ps.HEIGHT],
+                                   disable_buildup=kwargs[ps.DISABLE_BUILDUP],
+                                   floor=kwargs[ps.FLOOR],
+                                   physics=scenario.physics)
+
+    if engine == ps.SWEEP:
+        kwargs['sweep'] = True
+    elif scenario.get(ps.SPATIAL_INDEX) and len(barriers):
+        kwargs['index'] = get_barrier_index(barriers.segments)
+
+    return calc_dose_source_at_locations(source, points, barriers, **kwargs)
 
-    for i, point in enumerate(points):
-        dose_points[i] = calc_dose(point)
 
-    # resample dose points to a cartesian grid
-    if ps.config.get_setting(ps.GRID) == ps.CARTESIAN:
+def dose_points_to_map(dose_points, points, grid, resampler, scenario):
+    """ Resample dose_points (calculated for points) to the cartesian grid,
+    grid points outside the region of the scenario are NaN """
+    grid_type = scenario.get(ps.GRID)
+    mask = region_mask(scenario, *grid)
+
+    if grid_type == ps.CARTESIAN:
         # points already on cartesian grid
-        dose_map = dose_points.reshape(grid[0].shape)
-    if ps.config.get_setting(ps.GRID) == ps.POLAR:
+        if mask is None:
+            dose_map = dose_points.reshape(grid[0].shape)
+        else:
+            dose_map = np.full(grid[0].shape, np.nan)
+            dose_map[mask] = dose_points
+    elif resampler is not None:
+        # bilinear interpolation in angle and radius
+        dose_map = resampler.resample(dose_points, mask)
+    elif grid_type == ps.POLAR:
         # interpolate dose_points to rectangular grid
         dose_map = griddata(points, dose_points, grid)
+        if mask is not None:
+            dose_map[~mask] = np.nan
 
-    return (dose_map, points, grid)
+    return dose_map
 
 
-def grid_points(source):
-    """ Create a grid and list of points based on set preferences """
-    grid_type       = ps.config.get_setting(ps.GRID)
-    scale           = ps.config.get_setting(ps.SCALE)
+def grid_tiles(source, points, polar, scenario, tile_size=10000):
+    """ Split the points of source in tiles with at most tile_size points.
+    Points are ordered row by row (cartesian) or ray by ray (polar), so each
+    tile is spatially coherent.
 
-    source_location = np.array(source[ps.LOCATION])
+    Returns a list with for each tile (rows, polar, cost). rows is a slice
+    of points, polar the polar information for the tile (or None) and cost
+    an estimate of the calculation time (number of points times the number
+    of barriers that can be crossed) used for load balancing.
+    """
+    index = None
+    if len(scenario.barriers):
+        index = get_barrier_index(scenario.barriers.segments)
+
+    tiles = []
+    for start in range(0, len(points), tile_size):
+        rows = slice(start, start + tile_size)
+
+        tile_polar = None
+        if polar is not None:
+            ray_index, radius, angles = polar
+            tile_polar = (ray_index[rows], radius[rows], angles)
+
+        n_barriers = 0
+        if index is not None:
+            n_barriers = len(index.query_rays(source[ps.LOCATION],
+                                              points[rows]))
+        cost = len(points[rows]) * (1 + n_barriers)
 
-    origin          = np.array(ps.config.get_setting(ps.ORIGIN))
-    floor_plan      = ps.config.get_setting(ps.FLOOR_PLAN)
-    matrix_size     = np.array(floor_plan.shape)
-    grid_spacing    = ps.config.get_setting(ps.GRIDSIZE)
-    span            = matrix_size[0:2] * scale
+        tiles.append((rows, tile_polar, cost))
+    return tiles
 
-    area = ((-origin[0], span[1] - origin[0]),
-            (-origin[1], span[0] - origin[1]))
+
+def grid_points(source, return_polar=False, scenario=None):
+    """ Create a grid and list of points based on set preferences. If
+    return_polar is True, for a polar grid the ray index and distance to the
+    source of each point and the angle of each ray are returned as well."""
+    if scenario is None:
+        scenario = compile_scenario()
+
+    grid_type       = scenario.get(ps.GRID)
+
+    source_location = np.array(source[ps.LOCATION])
+
+    origin          = np.array(scenario.get(ps.ORIGIN))
+    grid_spacing    = scenario.get(ps.GRIDSIZE)
+    area, span      = scenario.area, scenario.span
 
     ps.logger.debug('area: %s', area)
     X, Y = cartesian_grid(area=area, spacing=grid_spacing)
 
     if grid_type == 'cartesian':
         points = np.stack((X.flatten(), Y.flatten())).T
+        mask = region_mask(scenario, X, Y)
+        if mask is not None:
+            # only points in the region of interest
+            points = points[mask.ravel()]
 
     elif grid_type == ps.POLAR:
-        n_angles = ps.config.get_setting(ps.NANGLES)
+        n_angles = scenario.get(ps.NANGLES)
 
-        points = polar_points(r_spacing=grid_spacing,
-                              n_angles=n_angles,
-                              span=span,
-                              origin=origin - source_location)
+        points, polar = polar_points(r_spacing=grid_spacing,
+                                     n_angles=n_angles,
+                                     span=span,
+                                     origin=origin - source_location,
+                                     return_polar=True)
 
         points[:, 0] += origin[0]
         points[:, 1] += origin[1]
@@ -103,11 +296,35 @@ def grid_points(source):
 
         points = points[np.logical_not(outside_bounds), :]
 
+        ray_index, radius, angles = polar
+        polar = (ray_index[np.logical_not(outside_bounds)],
+                 radius[np.logical_not(outside_bounds)],
+                 angles)
+
     else:
         print('Cannot make grid for: {0}'.format(grid_type))
         raise KeyError
+
+    if return_polar:
+        if grid_type != ps.POLAR:
+            polar = None
+        return (points, (X, Y), polar)
     return (points, (X, Y))
 
+def polar_resampler(source, scenario):
+    """ Return a (cached) PolarResampler from the polar grid around source to
+    the cartesian grid and the cartesian grid. """
+    grid_spacing    = scenario.get(ps.GRIDSIZE)
+    n_angles        = scenario.get(ps.NANGLES)
+    area, span      = scenario.area, scenario.span
+
+    X, Y = cartesian_grid(area=area, spacing=grid_spacing)
+    ri, theta_i = polar_axes(r_spacing=grid_spacing, n_angles=n_angles,
+                             span=span)
+
+    resampler = get_resampler(source[ps.LOCATION], ri, theta_i, X, Y)
+    return resampler, (X, Y)
+
 def cartesian_grid(area=((0, 100), (0, 100)), spacing=1):
     """returns a list of points of equally spaced points for a given area """
 
@@ -122,9 +339,29 @@ def cartesian_grid(area=((0, 100), (0, 100)), spacing=1):
     return X, Y
 
 def polar_points(r_spacing, n_angles=100, origin=(0, 0), span=(10, 10),
-                 grid='quadratic'):
+                 grid='quadratic', return_polar=False):
+    """ Points on rays from the origin. If return_polar is True the index of
+    the ray and the distance to the origin of each point and the angle
+    of each ray are returned as well. Angles are measured from the y-axis
+    clockwise, x = r * sin(angle) and y = r * cos(angle). """
+
+    ri, theta_i = polar_axes(r_spacing, n_angles=n_angles, span=span,
+                             grid=grid)
+
+    R, Theta = np.meshgrid(ri, theta_i)
 
+    X, Y = ((R * np.sin(Theta))  - origin[0],
+            (R * np.cos(Theta))  - origin[1])
+
+    points = np.stack((X.flatten(), Y.flatten())).T
 
+    if return_polar:
+        ray_index = np.repeat(np.arange(len(theta_i)), len(ri))
+        return points, (ray_index, R.flatten(), theta_i)
+    return points
+
+def polar_axes(r_spacing, n_angles=100, span=(10, 10), grid='quadratic'):
+    """ Radii and angles of the polar grid """
     rmax = (span[0] **2 + span[1]**2) ** 0.5
 
     if grid.lower() == 'quadratic':
@@ -137,20 +374,23 @@ def polar_points(r_spacing, n_angles=100, origin=(0, 0), span=(10, 10),
 
     theta_i = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
 
-    R, Theta = np.meshgrid(ri, theta_i)
-
-    X, Y = ((R * np.sin(Theta))  - origin[0],
-            (R * np.cos(Theta))  - origin[1])
-
-    points = np.stack((X.flatten(), Y.flatten())).T
-
-    return points
+    return ri, theta_i
 
 def sum_dose_maps(dose_maps):
     """ sum a collection of dose maps to obtain the total dose """
     ps.logger.debug('Summing %s dose_maps', len(dose_maps))
-    dose_maps = np.stack(dose_maps)
-    return np.nansum(dose_maps, axis=0)
+    summed = None
+    for dose_map in dose_maps:
+        summed = add_dose_map(summed, dose_map)
+    return summed
+
+def add_dose_map(summed, dose_map):
+    """ Add dose_map to the summed dose map in place, NaN values count as
+    zero. If summed is None a new summed dose map is returned. """
+    if summed is None:
+        summed = np.zeros(np.shape(dose_map))
+    np.add(summed, dose_map, out=summed, where=~np.isnan(dose_map))
+    return summed
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental grid calculations after barrier edits.
+
+For each source the grid points, the dose on the points and the barriers
+crossed by the line from the source to each point (sparse crossing matrix,
+see barrier.crossing_matrix) are kept from the previous run. When barriers
+are edited (thickness, material, moved end points, added or removed) only
+the points whose line crosses an edited barrier, before or after the edit,
+are calculated again and the dose map is patched. If only the thickness or
+material of a barrier changed the crossings stay the same, the dose of the
+affected points follows from the crossing matrix without any geometry
+(ObliquityMatrix). dose_map evaluates other thicknesses the same way.
+
+Everything else that determines the dose map (source, settings, physics
+data) must be unchanged, otherwise the map is calculated from scratch. The
+data is kept in memory for the current python session.
+"""
+import numpy as np
+from scipy import sparse
+
+import pyshield as ps
+from pyshield.calculations.barrier import crossing_matrix
+from pyshield.calculations.grid import calculate_dose_points, dose_bound, \
+                                       dose_points_to_map, source_floor
+from pyshield.calculations.map_cache import material_key, source_key
+from pyshield.calculations.obliquity import ObliquityMatrix
+from pyshield.calculations.spatial_index import get_barrier_index
+
+# IncrementalMap of each source from the previous run
+_STATE = {}
+
+
+class IncrementalMap():
+    """ Grid, dose and crossed barriers of a source from a previous run.
+
+    Args:
+        key:         source_key of the source without barriers
+        points:      array (N, 2) with the grid points
+        grid:        grid of the dose map (see source_grid)
+        resampler:   PolarResampler or None
+        dose_points: array (N, ) dose on the points
+        barriers:    BarrierSet used for the calculation
+        crossings:   sparse (N, M) crossing matrix for barriers
+        materials:   dictionary with material_key of the barrier materials
+        scenario:    Scenario of the calculation
+    """
+    def __init__(self, key, points, grid, resampler, dose_points, barriers,
+                 crossings, materials, scenario):
+        self.key = key
+        self.points = points
+        self.grid = grid
+        self.resampler = resampler
+        self.dose_points = dose_points
+        self.barriers = barriers
+        self.crossings = crossings
+        self.materials = materials
+        self.scenario = scenario
+
+
+def store_map(name, source, scenario, points, grid, resampler, dose_points):
+    """ Keep the grid and dose of source name for incremental updates """
+    barriers = scenario.barriers
+    crossings = crossing_matrix(source[ps.LOCATION], points,
+                                barriers.segments,
+                                scenario.get(ps.INTERSECTION_THICKNESS),
+                                index=_index(barriers))
+
+    materials = dict([(material, material_key(material, scenario.physics)) \
+                      for material in barriers.materials])
+
+    _STATE[name] = IncrementalMap(source_key(source, scenario, False), points,
+                                  grid, resampler, np.array(dose_points),
+                                  barriers, crossings, materials, scenario)
+
+
+def update_map(name, source, scenario):
+    """ Dose map for source name after barrier edits, only points affected by
+    edited barriers are calculated. Returns None if there is no previous
+    run for the source or anything but the barriers changed. """
+    state = _STATE.get(name)
+    if state is None or state.key != source_key(source, scenario, False):
+        return None
+
+    physics = scenario.physics
+    for material, key in state.materials.items():
+        if material in physics.materials.keys() and \
+           material_key(material, physics) != key:
+            return None
+
+    barriers = scenario.barriers
+    old_moved, new_moved, old_edited = changed_barriers(state.barriers,
+                                                        barriers)
+    intersection_thickness = scenario.get(ps.INTERSECTION_THICKNESS)
+    crossings = state.crossings.tocsc()
+
+    # points crossing a moved or removed barrier before the edit, or a moved
+    # or added barrier after the edit
+    moved = np.zeros(len(state.points), dtype=bool)
+    moved[crossings[:, old_moved].indices] = True
+    if len(new_moved):
+        columns = crossing_matrix(source[ps.LOCATION], state.points,
+                                  barriers.segments[new_moved],
+                                  intersection_thickness)
+        moved[columns.tocsc().indices] = True
+
+    # points crossing a barrier with a new thickness or material only, the
+    # crossings do not change
+    edited = np.zeros(len(state.points), dtype=bool)
+    edited[crossings[:, old_edited].indices] = True
+    edited &= ~moved
+
+    moved, edited = np.flatnonzero(moved), np.flatnonzero(edited)
+
+    names = set(state.barriers.names[i] for i in old_moved + old_edited) | \
+            set(barriers.names[i] for i in new_moved)
+    ps.logger.info('{0}: {1} barriers edited, {2} of {3} points affected'\
+                   .format(name, len(names), len(moved) + len(edited),
+                           len(state.points)))
+
+    # crossing matrix for the new barriers, rows of points affected by
+    # moved barriers are calculated again for all barriers
+    crossings = _remap_columns(state.crossings, state.barriers, barriers)
+    if len(moved):
+        keep = ~np.isin(crossings.row, moved)
+        update = crossing_matrix(source[ps.LOCATION], state.points[moved],
+                                 barriers.segments, intersection_thickness,
+                                 index=_index(barriers)).tocoo()
+        crossings = sparse.coo_matrix(
+            (np.concatenate((crossings.data[keep], update.data)),
+             (np.concatenate((crossings.row[keep], moved[update.row])),
+              np.concatenate((crossings.col[keep], update.col)))),
+            shape=crossings.shape)
+    state.crossings = crossings.tocsr()
+
+    if len(moved):
+        state.dose_points[moved] = calculate_dose_points(
+            source, state.points[moved], None, scenario)
+    if len(edited):
+        # no geometry needed, only the new thickness
+        matrix = ObliquityMatrix(source, state.points, scenario,
+                                 state.crossings)
+        dose = matrix.dose(rows=edited)
+        dose_floor = source_floor(scenario)
+        if dose_floor:
+            # points below the dose floor get the upper bound, as in
+            # calculate_dose_points
+            bound = dose_bound(source, state.points[edited], scenario)
+            dose = np.where(bound < dose_floor, bound, dose)
+        state.dose_points[edited] = dose
+
+    state.barriers = barriers
+    state.scenario = scenario
+    state.materials = dict([(material, material_key(material, physics)) \
+                            for material in barriers.materials])
+
+    return dose_points_to_map(state.dose_points, state.points, state.grid,
+                              state.resampler, scenario)
+
+
+def obliquity_matrix(name):
+    """ ObliquityMatrix for the grid points of source name from the last
+    run, or None. Use it to evaluate the dose for other barrier thicknesses
+    without any geometry calculations, see dose_map. """
+    state = _STATE.get(name)
+    if state is None:
+        return None
+    source = state.scenario.sources[name]
+    return ObliquityMatrix(source, state.points, state.scenario,
+                           state.crossings)
+
+
+def dose_map(name, changes):
+    """ Dose map of source name from the last run with changed barrier
+    thicknesses. changes is a dictionary {barrier name: {material:
+    thickness}}, see ObliquityMatrix.thickness. """
+    matrix = obliquity_matrix(name)
+    if matrix is None:
+        raise KeyError('No incremental data for source {0}'.format(name))
+    state = _STATE[name]
+    return dose_points_to_map(matrix.dose(changes), state.points, state.grid,
+                              state.resampler, state.scenario)
+
+
+def changed_barriers(old, new):
+    """ Barriers that differ between BarrierSets old and new, matched by
+    name.
+
+    Returns:
+        old_moved:  indices in old of barriers that were moved or removed
+        new_moved:  indices in new of barriers that were moved or added
+        old_edited: indices in old of barriers with only a new thickness or
+                    material
+    """
+    old_index = dict([(name, i) for i, name in enumerate(old.names)])
+    new_index = dict([(name, i) for i, name in enumerate(new.names)])
+
+    old_moved = [i for name, i in old_index.items() \
+                 if name not in new_index.keys()]
+    new_moved = [i for name, i in new_index.items() \
+                 if name not in old_index.keys()]
+    old_edited = []
+
+    for name in set(old_index.keys()) & set(new_index.keys()):
+        i, j = old_index[name], new_index[name]
+        if not(np.array_equal(old.segments[i], new.segments[j])):
+            old_moved += [i]
+            new_moved += [j]
+        elif _materials(old, i) != _materials(new, j):
+            old_edited += [i]
+
+    return sorted(old_moved), sorted(new_moved), sorted(old_edited)
+
+
+def clear():
+    """ Remove all data kept for incremental updates """
+    _STATE.clear()
+
+
+def _materials(barriers, i):
+    # dictionary with the non zero thickness of each material of barrier i
+    return dict([(material, thickness) for material, thickness in \
+                 zip(barriers.materials, barriers.thickness[i]) \
+                 if thickness != 0])
+
+
+def _remap_columns(crossings, old, new):
+    # crossing matrix (coo) with the columns of barriers in old moved to the
+    # index of the barrier with the same name in new, other columns removed
+    new_index = dict([(name, i) for i, name in enumerate(new.names)])
+    mapping = np.array([new_index.get(name, -1) for name in old.names],
+                       dtype=int)
+
+    crossings = crossings.tocoo()
+    columns = mapping[crossings.col] if len(mapping) else \
+              np.zeros(0, dtype=int)
+    keep = columns >= 0
+    return sparse.coo_matrix((crossings.data[keep],
+                              (crossings.row[keep], columns[keep])),
+                             shape=(crossings.shape[0], len(new.names)))
+
+
+def _index(barriers):
+    # spatial index for the crossing matrix of many barriers
+    if len(barriers) > 1:
+        return get_barrier_index(barriers.segments)
+    return None
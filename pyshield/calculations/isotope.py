@@ -5,16 +5,16 @@ Isotope calculations for pyshield package
 Last Updated 05-02-2016
 """
 import numpy as np
-import scipy.interpolate as interp
 
 import pyshield as ps
 
 
-from pyshield.calculations.barrier import sum_shielding_line, add_barriers
-from pyshield.calculations.dose_rates import H10
+from pyshield.calculations.barrier import sum_shielding_line, add_barriers, \
+                                          sum_shielding_lines
+from pyshield.calculations.physics_cache import get_physics
 DEBUG = False
 
-def equivalent_activity(source):
+def equivalent_activity(source, isotopes = None):
     """
     Calculate the equivalent activity in [MBqh]. Activity can be specified
     in two different ways in a source file:
@@ -34,6 +34,7 @@ def equivalent_activity(source):
 
     Args:
         source: dictionary with data for a single source
+        isotopes: isotope definitions, by default from the configuration
     Returns:
         eq_activity: equivalent activity in [MBqh] as float
 
@@ -62,7 +63,9 @@ def equivalent_activity(source):
 
         if decay_corr:
             # calculate the number of desintegrations with decau correction
-            labda = ps.config.get_setting(ps.ISOTOPES)[isotope][ps.LABDA]
+            if isotopes is None:
+                isotopes = ps.config.get_setting(ps.ISOTOPES)
+            labda = isotopes[isotope][ps.LABDA]
             if DEBUG:
                 ps.logger.debug('Isope %s', source[ps.ISOTOPE])
                 ps.logger.debug('Activity_MBq  %s', source[ps.ACTIVITY])
@@ -108,7 +111,7 @@ def calc_dose_source_at_location(source, location, barriers,
                                  height = 0, disable_buildup = False,
                                  intersection_thickness = True, 
                                  return_details = False,
-                                 floor = {}):
+                                 floor = {}, physics = None, activity = None):
 
     """" Calculates the dose that will be measured in location given a source
     specified by source and a shielding specified by shielding.
@@ -118,6 +121,8 @@ def calc_dose_source_at_location(source, location, barriers,
         source:     dictonary specifying the source properties
         location:   x, y coordinates for which the dose is calculated
         barriers:  dictonary containing all shielding elements.
+        physics:   PhysicsCache, by default for the current configuration
+        activity:  equivalent activity of the source if already known
 
      Returns:
          dose_mSv: the total summed dose for the source at the specified
@@ -126,9 +131,12 @@ def calc_dose_source_at_location(source, location, barriers,
     source_location = np.asarray(source[ps.LOCATION])
     isotope         = source[ps.ISOTOPE]
 
+    if physics is None:
+        physics = get_physics()
 
-
-    A_eff = equivalent_activity(source)
+    A_eff = activity
+    if A_eff is None:
+        A_eff = equivalent_activity(source, physics.isotopes)
     if DEBUG:
         ps.logger.debug('Source location: %s', source_location)
         ps.logger.debug('Grid location: %s', location)
@@ -142,7 +150,7 @@ def calc_dose_source_at_location(source, location, barriers,
     sum_shielding = {**sum_shielding, **source.get(ps.MATERIAL,{})}
     sum_shielding = add_barriers(sum_shielding, floor)
 
-    h10 = dose_rate(sum_shielding, isotope, disable_buildup)
+    h10 = dose_rate(sum_shielding, isotope, disable_buildup, physics)
 
 
 
@@ -188,30 +196,138 @@ def calc_dose_source_at_location(source, location, barriers,
 
     return np.sum(dose_mSv)
 
-def dose_rate(sum_shielding, isotope, disable_buildup = False):
+def calc_dose_source_at_locations(source, locations, barriers,
+                                  height = 0, disable_buildup = False,
+                                  intersection_thickness = True,
+                                  floor = {}, index = None, sweep = False,
+                                  physics = None, activity = None):
+
+    """ Vectorized version of calc_dose_source_at_location. Calculates the
+    dose for a source in N locations in a single pass.
+
+    Args:
+
+        source:     dictonary specifying the source properties
+        locations:  array with shape (N, 2), x, y coordinates for which the
+                    dose is calculated
+        barriers:   dictonary containing all shielding elements.
+        index:      optional spatial index (BarrierIndex) for barriers
+        sweep:      use the angular sweep engine for the shielding
+        physics:    PhysicsCache, by default for the current configuration
+        activity:   equivalent activity of the source if already known
+
+     Returns:
+         dose_mSv: array with the total summed dose for the source in each
+                   location."""
+
+    source_location = np.asarray(source[ps.LOCATION], dtype=float)
+    locations       = np.asarray(locations, dtype=float).reshape(-1, 2)
+    isotope         = source[ps.ISOTOPE]
+
+    # obtain total shielding between source location and all locations
+    sum_shielding = sum_shielding_lines(source_location, locations,
+                                        barriers, intersection_thickness,
+                                        index=index, sweep=sweep)
+
+    return dose_from_shielding(source, locations, sum_shielding,
+                               height=height, disable_buildup=disable_buildup,
+                               floor=floor, physics=physics, activity=activity)
+
+def dose_from_shielding(source, locations, sum_shielding, height = 0,
+                        disable_buildup = False, floor = {}, physics = None,
+                        activity = None, return_details = False):
+    """ Dose for a source in N locations, given the shielding by barriers
+    between the source and each location.
+
+    Args:
+
+        source:        dictonary specifying the source properties
+        locations:     array with shape (N, 2), x, y coordinates
+        sum_shielding: dictonary with an array with the effective thickness
+                       for each location (value) for each material (key)
+        physics:       PhysicsCache, by default for the current configuration
+        activity:      equivalent activity of the source if already known
+        return_details: if True a dictionary is returned with the dose
+                       (ps.DOSE_MSV), h10, distance and total shielding for
+                       each location and the equivalent activity.
+
+     Returns:
+         dose_mSv: array with the total summed dose for the source in each
+                   location."""
+    source_location = np.asarray(source[ps.LOCATION], dtype=float)
+    locations       = np.asarray(locations, dtype=float).reshape(-1, 2)
+    isotope         = source[ps.ISOTOPE]
+
+    if physics is None:
+        physics = get_physics()
+
+    A_eff = activity
+    if A_eff is None:
+        A_eff = equivalent_activity(source, physics.isotopes)
+
+    sum_shielding = dict(sum_shielding)
+
+    #include shielding from source
+    for material, thickness in source.get(ps.MATERIAL, {}).items():
+        sum_shielding[material] = np.full(len(locations), float(thickness))
+    sum_shielding = add_barriers(sum_shielding, floor)
+
+    h10 = dose_rate(sum_shielding, isotope, disable_buildup, physics)
+
+    d_meters = np.linalg.norm(locations - source_location, axis=1) / 100
+
+    if ps.LINE_SOURCE in source.get(ps.TYPE, [None]):
+      if height > 0:
+        print('Cannot use height > 0 for line sources')
+        raise NotImplementedError
+
+      rel_strength = dose_rate_line_source(source.get(ps.LENGTH), d_meters)
+
+    else:
+      rel_strength = dose_rate_point_source(d_meters + height / 100)
+
+    # calculate the dose for the locations
+    dose_mSv = A_eff * h10 * rel_strength / 1000
+
+    if return_details:
+        return {ps.DOSE_MSV:              dose_mSv,
+                ps.H10:                   h10,
+                ps.SOURCE_POINT_DISTANCE: d_meters,
+                ps.ACTIVITY_H:            A_eff,
+                ps.TOTAL_SHIELDING:       sum_shielding}
+
+    return dose_mSv
+
+def dose_rate(sum_shielding, isotope, disable_buildup = False,
+              physics = None):
     """
     Calculate the dose rate for a specified isotope behind shielding
     behind shielding barriers. The dose_rate is calculated for 1MBq
 
     Args:
-        sum_shielding:  dict with shielding elements
+        sum_shielding:  dict with shielding elements, thickness can be
+                        a float or an array of thicknesses
         isotope:        isotope name (string)
+        physics:        PhysicsCache, by default for the current configuration
+    Returns:
+        rate: dose rate, same shape as the thickness in sum_shielding
     """
+    if physics is None:
+        physics = get_physics()
 
-    t         = transmission_sum(sum_shielding, isotope, disable_buildup)
-    energies  = ps.config.get_setting(ps.ISOTOPES)[isotope][ps.ENERGY_keV]
-    abundance = ps.config.get_setting(ps.ISOTOPES)[isotope][ps.ABUNDANCE]
+    t         = transmission_sum(sum_shielding, isotope, disable_buildup,
+                                 physics)
     if DEBUG:
         ps.logger.debug(isotope)
         ps.logger.debug('t: %s', t)
-        ps.logger.debug('energies: %s', energies)
-        ps.logger.debug('abundance: %s', abundance)
 
-    rate = H10(energy_keV=energies, abundance=t * np.array(abundance))
+    # sum over the energies (last axis)
+    rate = physics.dose_rate(isotope, t)
 
     return rate
 
-def transmission_sum(sum_shielding, isotope, disable_buildup = False):
+def transmission_sum(sum_shielding, isotope, disable_buildup = False,
+                     physics = None):
     """calculate the total attenuation for the total amount of shielding
     (calculated by sum_shielding_line). Buildup is taken into account unless
     disabled in the pyshield options.
@@ -231,42 +347,39 @@ def transmission_sum(sum_shielding, isotope, disable_buildup = False):
 
      """
     #ignore_buildup = get_setting(ps.DISABLE_BUILDUP)
-    energies = ps.config.get_setting(ps.ISOTOPES)[isotope][ps.ENERGY_keV]
-    energies = np.array(energies)
+    if physics is None:
+        physics = get_physics()
+    energies = physics.energies(isotope)
     t = np.ones(len(energies))
     for material, thickness in sum_shielding.items():
         if DEBUG:
             ps.logger.debug('transmission through %s cm %s', thickness, material)
-        t *= transmission(isotope, material, thickness, disable_buildup)
+        t = t * transmission(isotope, material, thickness, disable_buildup,
+                             physics)
     return t
 
-def transmission(isotope, material, thickness, disable_buildup=False):
+def transmission(isotope, material, thickness, disable_buildup=False,
+                 physics=None):
     """ Transmission through a material with thickness. Buildup is taken
         into account unless disabled.
         Args:
             isotope: name of the isotope
             material: name of the material
-            thickness: thickness of the material
+            thickness: thickness of the material (float or array)
             ignore_buildup: if True buildup factor is 1.
+            physics: PhysicsCache, by default for the current configuration
         Returns:
-            t: transmission factor (float)
+            t: transmission factor for each energy, array with shape
+               thickness.shape + (number of energies, )
     """
-    energies = ps.config.get_setting(ps.ISOTOPES)[isotope][ps.ENERGY_keV]
-    energies = np.array(energies)
-
-
-    # attenuation, total is product of the attenuation of each barrier
-
-    #barriers
-
-
-    t = attenuation(energies, material, thickness)
-    msg = 'Attenuation for %s with thickness %s and energies %s: %s'
+    # attenuation and buildup are interpolated once for each isotope and
+    # material by the physics cache
+    if physics is None:
+        physics = get_physics()
+    t = physics.transmission(isotope, material, thickness, disable_buildup)
+    msg = 'Transmission for %s with thickness %s: %s'
     if DEBUG:
-        ps.logger.debug(msg, material, thickness, energies, t)
-
-    if not disable_buildup:
-        t *= buildup(energies, material, thickness)
+        ps.logger.debug(msg, material, thickness, t)
     return t
 
 def attenuation(energy_keV, material, thickness):
@@ -279,7 +392,7 @@ def attenuation(energy_keV, material, thickness):
     Returns:
         a:  attenation factor (float)
     """
-    a = np.exp(-u_linear(energy_keV, material) * thickness)
+    a = np.exp(-np.multiply.outer(thickness, u_linear(energy_keV, material)))
 
     msg = 'Material: %s Thickness: %s Energy: %s Attenuation %s'
     if DEBUG:
@@ -303,17 +416,21 @@ def buildup(energy_keV, material, thickness):
         print(material + ' not in buildup table!')
         raise NameError
 
+    n_mfp       = np.array(table.index, dtype=float)
+    energies    = np.array(table.columns, dtype=float)
+    factors     = np.array(table, dtype=float)
+    energy_MeV  = np.atleast_1d(energy_keV) / 1000
+    n_mfp_i     = number_mean_free_path(energy_keV, material, thickness)
+    factor      = np.ones(np.shape(n_mfp_i))
 
-    if thickness == 0:
-        return 1
+    # bilinear interpolation, first along the energy axis of the table then
+    # along the number of mean free paths. Each energy is evaluated at its
+    # own number of mean free paths.
+    for i, energy in enumerate(energy_MeV):
+        column = [np.interp(energy, energies, row) for row in factors]
+        factor[..., i] = np.interp(n_mfp_i[..., i], n_mfp, column)
 
-    n_mfp       = np.array(table.index)
-    energies    = np.array(table.columns)
-    factors     = np.array(table)
-    energy_MeV  = energy_keV/1000
-    n_mfp_i     = number_mean_free_path(energy_keV, material, thickness)
-    interp_func = interp.interp2d(energies, n_mfp, factors, kind='linear')
-    factor      = interp_func(energy_MeV, n_mfp_i)[0]
+    factor[np.asarray(thickness) == 0] = 1
     if DEBUG:
         ps.logger.debug('Buildup factor:  ' + str(factor))
         ps.logger.debug('Material: '        + str(material))
@@ -333,23 +450,15 @@ def number_mean_free_path(energy_keV, material, thickness):
       material thicknesss
     """
 
-    return thickness * u_linear(energy_keV, material)
+    return np.multiply.outer(thickness, u_linear(energy_keV, material))
 
 def u_mass(energy_keV, material):
     try:
-        table = ps.config.get_setting(ps.ATTENUATION)[material]
-    except NameError:
+        mu_p_i = get_physics().u_mass(energy_keV, material)
+    except KeyError:
         print(material + ' not in attenuation table!')
-        raise NameError
-
-    energies = np.array(table[ps.ENERGY_MeV])
+        raise
 
-    mu_p = np.array(table[ps.MASS_ATTENUATION])
-    
-    interp_fcn = interp.interp1d(energies, mu_p)
-
-    mu_p_i = interp_fcn(energy_keV / 1e3)
-    
     return mu_p_i
 
 def u_linear(energy_keV, material):
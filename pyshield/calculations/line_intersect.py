@@ -14,6 +14,10 @@ import matplotlib.pyplot as plt
 #number of significant digits (rounding)
 SIG_DIGITS = 6
 
+# lines with a smaller sine of the angle between them are parallel (rounding
+# errors of nearly parallel lines would give huge path length factors)
+PARALLEL_SINE = 1e-12
+
 def sci_round(x, sig=SIG_DIGITS):
     """Scientific rounding
 
@@ -70,6 +74,121 @@ def intersect_line(L0, L2):
     # lines not parallel but no intersection found on finite lines
     return (None, None)
 
+def intersect_segments(P0, P1, Q0, Q1):
+    """ Vectorized version of intersect_line. Line pieces P0-P1 and Q0-Q1
+        are given as arrays of points with shape (..., 2), the arrays are
+        broadcasted against each other.
+
+        - function returns an array (..., 2) with the coordinates of the
+          intersection between each pair of line pieces
+        - coordinates are NaN if lines are parallel (see PARALLEL_SINE) or
+          if no intersection is found on the finite lines
+    """
+    P0, P1, Q0, Q1 = (np.asarray(P, dtype=float) for P in (P0, P1, Q0, Q1))
+
+    s1_x = P1[..., 0] - P0[..., 0]
+    s1_y = P1[..., 1] - P0[..., 1]
+
+    s2_x = Q1[..., 0] - Q0[..., 0]
+    s2_y = Q1[..., 1] - Q0[..., 1]
+
+    dx = P0[..., 0] - Q0[..., 0]
+    dy = P0[..., 1] - Q0[..., 1]
+
+    den = (-s2_x * s1_y + s1_x * s2_y)
+
+    # parallel lines give a zero denominator, result is NaN (no intersection)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (-s1_y * dx + s1_x * dy) / den
+        t = (s2_x * dy - s2_y * dx) / den
+
+    # den is the cross product of the directions
+    parallel = np.abs(den) <= PARALLEL_SINE * np.hypot(s1_x, s1_y) * \
+                              np.hypot(s2_x, s2_y)
+
+    # check if intersection lies on line pieces
+    valid = (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1) & ~parallel
+    t = np.where(valid, t, np.nan)
+
+    return np.stack((P0[..., 0] + t * s1_x, P0[..., 1] + t * s1_y), axis=-1)
+
+def sin_angle_between_lines(d0, d1):
+    """ Sine of the angle between lines with direction vectors d0 and d1
+        (arrays with shape (..., 2)). Obtained from the cross product, which
+        is independent of the orientation of both lines. """
+    d0 = np.asarray(d0, dtype=float)
+    d1 = np.asarray(d1, dtype=float)
+    cross = d0[..., 0] * d1[..., 1] - d0[..., 1] * d1[..., 0]
+    norm = np.hypot(d0[..., 0], d0[..., 1]) * np.hypot(d1[..., 0], d1[..., 1])
+    return np.abs(cross) / norm
+
+def intersect_rays(origin, ends, segments, intersection_thickness=True,
+                   return_points=False):
+    """ Intersect N line pieces from origin to each point in ends with M line
+        pieces (barriers) at once.
+
+        origin:    (x, y) start point of all line pieces (e.g. the source)
+        ends:      array (N, 2) with the end point of each line piece
+        segments:  array (M, 4) with the barriers (x0, y0, x1, y1)
+        intersection_thickness: if True the path length factor 1/sin(theta)
+                   is calculated for each intersection, otherwise 1.
+
+        - function returns a boolean hit mask (N, M) and an (N, M) matrix
+          with the path length factor through each barrier that was hit
+          (0 if not hit). Multiplying the factor with the barrier thickness
+          gives the effective thickness.
+        - parallel lines do not intersect (see intersect_segments)
+        - an intersection point is only counted once for each line piece,
+          if barriers share an end point only the first barrier counts.
+        - if return_points is True the (N, M, 2) intersection points are
+          returned as well (NaN if not hit).
+    """
+    origin = np.asarray(origin, dtype=float)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+
+    points = intersect_segments(origin, ends[:, np.newaxis, :],
+                                segments[np.newaxis, :, 0:2],
+                                segments[np.newaxis, :, 2:4])
+    hit = ~np.isnan(points[..., 0])
+
+    # remove duplicate intersection points per line piece, sort hits by
+    # line piece, rounded intersection point and barrier index. The first
+    # barrier (lowest index) of each group of equal points is kept.
+    rows, cols = np.nonzero(hit)
+    if len(rows) > 1:
+        px = sci_round_array(points[rows, cols, 0])
+        py = sci_round_array(points[rows, cols, 1])
+        order = np.lexsort((cols, py, px, rows))
+        rows, cols, px, py = rows[order], cols[order], px[order], py[order]
+        duplicate = (rows[1:] == rows[:-1]) & (px[1:] == px[:-1]) & \
+                    (py[1:] == py[:-1])
+        hit[rows[1:][duplicate], cols[1:][duplicate]] = False
+
+    factor = np.zeros(hit.shape)
+    rows, cols = np.nonzero(hit)
+    if intersection_thickness:
+        sin_theta = sin_angle_between_lines(ends[rows] - origin,
+                                            segments[cols, 2:4] - \
+                                            segments[cols, 0:2])
+        factor[rows, cols] = 1 / sin_theta
+    else:
+        factor[rows, cols] = 1
+
+    if return_points:
+        points[~hit] = np.nan
+        return hit, factor, points
+    return hit, factor
+
+def sci_round_array(x, sig=SIG_DIGITS):
+    """ Vectorized version of sci_round, NaN values are left untouched. """
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(x)))
+    magnitude[~np.isfinite(magnitude)] = 0
+    factor = 10.0 ** (sig - 1 - magnitude)
+    return np.round(x * factor) / factor
+
 def angle_between_lines(L0, L1):
     """ Angle in radians between two lines
 
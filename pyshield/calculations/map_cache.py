@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Disk cache for the dose maps of single sources.
+
+A dose map is stored under a hash of everything it depends on: the source
+definition, the barriers, the grid and calculation settings and the physics
+data of the isotope and materials used. The name of the source is not part
+of the key, a renamed source reuses its map. When one source or barrier is
+edited only the maps whose key changed are calculated again.
+
+The cache folder is set with the dose_map_cache setting, an empty value
+disables the cache. Old maps are never removed automatically, the folder
+can be deleted at any time.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import pyshield as ps
+from pyshield.calculations.adaptive import contour_levels
+
+# change when calculation results change for the same input, all cached
+# maps are invalidated
+CACHE_VERSION = 2
+
+# settings that determine the dose map of a source
+MAP_SETTINGS = (ps.GRID,
+                ps.GRIDSIZE,
+                ps.NANGLES,
+                ps.ORIGIN,
+                ps.SCALE,
+                ps.GRID_ENGINE,
+                ps.POLAR_INTERPOLATION,
+                ps.HEIGHT,
+                ps.FLOOR,
+                ps.DISABLE_BUILDUP,
+                ps.INTERSECTION_THICKNESS,
+                ps.TRANSMISSION_TOLERANCE,
+                ps.ADAPTIVE_LEVELS,
+                ps.ADAPTIVE_TOLERANCE,
+                ps.DOSE_FLOOR)
+
+
+def source_key(source, scenario, barriers=True):
+    """ Hash (hex string) of all data that determines the dose map of source
+    in scenario. If barriers is False the barriers and the physics data of
+    their materials are left out (see incremental). """
+    physics = scenario.physics
+    isotope = source[ps.ISOTOPE]
+
+    materials = set(source.get(ps.MATERIAL, {}).keys())
+    materials.update(scenario.get(ps.FLOOR) or {})
+    barrier_data = None
+    if barriers:
+        materials.update(scenario.barriers.materials)
+        barrier_data = (scenario.barriers.segments,
+                        scenario.barriers.materials,
+                        scenario.barriers.thickness)
+
+    data = (CACHE_VERSION,
+            source,
+            barrier_data,
+            dict([(key, scenario.get(key)) for key in MAP_SETTINGS]),
+            scenario.span,
+            physics.isotopes[isotope],
+            dict([(material, _material_data(material, physics)) \
+                  for material in sorted(materials)]))
+
+    if scenario.get(ps.GRID) == ps.ADAPTIVE:
+        # the adaptive grid is refined on the isocontour levels
+        data += (contour_levels(scenario),)
+
+    if scenario.region is not None:
+        data += (scenario.region,)
+
+    if scenario.get(ps.DOSE_FLOOR):
+        # the dose floor of a source depends on the number of sources
+        data += (len(scenario.sources),)
+
+    return _hash(data)
+
+
+def material_key(material, physics):
+    """ Hash (hex string) of the physics data of material """
+    return _hash(_material_data(material, physics))
+
+
+def _material_data(material, physics):
+    return (physics.materials[material], physics.attenuation[material],
+            physics.buildup_tables.get(material))
+
+
+def _hash(data):
+    digest = hashlib.sha1()
+    _update(digest, data)
+    return digest.hexdigest()
+
+
+def load_map(folder, key, mmap_mode=None):
+    """ Return the cached dose map for key or None if not in the cache. With
+    mmap_mode (see numpy.load) the map is read from disk when used. """
+    file = os.path.join(folder, key + '.npy')
+    if not os.path.exists(file):
+        return None
+    try:
+        return np.load(file, mmap_mode=mmap_mode, allow_pickle=False)
+    except (OSError, ValueError):
+        ps.logger.warning('Cannot read cached dose map %s', file)
+        return None
+
+
+def save_map(folder, key, dose_map):
+    """ Store dose_map under key, the file is replaced atomically so
+    concurrent runs never read a partial map. """
+    os.makedirs(folder, exist_ok=True)
+    handle, temp_file = tempfile.mkstemp(suffix='.npy', dir=folder)
+    with os.fdopen(handle, 'wb') as file:
+        np.save(file, np.asarray(dose_map), allow_pickle=False)
+    os.replace(temp_file, os.path.join(folder, key + '.npy'))
+
+
+def _update(digest, item):
+    # feed a canonical representation of item to digest, dictionaries are
+    # sorted by key so the order in the yaml files does not matter
+    if isinstance(item, dict):
+        digest.update(b'dict')
+        for key in sorted(item.keys(), key=repr):
+            _update(digest, key)
+            _update(digest, item[key])
+    elif isinstance(item, (list, tuple)):
+        digest.update(b'list' + str(len(item)).encode())
+        for value in item:
+            _update(digest, value)
+    elif isinstance(item, np.ndarray):
+        item = np.ascontiguousarray(item)
+        digest.update(b'array' + item.dtype.str.encode() + \
+                      str(item.shape).encode())
+        digest.update(item.tobytes())
+    elif isinstance(item, pd.DataFrame):
+        digest.update(b'frame')
+        _update(digest, [str(column) for column in item.columns])
+        _update(digest, [str(index) for index in item.index])
+        _update(digest, item.to_numpy(dtype=float))
+    elif isinstance(item, np.generic):
+        _update(digest, item.item())
+    else:
+        digest.update(repr(item).encode())
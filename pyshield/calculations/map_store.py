@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Dose maps stored on disk as memory mapped .npy files.
+
+With the map_store setting the dose maps of the grid calculations are kept
+in export_dir/dose_maps instead of in memory. Files are named by the
+source_key of the source (see map_cache):
+
+    <key>.points.npy      dose on the grid points of the source, grid
+                          workers write their tiles directly to this file
+    <key>.tiles<n>.npy    finished tiles of n points, a tile is marked after
+                          its dose is flushed to the points file
+    <key>.npy             the finished dose map
+
+The summed dose map is sum_sources.npy. All maps are returned as read only
+memory maps, only the parts that are used (e.g. by the visualization) are
+read from disk.
+
+A run that is interrupted resumes with the finished tiles of each source
+whose key did not change, finished dose maps are not calculated again. Use
+tile_size to resume tile by tile, by default there is a single tile per
+source for worker processes. The folder can be deleted at any time.
+"""
+import glob
+import os
+import tempfile
+
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.map_cache import load_map, save_map
+
+# folder in export_dir
+STORE_FOLDER = 'dose_maps'
+
+# file name (without extension) of the summed dose map
+SUM_FILE = 'sum_sources'
+
+
+def store_folder():
+    """ Folder of the map store in the export folder, created if needed """
+    folder = os.path.join(ps.export.export_folder(), STORE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def points_file(folder, key, n_points):
+    """ File with the dose (n_points, ) on the grid points for key. An
+    existing file is reused (resumed), a new file is filled with zeros. """
+    file = os.path.join(folder, key + '.points.npy')
+    try:
+        dose = np.load(file, mmap_mode='r')
+        if dose.shape == (n_points, ) and dose.dtype == float:
+            return file
+    except (OSError, ValueError):
+        pass
+
+    # finished tiles refer to the old file
+    for tiles in glob.glob(os.path.join(folder, key + '.tiles*.npy')):
+        _remove(tiles)
+    np.lib.format.open_memmap(file, mode='w+', dtype=float,
+                              shape=(n_points, )).flush()
+    return file
+
+
+def finished_tiles(file, tile_size, n_tiles):
+    """ Boolean memory map (n_tiles, ) that marks the finished tiles of
+    tile_size points of the points file (see points_file). """
+    tiles = file.replace('.points.npy', '.tiles{0}.npy'.format(tile_size))
+    try:
+        finished = np.load(tiles, mmap_mode='r+')
+        if finished.shape == (n_tiles, ) and finished.dtype == bool:
+            return finished
+    except (OSError, ValueError):
+        pass
+    return np.lib.format.open_memmap(tiles, mode='w+', dtype=bool,
+                                     shape=(n_tiles, ))
+
+
+def store_map(folder, key, dose_map):
+    """ Store dose_map under key, remove the points and tiles files of key
+    and return the map as a read only memory map. """
+    save_map(folder, key, dose_map)
+    for file in glob.glob(os.path.join(folder, key + '.points.npy')) + \
+                glob.glob(os.path.join(folder, key + '.tiles*.npy')):
+        _remove(file)
+    return load_map(folder, key, mmap_mode='r')
+
+
+def summed_map(folder, shape):
+    """ New summed dose map (memory map filled with zeros) with shape, pass
+    it to finish_summed when all dose maps are added. """
+    handle, file = tempfile.mkstemp(suffix='.npy', dir=folder)
+    os.close(handle)
+    return np.lib.format.open_memmap(file, mode='w+', dtype=float,
+                                     shape=shape)
+
+
+def finish_summed(folder, summed):
+    """ Replace sum_sources.npy by summed (see summed_map), returns it as a
+    read only memory map. """
+    summed.flush()
+    os.replace(summed.filename, os.path.join(folder, SUM_FILE + '.npy'))
+    return load_map(folder, SUM_FILE, mmap_mode='r')
+
+
+def _remove(file):
+    # files that are still mapped cannot be removed on Windows, they are
+    # left in the folder
+    try:
+        os.remove(file)
+    except OSError:
+        ps.logger.debug('Cannot remove %s', file)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Dose on fixed points as a function of the barrier thickness.
+
+For fixed locations of the source, the points and the barriers, the
+effective thickness of each material between the source and each point is
+a linear function of the barrier thicknesses: a sparse (points x barriers)
+matrix with the obliquity factor (1 / sin(theta), see intersect_rays) of
+each crossed barrier times the (barriers x materials) thickness matrix.
+After the matrix is built, changing thicknesses (or materials) of barriers
+only needs a sparse matrix product and the transmission, no geometry.
+"""
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.barrier import crossing_matrix
+from pyshield.calculations.isotope import dose_from_shielding
+from pyshield.calculations.spatial_index import get_barrier_index
+
+
+class ObliquityMatrix():
+    """ Dose of source on points for any thickness of the barriers in
+    scenario.
+
+    Args:
+        source:    source definition
+        points:    array (N, 2) with the points
+        scenario:  Scenario with the barriers, physics and settings
+        crossings: sparse (N, M) crossing matrix for points and the
+                   scenario barriers, calculated if None.
+
+    Example:
+        matrix = ObliquityMatrix(source, points, scenario)
+        dose = matrix.dose({'wall 1': {'Lead': 0.3}})
+    """
+    def __init__(self, source, points, scenario, crossings=None):
+        self.source = source
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.scenario = scenario
+
+        barriers = scenario.barriers
+        if crossings is None:
+            index = None
+            if len(barriers) > 1:
+                index = get_barrier_index(barriers.segments)
+            intersection_thickness = scenario.get(ps.INTERSECTION_THICKNESS)
+            crossings = crossing_matrix(source[ps.LOCATION], self.points,
+                                        barriers.segments,
+                                        intersection_thickness, index=index)
+        self.crossings = crossings.tocsr()
+
+    def thickness(self, changes=None):
+        """ Thickness matrix (M, K) and the K materials of the barriers.
+
+        Args:
+            changes: dictionary {barrier name: {material: thickness}}, the
+                     materials of these barriers are replaced.
+        """
+        barriers = self.scenario.barriers
+        materials = list(barriers.materials)
+        thickness = np.array(barriers.thickness)
+
+        for name, barrier_materials in (changes or {}).items():
+            i = barriers.names.index(name)
+            thickness[i] = 0
+            for material, value in barrier_materials.items():
+                if material not in self.scenario.physics.materials.keys():
+                    msg = 'No physics data for {0} in scenario'
+                    raise KeyError(msg.format(material))
+                if material not in materials:
+                    materials += [material]
+                    thickness = np.append(thickness,
+                                          np.zeros((len(thickness), 1)),
+                                          axis=1)
+                thickness[i, materials.index(material)] = np.squeeze(value)
+        return thickness, materials
+
+    def shielding(self, changes=None, rows=None):
+        """ Effective thickness of each material for each point, dictionary
+        as returned by sum_shielding_lines. rows selects points. """
+        thickness, materials = self.thickness(changes)
+        crossings = self.crossings if rows is None else self.crossings[rows]
+        return shielding_from_crossings(crossings, thickness, materials)
+
+    def dose(self, changes=None, rows=None):
+        """ Dose in mSv on the points (or the selected rows) for the barrier
+        thicknesses with changes, see thickness. """
+        scenario = self.scenario
+        points = self.points if rows is None else self.points[rows]
+        return dose_from_shielding(self.source, points,
+                                   self.shielding(changes, rows),
+                                   height=scenario.get(ps.HEIGHT),
+                                   disable_buildup=scenario.get(
+                                       ps.DISABLE_BUILDUP),
+                                   floor=scenario.get(ps.FLOOR),
+                                   physics=scenario.physics)
+
+
+def shielding_from_crossings(crossings, thickness, materials):
+    """ Effective thickness of each material from a sparse (N, M) crossing
+    matrix and a (M, K) thickness matrix, dictionary as returned by
+    sum_shielding_lines. """
+    sum_thickness = crossings.dot(thickness)
+    used = (crossings.dot((thickness > 0).astype(float)) > 0).any(axis=0)
+    return dict([(material, sum_thickness[:, i]) \
+                 for i, material in enumerate(materials) if used[i]])
+
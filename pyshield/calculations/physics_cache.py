@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Cache for the physics data used in calculations. Interpolation of the
+attenuation and buildup tables is done once for each (isotope, material)
+combination instead of for each evaluation.
+
+The cache is rebuilt automatically when the physics data in the pyshield
+configuration changes.
+
+Optionally the transmission is tabulated over a thickness axis for each
+(isotope, material) combination. The resolution of the table is chosen such
+that the relative error of the interpolated transmission stays below a
+tolerance (transmission_tolerance setting).
+"""
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.dose_rates import H10
+
+# physics cache for the current configuration, see get_physics
+_CACHE = {}
+
+# transmission tables range up to this number of mean free paths for the
+# most penetrating photon energy, exact evaluation is used beyond.
+MAX_MFP = 70
+
+# limits for the number of intervals of a transmission table
+MIN_TABLE_SIZE = 64
+MAX_TABLE_SIZE = 2**16
+
+
+class PhysicsCache():
+    """ Precomputed physics data for isotopes and materials.
+
+    Args:
+        isotopes:    isotope definitions (isotopes.yml)
+        materials:   material definitions (materials.yml)
+        attenuation: attenuation tables (pandas) for each material
+        buildup:     buildup tables (pandas) for each material
+        tolerance:   relative error bound for tabulated transmission, if 0
+                     the transmission is always evaluated exactly.
+    """
+    def __init__(self, isotopes, materials, attenuation, buildup,
+                 tolerance=0):
+        self.isotopes = isotopes
+        self.materials = materials
+        self.attenuation = attenuation
+        self.buildup_tables = buildup
+        self.tolerance = tolerance
+
+        self._u_mass_table = {}     # material: (energy_MeV, mu_p)
+        self._u_linear = {}         # (isotope, material): mu for each energy
+        self._buildup = {}          # (isotope, material): (n_mfp, factors)
+        self._h10 = {}              # isotope: h10 for each energy
+        self._tables = {}           # transmission tables
+
+    def prepare(self, isotopes, materials, disable_buildup=False):
+        """ Precompute attenuation and buildup for all combinations of
+        isotopes and materials. Transmission tables are created as well if
+        the tolerance is larger than 0. """
+        for isotope in isotopes:
+            self.h10(isotope)
+            for material in materials:
+                self.u_linear(isotope, material)
+                if material in self.buildup_tables.keys():
+                    self._buildup_table(isotope, material)
+                if self.tolerance > 0:
+                    self.transmission_table(isotope, material, disable_buildup)
+
+    def energies(self, isotope):
+        """ Photon energies in keV for isotope """
+        return np.array(self.isotopes[isotope][ps.ENERGY_keV], dtype=float)
+
+    def abundance(self, isotope):
+        """ Abundance for each photon energy of isotope """
+        return np.array(self.isotopes[isotope][ps.ABUNDANCE], dtype=float)
+
+    def h10(self, isotope):
+        """ h10 in uSv/h per MBq/m^2 for each photon energy of isotope """
+        if isotope not in self._h10.keys():
+            self._h10[isotope] = H10(energy_keV=self.energies(isotope),
+                                     abundance=self.abundance(isotope),
+                                     add=False)
+        return self._h10[isotope]
+
+    def u_mass(self, energy_keV, material):
+        """ Mass attenuation coefficient in cm^2/g """
+        if material not in self._u_mass_table.keys():
+            table = self.attenuation[material]
+            self._u_mass_table[material] = (
+                np.array(table[ps.ENERGY_MeV], dtype=float),
+                np.array(table[ps.MASS_ATTENUATION], dtype=float))
+        energies, mu_p = self._u_mass_table[material]
+        return np.interp(np.asarray(energy_keV) / 1e3, energies, mu_p)
+
+    def u_linear(self, isotope, material):
+        """ Linear attenuation coefficient in cm^-1 for each photon energy
+        of isotope. """
+        key = (isotope, material)
+        if key not in self._u_linear.keys():
+            density = self.materials[material][ps.DENSITY]
+            self._u_linear[key] = self.u_mass(self.energies(isotope),
+                                              material) * density
+        return self._u_linear[key]
+
+    def _buildup_table(self, isotope, material):
+        # buildup table interpolated at each photon energy of isotope,
+        # returns the number of mean free paths and for each energy the
+        # buildup factor at those mean free paths.
+        key = (isotope, material)
+        if key not in self._buildup.keys():
+            table = self.buildup_tables[material]
+            n_mfp = np.array(table.index, dtype=float)
+            energies = np.array(table.columns, dtype=float)
+            factors = np.array(table, dtype=float)
+
+            energy_MeV = self.energies(isotope) / 1000
+            columns = np.array([[np.interp(energy, energies, row) \
+                                 for row in factors] \
+                                for energy in energy_MeV])
+            self._buildup[key] = (n_mfp, columns)
+        return self._buildup[key]
+
+    def buildup(self, isotope, material, thickness):
+        """ Buildup factor for each photon energy of isotope through
+        material with thickness (float or array). Returns an array with
+        shape thickness.shape + (number of energies, ) """
+        factor = self._buildup_factor(isotope, material, thickness)
+        factor[np.asarray(thickness) == 0] = 1
+        return factor
+
+    def _buildup_factor(self, isotope, material, thickness):
+        # interpolated buildup factor, without setting the factor for
+        # zero thickness to 1
+        n_mfp, columns = self._buildup_table(isotope, material)
+        n_mfp_i = self.number_mean_free_path(isotope, material, thickness)
+
+        factor = np.ones(np.shape(n_mfp_i))
+        for i, column in enumerate(columns):
+            factor[..., i] = np.interp(n_mfp_i[..., i], n_mfp, column)
+        return factor
+
+    def number_mean_free_path(self, isotope, material, thickness):
+        """ Number of mean free paths for each photon energy of isotope """
+        return np.multiply.outer(thickness, self.u_linear(isotope, material))
+
+    def attenuation_factor(self, isotope, material, thickness):
+        """ Attenuation (without buildup) for each photon energy of isotope
+        through material with thickness (float or array). """
+        return np.exp(-self.number_mean_free_path(isotope, material, thickness))
+
+    def transmission(self, isotope, material, thickness, disable_buildup=False):
+        """ Transmission for each photon energy of isotope through material
+        with thickness (float or array). Returns an array with shape
+        thickness.shape + (number of energies, ). The transmission table
+        is used if the tolerance is larger than 0 and the table is within
+        tolerance. """
+        if self.tolerance > 0:
+            table = self.transmission_table(isotope, material, disable_buildup)
+            if table['error'] <= self.tolerance:
+                return self._interpolate_table(isotope, material, thickness,
+                                               disable_buildup, table)
+        return self.exact_transmission(isotope, material, thickness,
+                                       disable_buildup)
+
+    def max_transmission(self, isotope, material, disable_buildup=False):
+        """ Largest transmission through any thickness of material for each
+        photon energy of isotope. Without buildup this is 1, with buildup
+        the transmission through a thin layer can be larger than 1. The
+        tolerance of the transmission tables is included. """
+        t = np.ones(len(self.energies(isotope)))
+        if not disable_buildup:
+            n_mfp, columns = self._buildup_table(isotope, material)
+            for i, column in enumerate(columns):
+                t[i] = max(1, _max_buildup_attenuation(n_mfp, column))
+        return t * (1 + self.tolerance)
+
+    def exact_transmission(self, isotope, material, thickness,
+                           disable_buildup=False):
+        """ Transmission for each photon energy of isotope through material
+        with thickness, evaluated without transmission table. """
+        t = self.attenuation_factor(isotope, material, thickness)
+        if not disable_buildup:
+            t *= self.buildup(isotope, material, thickness)
+        return t
+
+    def _log_transmission(self, isotope, material, thickness, disable_buildup):
+        # natural log of the transmission, at zero thickness the limit for
+        # thickness to zero is returned.
+        log_t = -self.number_mean_free_path(isotope, material, thickness)
+        if not disable_buildup:
+            log_t += np.log(self._buildup_factor(isotope, material, thickness))
+        return log_t
+
+    def transmission_table(self, isotope, material, disable_buildup=False):
+        """ Table with the log of the transmission for each photon energy
+        of isotope on an equidistant thickness axis. The number of points is
+        doubled until the relative error of the interpolated transmission
+        is below the tolerance. If the tolerance cannot be met with
+        MAX_TABLE_SIZE points the table is not used and the transmission is
+        evaluated exactly.
+
+        Returns:
+            dict with the thickness step (cm), maximum thickness (cm), the
+            log transmission (points x energies) and the error estimate.
+        """
+        key = (isotope, material, disable_buildup, self.tolerance)
+        if key in self._tables.keys():
+            return self._tables[key]
+
+        mu = self.u_linear(isotope, material)
+        max_thickness = MAX_MFP / max(np.min(mu), 1e-12)
+
+        n = MIN_TABLE_SIZE
+        while True:
+            step = max_thickness / n
+            thickness = np.arange(n + 1) * step
+            log_t = self._log_transmission(isotope, material, thickness,
+                                           disable_buildup)
+            table = {'step': step,
+                     'max_thickness': max_thickness,
+                     'log_transmission': log_t}
+
+            # estimate error between the points of the table
+            test = (thickness[:-1, np.newaxis] + \
+                    step * np.array((0.25, 0.5, 0.75))).ravel()
+            table['error'] = self._table_error(isotope, material, test,
+                                               disable_buildup, table)
+
+            if table['error'] <= self.tolerance or n >= MAX_TABLE_SIZE:
+                break
+            n *= 2
+
+        if table['error'] > self.tolerance:
+            msg = ('Transmission table for %s and %s exceeds tolerance (%s), '
+                   'using exact evaluation')
+            ps.logger.warning(msg, isotope, material, table['error'])
+
+        ps.logger.debug('Transmission table for %s and %s with %s points',
+                        isotope, material, n + 1)
+        self._tables[key] = table
+        return table
+
+    def _interpolate_table(self, isotope, material, thickness,
+                           disable_buildup, table):
+        # linear interpolation of the log transmission, thickness outside the
+        # table is evaluated exactly
+        thickness = np.asarray(thickness, dtype=float)
+
+        t = np.exp(_interpolate_log(table, thickness))
+        t[thickness == 0] = 1
+
+        outside = thickness > table['max_thickness']
+        if np.any(outside):
+            t[outside] = self.exact_transmission(isotope, material,
+                                                 thickness[outside],
+                                                 disable_buildup)
+        return t
+
+    def _table_error(self, isotope, material, thickness, disable_buildup,
+                     table):
+        # maximum relative deviation between table and exact transmission
+        # for all energies, negligible transmissions are ignored
+        exact = self._log_transmission(isotope, material, thickness,
+                                       disable_buildup)
+        interpolated = _interpolate_log(table, thickness)
+        error = np.abs(np.expm1(interpolated - exact))[exact > -MAX_MFP]
+        return float(np.max(error)) if error.size else 0.
+
+    def validate_tables(self, npoints=10000):
+        """ Compare the transmission tables in use with the exact
+        transmission on npoints random thicknesses. Returns a dictionary with
+        the maximum relative deviation for each (isotope, material,
+        disable_buildup). """
+        deviation = {}
+        random = np.random.RandomState(0)
+        for key, table in self._tables.items():
+            isotope, material, disable_buildup, tolerance = key
+            if tolerance != self.tolerance or table['error'] > tolerance:
+                continue
+            thickness = random.uniform(0, table['max_thickness'], npoints)
+            exact = self.exact_transmission(isotope, material, thickness,
+                                            disable_buildup)
+            interpolated = self._interpolate_table(isotope, material,
+                                                   thickness, disable_buildup,
+                                                   table)
+            # relative deviation, negligible transmissions are ignored
+            valid = exact > np.exp(-MAX_MFP)
+            error = np.abs(interpolated[valid] / exact[valid] - 1)
+            deviation[key[0:3]] = float(np.max(error)) if error.size else 0.
+        return deviation
+
+    def dose_rate(self, isotope, t):
+        """ Dose rate in uSv/h per MBq/m^2 given the transmission t for each
+        photon energy (last axis) of isotope. """
+        return np.dot(t, self.h10(isotope))
+
+
+def _interpolate_log(table, thickness):
+    # linear interpolation of the log transmission in table, thickness is
+    # clipped to the range of the table
+    log_t = table['log_transmission']
+
+    x = np.clip(thickness / table['step'], 0, len(log_t) - 1)
+    i = np.minimum(x.astype(int), len(log_t) - 2)
+    w = (x - i)[..., np.newaxis]
+
+    return (1 - w) * log_t[i] + w * log_t[i + 1]
+
+
+def _max_buildup_attenuation(n_mfp, factors):
+    # maximum of buildup * exp(-n) for n >= 0 mean free paths, the buildup
+    # factor is interpolated linearly in the table (n_mfp, factors) and
+    # constant outside. The maximum is at a point of the table or where the
+    # derivative is zero within an interval of the table.
+    n_mfp = np.asarray(n_mfp, dtype=float)
+    factors = np.asarray(factors, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.diff(factors) / np.diff(n_mfp)
+        stationary = n_mfp[:-1] + (slope - factors[:-1]) / slope
+    valid = (slope > 0) & np.isfinite(slope)
+    stationary = np.clip(stationary[valid], n_mfp[:-1][valid],
+                         n_mfp[1:][valid])
+
+    n = np.concatenate(([0], n_mfp, stationary))
+    n = n[n >= 0]
+    return float(np.max(np.interp(n, n_mfp, factors) * np.exp(-n)))
+
+
+def get_physics():
+    """ Return the PhysicsCache for the physics data in the current pyshield
+    configuration. A new cache is created if the physics data changed. """
+    keys = (ps.ISOTOPES, ps.MATERIALS, ps.ATTENUATION, ps.BUILDUP)
+    data = [ps.config.get_setting(key) for key in keys]
+    ids = tuple(id(item) for item in data)
+    if _CACHE.get('ids') != ids:
+        ps.logger.debug('Building physics cache')
+        _CACHE['ids'] = ids
+        _CACHE['physics'] = PhysicsCache(*data)
+    physics = _CACHE['physics']
+    physics.tolerance = ps.config.get_setting(ps.TRANSMISSION_TOLERANCE) or 0
+    return physics
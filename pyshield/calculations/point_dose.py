@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Dose of all sources on many points at once.
+
+dose_matrix calculates the dose of each source for an array of points in
+one vectorized pass per source and returns a (points x sources) matrix.
+Details (distance, activity, h10 and shielding) are returned as arrays.
+The pandas table of the point calculations is built from these arrays
+once, with point_table, and only when it is needed.
+"""
+import numpy as np
+import pandas as pd
+
+import pyshield as ps
+from pyshield.calculations.barrier import add_barriers, sum_shielding_lines
+from pyshield.calculations.isotope import dose_from_shielding
+from pyshield.calculations.scenario import compile_scenario
+from pyshield.calculations.spatial_index import get_barrier_index
+
+# fields of the detail array, for each point and source
+DETAILS_DTYPE = np.dtype([('distance', float),  # distance in m
+                          ('activity', float),  # equivalent activity [MBqh]
+                          ('h10', float)])      # uSv/h per MBq/m^2
+
+
+def dose_matrix(points, scenario=None, details=False):
+    """ Dose in mSv of all sources in scenario on points.
+
+    Args:
+        points:   array (N, 2) with the locations of the points
+        scenario: Scenario, by default for the current configuration
+        details:  return the details of the calculation as well
+
+    Returns:
+        dose:      array (N, S) with the dose for each point and source
+        details:   (only if details is True) structured array (N, S) with
+                   DETAILS_DTYPE
+        shielding: (only if details is True) list with for each source a
+                   dictionary with the effective barrier thickness (N, ) of
+                   each material crossed, NaN for points where the
+                   material is not crossed.
+    """
+    if scenario is None:
+        scenario = compile_scenario()
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    sources = scenario.sources
+    barriers = scenario.barriers
+
+    kwargs = {}
+    if scenario.get(ps.GRID_ENGINE) == ps.SWEEP:
+        kwargs['sweep'] = True
+    elif scenario.get(ps.SPATIAL_INDEX) and len(barriers):
+        kwargs['index'] = get_barrier_index(barriers.segments)
+
+    dose = np.zeros((len(points), len(sources)))
+    detail_array = np.zeros((len(points), len(sources)), dtype=DETAILS_DTYPE)
+    shielding = []
+
+    for i, name in enumerate(sources.names):
+        source = sources[name]
+        sum_shielding = sum_shielding_lines(
+            source[ps.LOCATION], points, barriers,
+            scenario.get(ps.INTERSECTION_THICKNESS), **kwargs)
+
+        result = dose_from_shielding(
+            source, points, sum_shielding,
+            height=scenario.get(ps.HEIGHT),
+            disable_buildup=scenario.get(ps.DISABLE_BUILDUP),
+            floor=scenario.get(ps.FLOOR), physics=scenario.physics,
+            activity=sources.activity[i], return_details=True)
+
+        dose[:, i] = result[ps.DOSE_MSV]
+        detail_array['distance'][:, i] = result[ps.SOURCE_POINT_DISTANCE]
+        detail_array['activity'][:, i] = result[ps.ACTIVITY_H]
+        detail_array['h10'][:, i] = result[ps.H10]
+
+        # barrier shielding of each point, NaN if not crossed
+        shielding += [dict([(material, np.where(thickness > 0, thickness,
+                                                np.nan)) \
+                            for material, thickness in sum_shielding.items()])]
+
+    if details:
+        return dose, detail_array, shielding
+    return dose
+
+
+def merge_shielding(parts, sizes):
+    """ Concatenate shielding (see dose_matrix) calculated for consecutive
+    parts of the points, sizes is the number of points of each part. """
+    merged = []
+    for source_parts in zip(*parts):
+        materials = []
+        for part in source_parts:
+            materials += [material for material in part.keys() \
+                          if material not in materials]
+        merged += [dict([(material, np.concatenate(
+            [part.get(material, np.full(size, np.nan)) \
+             for part, size in zip(source_parts, sizes)])) \
+            for material in materials])]
+    return merged
+
+
+def point_table(names, locations, dose, details, shielding, scenario,
+                occupancy=None):
+    """ Pandas table with a row for each point and source, as created by the
+    point calculations (see execute.point_calculations).
+
+    Args:
+        names:     names of the N points
+        locations: locations of the N points (as defined)
+        dose, details, shielding: see dose_matrix
+        scenario:  Scenario used for the calculation
+        occupancy: occupancy factor for each point (default 1)
+
+    Source and point locations are stored as arrays and lists as given.
+    """
+    sources = scenario.sources
+    n_points, n_sources = dose.shape
+    if occupancy is None:
+        occupancy = [1] * n_points
+
+    floor = scenario.get(ps.FLOOR) or {}
+
+    # shielding as text for each point and source, in the same form as for
+    # a single point (barriers, source shielding and floor)
+    shielding_text = np.empty((n_points, n_sources), dtype=object)
+    for j, name in enumerate(sources.names):
+        source_shielding = sources[name].get(ps.MATERIAL, {})
+        for i in range(n_points):
+            total = dict([(material, float(thickness[i])) \
+                          for material, thickness in shielding[j].items() \
+                          if not np.isnan(thickness[i])])
+            total = {**total, **source_shielding}
+            shielding_text[i, j] = str(add_barriers(total, floor))
+
+    source_locations = _objects([np.asarray(sources[name][ps.LOCATION]) \
+                                 for name in sources.names])
+    isotopes = _objects([sources[name][ps.ISOTOPE] for name in sources.names])
+
+    table = pd.DataFrame({
+        ps.SOURCE_LOCATION:        np.tile(source_locations, n_points),
+        ps.POINT_LOCATION:         np.repeat(_objects(locations), n_sources),
+        ps.DISABLE_BUILDUP:        scenario.get(ps.DISABLE_BUILDUP),
+        ps.ISOTOPE:                np.tile(isotopes, n_points),
+        ps.ACTIVITY_H:             details['activity'].ravel(),
+        ps.H10:                    details['h10'].ravel(),
+        ps.TOTAL_SHIELDING:        shielding_text.ravel(),
+        ps.SOURCE_POINT_DISTANCE:  details['distance'].ravel(),
+        ps.DOSE_MSV_PER_ENERGY:    dose.ravel(),
+        ps.DOSE_MSV:               dose.ravel(),
+        ps.INTERSECTION_THICKNESS: scenario.get(ps.INTERSECTION_THICKNESS),
+        ps.HEIGHT:                 scenario.get(ps.HEIGHT),
+        ps.SOURCE_NAME:            np.tile(_objects(sources.names), n_points),
+        ps.POINT_NAME:             np.repeat(_objects(names), n_sources),
+        ps.OCCUPANCY_FACTOR:       np.repeat(occupancy, n_sources)},
+        index=np.tile(np.arange(n_sources), n_points))
+
+    return table
+
+
+def _objects(values):
+    # 1D object array with values, values can be sequences themselves
+    result = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        result[i] = value
+    return result
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Region of interest for the grid calculations.
+
+The region setting limits the dose maps to a part of the floor plan, the
+dose of grid points outside the region is not calculated and is NaN in the
+dose map. The region can be:
+
+    - a polygon [[x, y], ...] in cm, a list of polygons or a dictionary
+      (yml file) with named polygons
+    - a mask image, pixels that are not zero (or not transparent if the
+      image has an alpha channel) are inside. The image covers the floor
+      plan, it does not need to have the same size.
+    - alpha: the non transparent pixels of the floor plan
+
+An empty region ('' or None) is the whole floor plan.
+"""
+import numpy as np
+from matplotlib.path import Path
+
+import pyshield as ps
+
+# raster mask of the last grid, reused as long as region and grid are equal
+_CACHE = {}
+
+
+def compile_region(region, floor_plan):
+    """ Region setting as stored in a Scenario: None, a boolean mask (rows
+    from the bottom of the floor plan, as read by io.read_img) or a list of
+    polygons (arrays (K, 2)). """
+    if region is None or (isinstance(region, (str, list, tuple, dict)) and \
+                          not len(region)):
+        return None
+
+    if isinstance(region, str):
+        if region != ps.ALPHA:
+            raise ValueError('Unknown region: {0}'.format(region))
+        if floor_plan.ndim < 3 or floor_plan.shape[2] != 4:
+            ps.logger.warning('Floor plan has no alpha channel, region '
+                              'is the whole floor plan')
+            return None
+        region = floor_plan
+
+    if isinstance(region, np.ndarray) and region.ndim >= 2 and \
+       region.shape[-1] != 2:
+        mask = np.asarray(region)
+        if mask.ndim == 3:
+            # alpha channel or any color channel
+            mask = mask[:, :, 3] if mask.shape[2] == 4 else mask.max(axis=2)
+        mask = mask > 0
+        if not mask.any():
+            ps.logger.warning('Region mask is empty, region is the whole '
+                              'floor plan')
+            return None
+        mask.flags.writeable = False
+        return mask
+
+    if isinstance(region, dict):
+        region = list(region.values())
+    polygons = np.asarray(region[0], dtype=float)
+    if polygons.ndim == 1:
+        # a single polygon
+        region = [region]
+    return [np.asarray(polygon, dtype=float).reshape(-1, 2) \
+            for polygon in region]
+
+
+def inside_region(region, points, area):
+    """ Boolean array (N, ) that is True for points (N, 2) inside region
+    (see compile_region), area is the area of the floor plan in cm. """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if region is None:
+        return np.ones(len(points), dtype=bool)
+
+    if isinstance(region, np.ndarray):
+        # nearest pixel of the mask, the mask covers area
+        rows, columns = region.shape
+        (x0, x1), (y0, y1) = area
+        column = np.floor((points[:, 0] - x0) / (x1 - x0) * columns)
+        row = np.floor((points[:, 1] - y0) / (y1 - y0) * rows)
+        column = np.clip(column, 0, columns - 1).astype(int)
+        row = np.clip(row, 0, rows - 1).astype(int)
+        return region[row, column]
+
+    inside = np.zeros(len(points), dtype=bool)
+    for polygon in region:
+        # points on the boundary are inside
+        inside |= Path(polygon).contains_points(points, radius=1e-9) | \
+                  Path(polygon[::-1]).contains_points(points, radius=1e-9)
+    return inside
+
+
+def region_mask(scenario, X, Y):
+    """ Boolean array (shape of X) that is True for grid points (X, Y)
+    inside the region of scenario, None if there is no region. """
+    if scenario.region is None:
+        return None
+
+    key = (X.shape, X[0, 0], X[0, -1], Y[0, 0], Y[-1, 0])
+    cached = _CACHE.get('mask')
+    if cached is not None and cached[0] is scenario.region and \
+       cached[1] == key:
+        return cached[2]
+
+    mask = inside_region(scenario.region, np.stack((X.ravel(), Y.ravel()),
+                                                   axis=1), scenario.area)
+    mask = mask.reshape(X.shape)
+    mask.flags.writeable = False
+    _CACHE['mask'] = (scenario.region, key, mask)
+    return mask
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Resample dose values on a polar grid to the cartesian grid of a dose map.
+
+The polar grid has a known structure: samples lie on rays with equidistant
+angles at fixed radii. For each pixel of the cartesian grid the two
+neighbouring rays and radii are found directly and the dose is interpolated
+bilinearly in (angle, radius). Indices and weights are cached by source
+location and grid, so only sources at exactly the same location and
+subsequent runs reuse them. Sources at other locations get a new
+resampler, even if their offset to the grid cells is the same: the polar
+grid covers the whole floor plan from any source, a resampler that could
+be shifted between sources would be several times larger than the dose
+map.
+
+Only polar samples that are used by at least one pixel need a dose value.
+"""
+import numpy as np
+
+import pyshield as ps
+
+# resamplers for recently used source locations and grids
+_CACHE = {}
+CACHE_SIZE = 16
+
+
+class PolarResampler():
+    """ Bilinear interpolation from a polar grid to a cartesian grid.
+
+    Args:
+        offset: (x, y) location of the center (source) of the polar grid
+        ri:     radii of the polar grid (ascending)
+        angles: equidistant angles of the rays over [0, 2 * pi), measured
+                from the y-axis, x = r * sin(angle) and y = r * cos(angle)
+        X, Y:   cartesian grid (meshgrid)
+    """
+    def __init__(self, offset, ri, angles, X, Y):
+        self.offset = np.asarray(offset, dtype=float)
+        self.ri = np.asarray(ri, dtype=float)
+        self.angles = np.asarray(angles, dtype=float)
+        self.shape = X.shape
+
+        n_radii = len(self.ri)
+        n_angles = len(self.angles)
+
+        dx = X.ravel() - self.offset[0]
+        dy = Y.ravel() - self.offset[1]
+        r = np.hypot(dx, dy)
+
+        # pixels beyond the largest radius cannot be interpolated
+        self.inside = np.flatnonzero(r <= self.ri[-1])
+        r = r[self.inside]
+        theta = np.mod(np.arctan2(dx[self.inside], dy[self.inside]), 2 * np.pi)
+
+        # neighbouring rays
+        a = theta / (2 * np.pi / n_angles)
+        a0 = np.floor(a)
+        wa = a - a0
+        a0 = a0.astype(int) % n_angles
+        a1 = (a0 + 1) % n_angles
+
+        # neighbouring radii, pixels within the first radius get the value
+        # of the first radius
+        k0 = np.clip(np.searchsorted(self.ri, r, side='right') - 1,
+                     0, n_radii - 1)
+        k1 = np.minimum(k0 + 1, n_radii - 1)
+        dr = self.ri[k1] - self.ri[k0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wr = np.where(dr > 0, (r - self.ri[k0]) / dr, 0)
+        wr = np.clip(wr, 0, 1)
+
+        # index of the polar sample (ray * n_radii + radius) of each corner
+        corners = np.stack((a0 * n_radii + k0, a0 * n_radii + k1,
+                            a1 * n_radii + k0, a1 * n_radii + k1), axis=1)
+
+        self.weights = np.stack(((1 - wa) * (1 - wr), (1 - wa) * wr,
+                                 wa * (1 - wr), wa * wr), axis=1)
+
+        # polar samples used by any pixel
+        self.samples, inverse = np.unique(corners, return_inverse=True)
+        self.corners = inverse.reshape(corners.shape)
+
+        self.ray_index = self.samples // n_radii
+        self.radius = self.ri[self.samples % n_radii]
+
+    def used(self, mask=None):
+        """ Indices of the samples used by pixels where mask (boolean array
+        with the shape of the cartesian grid) is True, all samples if mask
+        is None. """
+        if mask is None:
+            return np.arange(len(self.samples))
+        return np.unique(self.corners[mask.flat[self.inside]])
+
+    def points(self, mask=None):
+        """ Locations (N, 2) of the polar samples that need a dose value,
+        only samples used by pixels in mask (see used) if mask is given """
+        used = self.used(mask)
+        angles = self.angles[self.ray_index[used]]
+        return self.offset + self.radius[used, np.newaxis] * \
+               np.stack((np.sin(angles), np.cos(angles)), axis=1)
+
+    def resample(self, values, mask=None):
+        """ Interpolate values (N, ) given for each sample in points(mask) to
+        the cartesian grid. Pixels that cannot be interpolated or are outside
+        mask are NaN. """
+        values = np.asarray(values, dtype=float)
+        if mask is not None:
+            all_values = np.full(len(self.samples), np.nan)
+            all_values[self.used(mask)] = values
+            values = all_values
+        result = np.full(self.shape, np.nan)
+        result.flat[self.inside] = np.sum(values[self.corners] * self.weights,
+                                          axis=1)
+        if mask is not None:
+            result[~mask] = np.nan
+        return result
+
+
+def get_resampler(offset, ri, angles, X, Y):
+    """ Return a PolarResampler, resamplers are cached for the CACHE_SIZE most
+    recently used combinations of source location and grids. A resampler is
+    only reused for the same (absolute) source location. """
+    arrays = [np.asarray(item, dtype=float) for item in \
+              (offset, ri, angles, X[0, :], Y[:, 0])]
+    key = b''.join(item.tobytes() for item in arrays) + \
+          np.array(X.shape).tobytes()
+
+    if key in _CACHE.keys():
+        # move to the end (most recently used)
+        _CACHE[key] = _CACHE.pop(key)
+    else:
+        ps.logger.debug('Building polar resampler for source at %s', offset)
+        _CACHE[key] = PolarResampler(offset, ri, angles, X, Y)
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.pop(next(iter(_CACHE)))
+    return _CACHE[key]
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled snapshot of everything a calculation needs. A Scenario is created
+once per run from the pyshield configuration and passed explicitly to the
+calculation kernels and worker processes, which then do not depend on the
+global configuration.
+
+A Scenario is immutable and can be pickled. The physics data is limited to
+the isotopes and materials used, to keep the payload for workers small.
+"""
+import copy
+
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.physics_cache import PhysicsCache
+from pyshield.calculations.region import compile_region
+from pyshield.calculations.sets import BarrierSet, SourceSet
+
+# physics data of the last compiled scenario, reused if the isotopes,
+# materials and physics tables do not change
+_PHYSICS = {}
+
+# settings used by the calculation kernels
+SCENARIO_SETTINGS = (ps.GRID,
+                     ps.GRIDSIZE,
+                     ps.NANGLES,
+                     ps.ORIGIN,
+                     ps.SCALE,
+                     ps.GRID_ENGINE,
+                     ps.POLAR_INTERPOLATION,
+                     ps.SPATIAL_INDEX,
+                     ps.TILE_SIZE,
+                     ps.HEIGHT,
+                     ps.FLOOR,
+                     ps.DISABLE_BUILDUP,
+                     ps.INTERSECTION_THICKNESS,
+                     ps.TRANSMISSION_TOLERANCE,
+                     ps.ADAPTIVE_LEVELS,
+                     ps.ADAPTIVE_TOLERANCE,
+                     ps.DOSE_FLOOR,
+                     ps.VISUALIZATION)
+
+
+class Scenario():
+    """ Immutable snapshot of a calculation.
+
+    Args:
+        barriers:   dictionary with barriers
+        sources:    dictionary with sources
+        points:     dictionary with points
+        physics:    prepared PhysicsCache
+        settings:   dictionary with (at least) the SCENARIO_SETTINGS
+        floor_plan_shape: shape of the floor plan in pixels
+        region:     region of interest for the grid (see
+                    region.compile_region), None for the whole floor plan
+
+    Attributes:
+        barriers:   BarrierSet
+        sources:    SourceSet
+        area, span: area and size of the floor plan in cm
+        region:     region of interest or None
+    """
+    def __init__(self, barriers, sources, points, physics, settings,
+                 floor_plan_shape, region=None):
+        self.barriers = BarrierSet.from_dict(barriers)
+        self.sources = SourceSet(copy.deepcopy(sources), physics.isotopes)
+        self.points = copy.deepcopy(points)
+        self.physics = physics
+        self.region = region
+        self._settings = dict([(key, copy.deepcopy(settings.get(key))) \
+                               for key in SCENARIO_SETTINGS])
+
+        origin = np.array(self.get(ps.ORIGIN))
+        span = np.array(floor_plan_shape[0:2]) * self.get(ps.SCALE)
+        self.span = span
+        self.area = ((-origin[0], span[1] - origin[0]),
+                     (-origin[1], span[0] - origin[1]))
+
+        self.span.flags.writeable = False
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('Scenario is immutable')
+        object.__setattr__(self, name, value)
+
+    def get(self, key):
+        """ Value of a setting in the scenario """
+        return self._settings[key]
+
+    def parts(self):
+        """ Dictionary with the parts (barriers, sources, physics, ...) of
+        the scenario, see from_parts. """
+        return dict([(name, value) for name, value in vars(self).items() \
+                     if name != '_frozen'])
+
+    @classmethod
+    def from_parts(cls, parts):
+        """ Scenario made of parts (see parts), the parts are not copied """
+        scenario = cls.__new__(cls)
+        for name, value in parts.items():
+            object.__setattr__(scenario, name, value)
+        object.__setattr__(scenario, '_frozen', True)
+        return scenario
+
+
+def compile_scenario():
+    """ Create a Scenario from the current pyshield configuration. Physics
+    data is interpolated once for all isotopes and materials used. """
+    barriers = ps.config.get_setting(ps.BARRIERS) or {}
+    sources = ps.config.get_setting(ps.SOURCES) or {}
+    points = ps.config.get_setting(ps.POINTS) or {}
+    floor = ps.config.get_setting(ps.FLOOR) or {}
+
+    isotopes = set(source[ps.ISOTOPE] for source in sources.values())
+    materials = set(floor)
+    for item in list(barriers.values()) + list(sources.values()):
+        materials.update(item.get(ps.MATERIAL, {}).keys())
+
+    settings = dict([(key, ps.config.get_setting(key)) \
+                     for key in SCENARIO_SETTINGS])
+
+    physics = _compile_physics(isotopes, materials, settings)
+
+    floor_plan = ps.config.get_setting(ps.FLOOR_PLAN)
+    region = compile_region(ps.config.get_setting(ps.REGION), floor_plan)
+
+    return Scenario(barriers, sources, points, physics, settings,
+                    floor_plan.shape, region)
+
+
+def _compile_physics(isotopes, materials, settings):
+    # PhysicsCache limited to isotopes and materials, the last one is reused
+    # by subsequent runs with the same physics data
+    all_isotopes = ps.config.get_setting(ps.ISOTOPES)
+    all_materials = ps.config.get_setting(ps.MATERIALS)
+    attenuation = ps.config.get_setting(ps.ATTENUATION)
+    buildup = ps.config.get_setting(ps.BUILDUP)
+
+    tolerance = settings[ps.TRANSMISSION_TOLERANCE] or 0
+    disable_buildup = settings[ps.DISABLE_BUILDUP]
+
+    key = (tuple(sorted(isotopes)), tuple(sorted(materials)), tolerance,
+           disable_buildup, id(all_isotopes), id(all_materials),
+           id(attenuation), id(buildup))
+    if _PHYSICS.get('key') == key:
+        return _PHYSICS['physics']
+
+    physics = PhysicsCache(
+        isotopes=dict([(isotope, all_isotopes[isotope]) \
+                       for isotope in isotopes]),
+        materials=dict([(material, all_materials[material]) \
+                        for material in materials]),
+        attenuation=dict([(material, attenuation[material]) \
+                          for material in materials]),
+        buildup=dict([(material, buildup[material]) for material in \
+                      materials if material in buildup.keys()]),
+        tolerance=tolerance)
+
+    physics.prepare(isotopes, materials, disable_buildup=disable_buildup)
+
+    _PHYSICS['key'] = key
+    _PHYSICS['physics'] = physics
+    return physics
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Array backed containers for barriers and sources. The dictionaries loaded
+from yaml are converted once, calculations use the arrays directly.
+"""
+import numpy as np
+
+import pyshield as ps
+from pyshield.calculations.isotope import equivalent_activity
+
+
+class BarrierSet():
+    """ Barriers as arrays.
+
+    Attributes:
+        names:     tuple with the name of each of the M barriers
+        segments:  array (M, 4) with the location (x0, y0, x1, y1) of each
+                   barrier
+        materials: tuple with all K materials used by the barriers
+        thickness: array (M, K) with the thickness of each material for
+                   each barrier
+    """
+    def __init__(self, names, segments, materials, thickness):
+        self.names = tuple(names)
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        self.materials = tuple(materials)
+        self.thickness = np.asarray(thickness, dtype=float).reshape(
+            len(self.segments), len(self.materials))
+
+        self.segments.flags.writeable = False
+        self.thickness.flags.writeable = False
+
+    @classmethod
+    def from_dict(cls, barriers):
+        """ Create a BarrierSet from a dictionary with barriers """
+        materials = []
+        for barrier in barriers.values():
+            for material in barrier[ps.MATERIAL].keys():
+                if material not in materials:
+                    materials.append(material)
+
+        segments = np.zeros((len(barriers), 4))
+        thickness = np.zeros((len(barriers), len(materials)))
+        for i, barrier in enumerate(barriers.values()):
+            segments[i] = barrier[ps.LOCATION]
+            for material, value in barrier[ps.MATERIAL].items():
+                thickness[i, materials.index(material)] = np.squeeze(value)
+
+        return cls(barriers.keys(), segments, materials, thickness)
+
+    def __len__(self):
+        return len(self.segments)
+
+
+class SourceSet():
+    """ Sources as arrays. The original definition of each source is kept,
+    SourceSet can be used as a read only dictionary with the definitions.
+
+    Attributes:
+        names:     tuple with the name of each of the S sources
+        locations: array (S, 2) with the location of each source
+        activity:  array (S, ) equivalent activity [MBqh] of each source
+    """
+    def __init__(self, sources, isotopes=None):
+        self.definitions = dict(sources)
+        for source in self.definitions.values():
+            if not(isinstance(source.get(ps.TYPE, []), (list, tuple))):
+                source[ps.TYPE] = [source[ps.TYPE]]
+
+        definitions = self.definitions.values()
+
+        self.names = tuple(self.definitions.keys())
+        self.locations = np.array([source[ps.LOCATION] for source in \
+                                   definitions], dtype=float).reshape(-1, 2)
+
+        self.activity = np.array([equivalent_activity(source, isotopes) \
+                                  for source in definitions], dtype=float)
+
+        for item in (self.locations, self.activity):
+            item.flags.writeable = False
+
+    def index(self, name):
+        """ Index of source name """
+        return self.names.index(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name):
+        return self.definitions[name]
+
+    def keys(self):
+        return self.definitions.keys()
+
+    def values(self):
+        return self.definitions.values()
+
+    def items(self):
+        return self.definitions.items()
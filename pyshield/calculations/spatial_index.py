@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index for barriers. Barriers are stored on a uniform grid, each
+cell lists the barriers whose bounding box overlaps the cell. Locations are
+binned with the same cell size, for each bin only the barriers that can be
+crossed by a line from the source to any location in the bin are tested for
+intersection.
+
+A barrier can be crossed if its line piece overlaps the convex hull of the
+source location and the bounding box of the locations in the bin. The
+barriers in the grid cells covered by the bounding box of the hull are
+tested on their bounding boxes first and with a separating axis test on the
+remaining barriers.
+"""
+import numpy as np
+
+import pyshield as ps
+
+# last index that was built, reused as long as the barriers do not change
+_CACHE = {}
+
+
+class BarrierIndex():
+    """ Uniform grid over the extent of the barriers, each cell lists the
+    barriers whose bounding box overlaps the cell.
+
+    Args:
+        segments:  array (M, 4) with the location (x0, y0, x1, y1) of each
+                   barrier
+        cell_size: size of the grid cells in cm, by default the size is
+                   chosen such that there is about one barrier per cell.
+    """
+    def __init__(self, segments, cell_size=None):
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+
+        # bounding box of each barrier (xmin, ymin, xmax, ymax)
+        self.boxes = np.stack((np.minimum(self.segments[:, 0], self.segments[:, 2]),
+                               np.minimum(self.segments[:, 1], self.segments[:, 3]),
+                               np.maximum(self.segments[:, 0], self.segments[:, 2]),
+                               np.maximum(self.segments[:, 1], self.segments[:, 3])),
+                              axis=1)
+
+        if cell_size is None:
+            cell_size = default_cell_size(self.boxes)
+        self.cell_size = cell_size
+
+        # range of cells covered by the bounding box of each barrier
+        self.origin = self.boxes[:, :2].min(axis=0) if len(self.boxes) \
+                      else np.zeros(2)
+        first = self._cells(self.boxes[:, :2])
+        last = self._cells(self.boxes[:, 2:])
+        self.shape = last.max(axis=0) + 1 if len(self.boxes) \
+                     else np.ones(2, dtype=np.int64)
+
+        # (cell, barrier) pairs sorted by cell, the barriers of cell c are
+        # items[start[c]:start[c + 1]] in barrier order
+        nx, ny = (last - first + 1).T
+        counts = nx * ny
+        barrier = np.repeat(np.arange(len(self.boxes)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                     counts)
+        cell = (first[barrier, 1] + offset // nx[barrier]) * self.shape[0] + \
+               first[barrier, 0] + offset % nx[barrier]
+        order = np.argsort(cell, kind='stable')
+        self.items = barrier[order]
+        self.start = np.searchsorted(cell[order],
+                                     np.arange(np.prod(self.shape) + 1))
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _cells(self, locations):
+        # (column, row) of the grid cell of each location
+        cells = np.floor((locations - self.origin) / self.cell_size)
+        return cells.astype(np.int64)
+
+    def bins(self, locations):
+        """ Group locations by grid cell. Returns a list with an array of
+        location indices for each occupied cell. """
+        cells = np.floor(np.asarray(locations) / self.cell_size).astype(np.int64)
+        _, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        splits = np.flatnonzero(np.diff(inverse[order])) + 1
+        return np.split(order, splits)
+
+    def query_box(self, box):
+        """ Indices (sorted) of barriers with a bounding box overlapping box
+        (xmin, ymin, xmax, ymax). """
+        box = np.asarray(box, dtype=float)
+        low = np.maximum(self._cells(box[:2]), 0)
+        high = np.minimum(self._cells(box[2:]), self.shape - 1)
+        if np.any(high < low):
+            return np.zeros(0, dtype=np.int64)
+
+        # barriers listed in the cells covered by box
+        columns = np.arange(low[0], high[0] + 1)
+        rows = np.arange(low[1], high[1] + 1)
+        cells = (rows[:, None] * self.shape[0] + columns).ravel()
+        if len(cells) >= len(self.start) // 2:
+            # most of the grid, test all barriers
+            candidates = np.arange(len(self.boxes))
+        else:
+            starts = self.start[cells]
+            counts = self.start[cells + 1] - starts
+            index = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+                    np.arange(counts.sum())
+            candidates = np.unique(self.items[index])
+
+        boxes = self.boxes[candidates]
+        overlap = (boxes[:, 0] <= box[2]) & (boxes[:, 2] >= box[0]) & \
+                  (boxes[:, 1] <= box[3]) & (boxes[:, 3] >= box[1])
+        return candidates[overlap]
+
+    def query_rays(self, origin, ends):
+        """ Indices (sorted) of barriers that can be crossed by a line from
+        origin to any of the points in ends (array (N, 2)). """
+        origin = np.asarray(origin, dtype=float)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+
+        xmin, ymin = np.minimum(ends.min(axis=0), origin)
+        xmax, ymax = np.maximum(ends.max(axis=0), origin)
+
+        candidates = self.query_box((xmin, ymin, xmax, ymax))
+        if len(candidates) == 0:
+            return candidates
+
+        # polygon: origin and corners of the bounding box of ends
+        e_min, e_max = ends.min(axis=0), ends.max(axis=0)
+        polygon = np.array((origin,
+                            (e_min[0], e_min[1]), (e_max[0], e_min[1]),
+                            (e_max[0], e_max[1]), (e_min[0], e_max[1])))
+
+        # separating axes, normals of all edges of the convex hull of the
+        # polygon are included (x, y and the lines origin-corner)
+        directions = polygon[1:] - origin
+        axes = np.concatenate((((1, 0), (0, 1)),
+                               np.stack((-directions[:, 1], directions[:, 0]),
+                                        axis=1)))
+
+        segments = self.segments[candidates]
+        p0, p1 = segments[:, 0:2], segments[:, 2:4]
+
+        poly_proj = polygon.dot(axes.T)            # (5, A)
+        seg_proj = np.stack((p0.dot(axes.T), p1.dot(axes.T)))  # (2, C, A)
+
+        separated = (seg_proj.max(axis=0) < poly_proj.min(axis=0)) | \
+                    (seg_proj.min(axis=0) > poly_proj.max(axis=0))
+        separated = separated.any(axis=1)
+
+        # normal of each barrier as separating axis
+        normal = np.stack((p0[:, 1] - p1[:, 1], p1[:, 0] - p0[:, 0]), axis=1)
+        seg_offset = np.sum(normal * p0, axis=1)
+        poly_normal = polygon.dot(normal.T)        # (5, C)
+        separated |= (poly_normal.max(axis=0) < seg_offset) | \
+                     (poly_normal.min(axis=0) > seg_offset)
+
+        return candidates[~separated]
+
+    def ray_chunks(self, origin, ends, max_rows=None):
+        """ Split the lines from origin to each point in ends in spatially
+        coherent chunks. Yields (rows, barriers) with the indices of the
+        points in the chunk and the indices of the barriers that can be
+        crossed by those lines. """
+        for rows in self.bins(ends):
+            if max_rows is not None and len(rows) > max_rows:
+                parts = np.array_split(rows, int(np.ceil(len(rows) / max_rows)))
+            else:
+                parts = (rows,)
+            for part in parts:
+                yield part, self.query_rays(origin, ends[part])
+
+
+def default_cell_size(boxes):
+    """ Cell size for which the area of the barrier extent is divided in
+    about as many cells as there are barriers. """
+    if len(boxes) == 0:
+        return 100.
+    width = boxes[:, 2].max() - boxes[:, 0].min()
+    height = boxes[:, 3].max() - boxes[:, 1].min()
+    cell_size = np.sqrt(max(width * height, 1) / len(boxes))
+    return float(max(cell_size, 1))
+
+
+def get_barrier_index(segments):
+    """ Return a BarrierIndex for segments. The index is built once and
+    reused as long as the barrier locations do not change. """
+    segments = np.asarray(segments, dtype=float)
+    key = segments.tobytes()
+    # key and index are stored as one item, worker threads always see a
+    # matching pair
+    cached = _CACHE.get('index')
+    if cached is None or cached[0] != key:
+        ps.logger.debug('Building spatial index for %s barriers', len(segments))
+        cached = (key, BarrierIndex(segments))
+        _CACHE['index'] = cached
+    return cached[1]
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Angular sweep engine to calculate the shielding between a point source and
+many locations.
+
+Seen from the source each barrier covers an angular interval. The end points
+of all barriers divide the full circle in sectors, within a sector the set of
+barriers that can be crossed is fixed. The set is determined once per sector,
+locations in a sector are only intersected with the barriers of that set.
+Every barrier crossed by a line from the source to the location is in the
+set, so the intersections (and the rule for shared intersection points) are
+the same as for intersecting all barriers.
+
+Locations that lie on the boundary of a sector (in line with the source and
+a barrier end point) are intersected with all barriers, barriers that end
+on the boundary can be touched by those lines.
+"""
+import numpy as np
+
+import pyshield as ps
+
+# relative tolerance to decide if a location is in line with a barrier end point
+COLLINEAR_TOLERANCE = 1e-9
+
+
+def sweep_thickness(source_location, locations, segments, thickness,
+                    intersection_thickness=True, max_matrix_size=2**20):
+    """ Effective thickness of each material between the source and each
+    location.
+
+    Args:
+        source_location: (x, y) of the source
+        locations:       array (N, 2) with locations
+        segments:        array (M, 4) with the barriers (x0, y0, x1, y1)
+        thickness:       array (M, K) thickness of each material per barrier
+        intersection_thickness: correct thickness for oblique intersections
+        max_matrix_size: maximum number of elements of the (locations x
+                         barriers) matrices per sector.
+    Returns:
+        sum_thickness: array (N, K) with the summed effective thickness
+        used:          boolean array (K, ), True for materials of barriers
+                       that were crossed at least once
+    """
+    source = np.asarray(source_location, dtype=float)
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    thickness = np.asarray(thickness, dtype=float)
+
+    sum_thickness = np.zeros((len(locations), thickness.shape[1]))
+    used = np.zeros(thickness.shape[1], dtype=bool)
+
+    if len(segments) == 0 or len(locations) == 0:
+        return sum_thickness, used
+
+    def add(rows, cols, hit, factor):
+        sum_thickness[rows] = factor.dot(thickness[cols])
+        used[:] |= (hit.any(axis=0)[:, np.newaxis] & \
+                    (thickness[cols] > 0)).any(axis=0)
+
+    events, start, span = angular_intervals(source, segments)
+
+    # barriers in line with the source are never crossed (parallel)
+    valid = span > 0
+
+    angle = _angle(locations - source)
+    sector = np.searchsorted(events, angle, side='right') - 1
+    sector[sector < 0] = len(events) - 1
+
+    boundary = _on_boundary(source, locations, segments, events, sector)
+
+    # sectors with at least one location inside
+    inside = np.flatnonzero(~boundary)
+    order = inside[np.argsort(sector[inside], kind='stable')]
+    occupied, first = np.unique(sector[order], return_index=True)
+    groups = np.split(order, first[1:])
+
+    # angle in the middle of each occupied sector
+    upper = np.append(events[1:], events[0] + 2 * np.pi)
+    middle = 0.5 * (events[occupied] + upper[occupied])
+
+    for rows, mid in zip(groups, middle):
+        covers = valid & (np.mod(mid - start, 2 * np.pi) < span)
+        cols = np.flatnonzero(covers)
+        if len(cols) == 0:
+            continue
+        step = max(1, max_matrix_size // len(cols))
+        for i in range(0, len(rows), step):
+            part = rows[i:i + step]
+            hit, factor = ps.line_intersect.intersect_rays(source,
+                                                           locations[part],
+                                                           segments[cols],
+                                                           intersection_thickness)
+            add(part, cols, hit, factor)
+
+    # full intersection test for locations on a sector boundary
+    rows = np.flatnonzero(boundary)
+    step = max(1, max_matrix_size // len(segments))
+    for i in range(0, len(rows), step):
+        part = rows[i:i + step]
+        hit, factor = ps.line_intersect.intersect_rays(source, locations[part],
+                                                       segments,
+                                                       intersection_thickness)
+        add(part, slice(None), hit, factor)
+
+    return sum_thickness, used
+
+
+def angular_intervals(source, segments):
+    """ Angular interval of each barrier seen from the source.
+
+    Returns:
+        events: sorted unique angles [-pi, pi) of all barrier end points
+        start:  start angle of the interval of each barrier
+        span:   angular width (< pi) of the interval of each barrier, 0 for
+                barriers in line with the source and 2 * pi for barriers
+                through the source
+    """
+    a = _angle(segments[:, 0:2] - source)
+    b = _angle(segments[:, 2:4] - source)
+
+    # shortest angular distance from a to b in [-pi, pi)
+    delta = np.mod(b - a + np.pi, 2 * np.pi) - np.pi
+    start = np.where(delta >= 0, a, b)
+    span = np.abs(delta)
+
+    # the barrier line passes through the source. A barrier in line with
+    # the source cannot be crossed, a barrier through the source (end points
+    # on both sides or at the source) is crossed by every line, at the
+    # source.
+    d0, d1 = segments[:, 0:2] - source, segments[:, 2:4] - source
+    collinear = _cross(d0, d1) == 0
+    span[collinear] = 0
+    span[collinear & (np.sum(d0 * d1, axis=1) <= 0)] = 2 * np.pi
+
+    events = np.unique(np.concatenate((a, b)))
+    return events, start, span
+
+
+def _on_boundary(source, locations, segments, events, sector):
+    # True for locations (nearly) in line with the source and a barrier end
+    # point that bounds its sector
+    endpoints = np.concatenate((segments[:, 0:2], segments[:, 2:4]))
+    endpoint_angle = _angle(endpoints - source)
+
+    # direction of an end point for each event angle
+    index = np.searchsorted(np.sort(endpoint_angle), events)
+    directions = (endpoints[np.argsort(endpoint_angle)] - source)[index]
+
+    upper = np.mod(sector + 1, len(events))
+    d = locations - source
+    length = np.hypot(d[:, 0], d[:, 1])
+
+    boundary = np.zeros(len(locations), dtype=bool)
+    for bound in (sector, upper):
+        e = directions[bound]
+        tolerance = COLLINEAR_TOLERANCE * length * np.hypot(e[:, 0], e[:, 1])
+        # same direction, not opposite
+        boundary |= (np.abs(_cross(d, e)) <= tolerance) & \
+                    (np.sum(d * e, axis=1) > 0)
+    return boundary
+
+
+def _angle(d):
+    return np.arctan2(d[..., 1], d[..., 0])
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
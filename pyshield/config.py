@@ -26,6 +26,9 @@ def __str__():
          elif key in (ps.FLOOR_PLAN,):
              value = 'Size: ' + str(CONFIG[key].shape) 
              config_str += formatter.format(key, value)
+         elif key == ps.REGION and isinstance(CONFIG[key], np.ndarray):
+             value = 'Mask: ' + str(CONFIG[key].shape)
+             config_str += formatter.format(key, value)
          elif key in (ps.BUILDUP,ps.ATTENUATION, ps.ISOTOPES, ps.MATERIALS):
              value = str(tuple(CONFIG[key].keys()))
              config_str += formatter.format(key, value)
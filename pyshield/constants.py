@@ -43,12 +43,35 @@ MASS_ATTENUATION =              'mu/p [cm^2/g]'
 CALCULATE =                     'calculate'
 POLAR =                         'polar'
 CARTESIAN =                     'cartesian'
+ADAPTIVE =                      'adaptive'
+ADAPTIVE_LEVELS =               'adaptive_levels'
+ADAPTIVE_TOLERANCE =            'adaptive_tolerance'
+REGION =                        'region'
+ALPHA =                         'alpha'
+DOSE_FLOOR =                    'dose_floor'
+STREAM_SUM =                    'stream_sum'
+SPILL_FOLDER =                  'spill_folder'
+MAP_STORE =                     'map_store'
 NANGLES =                       'number_of_angles'
 GRID =                          'grid'
+GRID_ENGINE =                   'grid_engine'
+RAYS =                          'rays'
+SWEEP =                         'sweep'
+POLAR_RAYS =                    'polar_rays'
+POLAR_INTERPOLATION =           'polar_interpolation'
+TILE_SIZE =                     'tile_size'
+DOSE_MAP_CACHE =                'dose_map_cache'
+INCREMENTAL =                   'incremental'
+BILINEAR =                      'bilinear'
+GRIDDATA =                      'griddata'
 GRIDSIZE =                      'grid_size'
 INTERSECTION_THICKNESS =        'intersection_thickness'
 DISABLE_BUILDUP =               'disable_buildup'
 MULTI_CPU =                     'multi_cpu'
+THREADS =                       'threads'
+SPATIAL_INDEX =                 'spatial_index'
+TRANSMISSION_TOLERANCE =        'transmission_tolerance'
+VALIDATE_TRANSMISSION =         'validate_transmission'
 
 
 #--------------------Logging---------------------------------------------------
@@ -119,6 +142,7 @@ FIGURE    =                     'figure'
 TABLE     =                     'table'
 SUM_TABLE =                     'sum_table'
 TABLE     =                     'table'
+CONTOURS =                      'contours'
 SOURCE_TABLE =                  'source_table'
 
 #--------------------Visualization---------------------------------------------
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Long lived calculation engine. The engine owns the worker pool, which is
+started once and reused by subsequent runs (e.g. the optimisation loops in
+tools.hvt and the double click dose readout in the visualization).
+
+Workers do not receive the scenario with every task. The engine writes each
+part of a new scenario (barriers, sources, physics, ...) to its own file and
+a snapshot file with a version number lists the part files, tasks only carry
+the (snapshot, version) reference. Parts that did not change since the
+previous scenario keep their file. A worker loads the snapshot when it sees
+a new version, only the part files it has not loaded before are read, and
+keeps the scenario in memory for all following tasks. Large arrays of the
+parts (barriers, physics tables) are placed in shared memory, all workers
+read the same copy.
+
+Input and output arrays of a calculation (grid points, dose values) can be
+placed in shared memory with Engine.share, workers then read their input
+and write their results without pickling.
+
+With threads=True the engine uses a thread pool instead. The vectorized
+numpy calculations release the GIL for most of their work, threads share
+the scenario and arrays directly and nothing is pickled or copied. Work is
+split in chunks that fit in the cache of a core (chunk_size).
+"""
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+from itertools import repeat
+import os
+import pickle
+import tempfile
+
+from pathos import multiprocessing
+import numpy as np
+
+import pyshield as ps
+from pyshield.shared import SharedArrays, dump_shared, load_shared
+
+NCORES = multiprocessing.cpu_count()
+
+# cache size (bytes) per core used to size the chunks for threads, and the
+# approximate number of (points x barriers) float arrays alive while
+# calculating the shielding of a chunk
+CACHE_BYTES = 2**21
+CHUNK_ARRAYS = 8
+
+# limits for the number of points in a chunk
+MIN_CHUNK_SIZE = 256
+MAX_CHUNK_SIZE = 2**14
+
+# scenario loaded by this (worker) process: {'snapshot': (file, version),
+# 'scenario': Scenario, 'parts': {part file: (SharedArrays, part)}}
+_WORKER_STATE = {}
+
+# engine used by run_with_configuration
+_ENGINE = {}
+
+
+class Engine():
+    """ Run calculations for a scenario on a persistent worker pool.
+
+    Args:
+        ncores:  number of workers, if None calculations are done in the
+                 calling process.
+        threads: use worker threads instead of worker processes
+    """
+    def __init__(self, ncores=NCORES, threads=False):
+        self.ncores = ncores
+        self.threads = threads
+        self.version = 0
+        self.scenario = None
+        self._pool = None
+        self._file = None
+        # {part name: (key, file, SharedArrays, part)} of the scenario
+        self._parts = {}
+
+    @property
+    def multi_cpu(self):
+        return self.ncores is not None
+
+    @property
+    def processes(self):
+        return self.multi_cpu and not self.threads
+
+    def start(self):
+        """ Start the worker pool (if not started yet) """
+        if self.threads and self._pool is None:
+            self._pool = ThreadPoolExecutor(self.ncores)
+            msg = '---MULTI THREAD ENGINE STARTED with {0} threads---\n'
+            ps.logger.info(msg.format(self.ncores))
+        elif self.processes and self._pool is None:
+            if not(os.name == 'posix'):
+                raise RuntimeError('Multi processing not available in Windows')
+            self._pool = multiprocessing.ProcessPool(self.ncores)
+            handle, self._file = tempfile.mkstemp(prefix='pyshield_',
+                                                  suffix='.pickle')
+            os.close(handle)
+            msg = '---MULTI CPU ENGINE STARTED with {0} cpu\'s---\n'
+            ps.logger.info(msg.format(self.ncores))
+        return self
+
+    def update(self, scenario):
+        """ Set the scenario for the next calculations. Workers load the new
+        scenario once, at their first task after the update. Only the parts
+        of the scenario that changed are written and loaded again. """
+        self.scenario = scenario
+        self.version += 1
+        if self.processes:
+            self.start()
+            parts = {}
+            for name, part in scenario.parts().items():
+                previous = self._parts.get(name)
+                key = _part_key(name, part, previous)
+                if previous is not None and previous[0] == key:
+                    parts[name] = previous
+                    continue
+                handle, file = tempfile.mkstemp(prefix='pyshield_',
+                                                suffix='.pickle')
+                with os.fdopen(handle, 'wb') as part_file:
+                    shared = dump_shared(part, part_file)
+                parts[name] = (key, file, shared, part)
+
+            changed = [name for name, part in parts.items() \
+                       if self._parts.get(name) is not part]
+            ps.logger.debug('Scenario parts sent to workers: %s', changed)
+            self._remove_parts([part for name, part in self._parts.items() \
+                                if parts.get(name) is not part])
+            self._parts = parts
+
+            with open(self._file, 'wb') as file:
+                pickle.dump((self.version,
+                             dict([(name, part[1]) \
+                                   for name, part in parts.items()])), file)
+
+    def share(self, arrays=None, empty=None):
+        """ Arrays for the input and output of tasks. For worker processes
+        the arrays are placed in shared memory (SharedArrays), otherwise a
+        dictionary with the arrays is returned. Release the arrays with
+        release when the calculation is finished.
+
+        Args:
+            arrays: dictionary with arrays (copied)
+            empty:  dictionary with (shape, dtype) of arrays filled with zeros
+        """
+        if self.processes:
+            return SharedArrays(arrays, empty)
+
+        result = dict(arrays or {})
+        for name, (shape, dtype) in (empty or {}).items():
+            result[name] = np.zeros(shape, dtype=dtype)
+        return result
+
+    def release(self, arrays):
+        """ Release arrays created by share """
+        if isinstance(arrays, SharedArrays):
+            arrays.close()
+
+    def map(self, func, items):
+        """ Return [func(item, scenario) for item in items] """
+        if not self.multi_cpu:
+            return [func(item, self.scenario) for item in items]
+        if self.threads:
+            return list(self._pool.map(func, items, repeat(self.scenario)))
+        return self._pool.map(_run_task, self._tasks(func, items))
+
+    def imap_unordered(self, func, items):
+        """ Iterate over func(item, scenario) for all items in the order in
+        which they finish. Items are handed out one at a time, idle workers
+        take the next item. """
+        if not self.multi_cpu:
+            return (func(item, self.scenario) for item in items)
+        if self.threads:
+            futures = [self._pool.submit(func, item, self.scenario) \
+                       for item in items]
+            return (future.result() for future in as_completed(futures))
+        return self._pool.uimap(_run_task, self._tasks(func, items))
+
+    def chunk_size(self, n_points, n_barriers):
+        """ Number of points per job. Worker processes get all n_points in one
+        job (least pickling), threads get chunks for which the intermediate
+        (points x barriers) arrays fit in the cache of a core. """
+        if not self.threads:
+            return max(n_points, 1)
+        size = CACHE_BYTES // (CHUNK_ARRAYS * 8 * (1 + n_barriers))
+        return int(np.clip(size, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE))
+
+    def _tasks(self, func, items):
+        snapshot = (self._file, self.version)
+        return [(snapshot, func, item) for item in items]
+
+    def close(self):
+        """ Stop the worker pool and remove the snapshot file """
+        if self.threads and self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        elif self._pool is not None:
+            self._pool.terminate()
+            # remove terminated pool from the pathos cache
+            self._pool.clear()
+            self._pool = None
+        if self._file is not None and os.path.exists(self._file):
+            os.remove(self._file)
+        self._file = None
+        self._remove_parts(self._parts.values())
+        self._parts = {}
+
+    def _remove_parts(self, parts):
+        # remove the files and shared memory of scenario parts
+        for _, file, shared, _ in parts:
+            if os.path.exists(file):
+                os.remove(file)
+            shared.close()
+
+
+def _part_key(name, part, previous):
+    # key of a scenario part, equal keys are equal parts. The physics data
+    # is reused as the same object by compile_scenario if it did not
+    # change, other parts are compared by content.
+    if previous is not None and previous[3] is part:
+        return previous[0]
+    if name == 'physics':
+        return id(part)
+    return hashlib.sha1(pickle.dumps(part,
+                                     protocol=pickle.HIGHEST_PROTOCOL)).digest()
+
+
+def _run_task(task):
+    # execute a task in a worker, load the scenario if it changed
+    snapshot, func, item = task
+    if _WORKER_STATE.get('snapshot') != snapshot:
+        # release the previous scenario before the parts it used
+        _WORKER_STATE.pop('scenario', None)
+
+        with open(snapshot[0], 'rb') as file:
+            version, files = pickle.load(file)
+        if version != snapshot[1]:
+            raise RuntimeError('Scenario snapshot changed during calculation')
+
+        # parts loaded for a previous version are kept
+        loaded = _WORKER_STATE.get('parts', {})
+        parts = {}
+        for file_name in files.values():
+            if file_name not in loaded.keys():
+                with open(file_name, 'rb') as file:
+                    loaded[file_name] = load_shared(file)
+            parts[file_name] = loaded[file_name]
+        _WORKER_STATE['parts'] = parts
+
+        scenario = ps.scenario.Scenario.from_parts(
+            dict([(name, parts[file_name][1]) \
+                  for name, file_name in files.items()]))
+        _WORKER_STATE['snapshot'] = snapshot
+        _WORKER_STATE['scenario'] = scenario
+    return func(item, _WORKER_STATE['scenario'])
+
+
+def get_engine(multi_cpu=False):
+    """ Return the engine for single or multi cpu calculations. multi_cpu is
+    True for worker processes or 'threads' for worker threads. Multi cpu
+    engines and their workers are created once and reused. """
+    key = ps.THREADS if multi_cpu == ps.THREADS else bool(multi_cpu)
+    if key not in _ENGINE.keys():
+        _ENGINE[key] = Engine(NCORES if multi_cpu else None,
+                              threads=(key == ps.THREADS))
+    return _ENGINE[key].start()
+
+
+def shutdown():
+    """ Stop all engines """
+    for engine in _ENGINE.values():
+        engine.close()
+    _ENGINE.clear()
+
+
+atexit.register(shutdown)
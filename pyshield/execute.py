@@ -5,15 +5,15 @@ Created on Mon Mar 28 18:17:39 2016
 @author: msegbers
 """
 
-from pathos import multiprocessing
 import os
+import re
 from timeit import default_timer as timer
-import pandas as pd
+import numpy as np
 from natsort import index_natsorted
 import matplotlib.pyplot as plt
 import pyshield as ps
 
-NCORES = multiprocessing.cpu_count()
+NCORES = ps.engine.NCORES
 
 def run_with_configuration(config=None, **kwargs):
     """ Call this module to start pyshield. Depending on the settings calculations
@@ -50,8 +50,15 @@ def run_with_configuration(config=None, **kwargs):
     # save original config params
     ps.RUN_CONFIGURATION = ps.config.get_config()
 
-    # map for single core or multiprocessing.pool.map for multi-core
-    pool, worker = _get_worker()
+    # compile the calculation data once, physics data is interpolated once
+    # for all isotopes and materials used
+    scenario = _compile_scenario()
+    ps.RUN_SCENARIO = scenario
+
+    # engine for single core or multi-core, the multi-core worker pool is
+    # kept for following runs
+    engine = _get_engine()
+    engine.update(scenario)
 
     result = {} # gather calculation results
     
@@ -60,18 +67,18 @@ def run_with_configuration(config=None, **kwargs):
     if ps.GRID in calc_setting and ps.config.get_setting(ps.SOURCES):
         ps.logger.debug('Start grid calculations')
         # perform grid calculations
-        dose_maps = grid_calculations(worker)
+        dose_maps = grid_calculations(engine)
         result[ps.DOSE_MAPS] = dose_maps
     if ps.POINTS in calc_setting and ps.config.get_setting(ps.POINTS):
         ps.logger.debug('Start point calculations')
         # perform dose calculations
-        table, sum_table = point_calculations(worker)
+        table, sum_table = point_calculations(engine)
         result[ps.TABLE] = table
         result[ps.SUM_TABLE] = sum_table
-
-    # necessary for multi core
-    if pool is not None:
-        pool.terminate()
+    if ps.CONTOURS in calc_setting and ps.config.get_setting(ps.SOURCES):
+        ps.logger.debug('Start contour calculations')
+        # trace isocontours of the summed dose
+        result[ps.CONTOURS] = contour_calculations(engine)
 
     # display
     if ps.config.get_setting(ps.SHOW):
@@ -82,6 +89,8 @@ def run_with_configuration(config=None, **kwargs):
     # write results to disk if any
     if ps.config.get_setting(ps.EXPORT_EXCEL):
         ps.export.export_excel(result)
+        if ps.CONTOURS in result.keys():
+            ps.export.export_contours(result)
         
     if ps.FIGURE in result.keys() and ps.config.get_setting(ps.EXPORT_IMAGES):
         ps.export.export_images(result)
@@ -91,39 +100,15 @@ def run_with_configuration(config=None, **kwargs):
         plt.show(block=True)
     return result
 
-def point_wrapper(location):
+def points_wrapper(rows, scenario):
     """
-    Calculate dose at a specific location. Dose are calculated per source.
-    For each source an entry in a pandas table is created. 
-    """ 
-    
-    # get data from settings
-    height                 = ps.config.get_setting(ps.HEIGHT)
-    disable_buildup        = ps.config.get_setting(ps.DISABLE_BUILDUP)
-    intersection_thickness = ps.config.get_setting(ps.INTERSECTION_THICKNESS)
-    barriers               = ps.config.get_setting(ps.BARRIERS)
-    floor                  = ps.config.get_setting(ps.FLOOR)
-    sources                = ps.config.get_setting(ps.SOURCES)
-
-
-    calc_func = ps.calculations.isotope.calc_dose_source_at_location
-    
-    # iterate over all sources
-    rows = []
-    for name, source in sources.items():
-        result = calc_func(source, location[ps.LOCATION],
-                           barriers,
-                           disable_buildup = disable_buildup,
-                           intersection_thickness = intersection_thickness,
-                           height = height,
-                           return_details = True,
-                           floor = floor)
-
-        result[ps.SOURCE_NAME] = name
-        #row = dose_table(result)
-        rows += [result]
-        
-    return pd.DataFrame(rows)
+    Calculate the dose of all sources for a part (rows) of the points.
+    Returns the (points x sources) dose, details and shielding arrays, see
+    ps.point_dose.dose_matrix.
+    """
+    locations = [location[ps.LOCATION] for location in \
+                 list(scenario.points.values())[rows]]
+    return ps.point_dose.dose_matrix(locations, scenario, details=True)
 
 
 def summary_table(table):
@@ -148,105 +133,461 @@ def summary_table(table):
   return summary
 
 
-def point_calculations(worker):
+def point_calculations(engine):
     """ 
-    Calculate doses for all points, use worker to execute calculations.
+    Calculate doses for all points, use engine to execute calculations.
+    The points are split in parts that are calculated at once, the pandas
+    tables are created at the end.
     """
+    scenario        = engine.scenario
     
-    locations       = ps.config.get_setting(ps.POINTS)
-    sources         = ps.config.get_setting(ps.SOURCES)
+    locations       = scenario.points
+    sources         = scenario.sources
 
     ps.logger.debug('Locations: {0}'.format(locations))
     ps.logger.debug('Sources: {0}'.format(sources))
 
     ps.logger.info('\n-----Starting point calculations-----\n')
 
-    # actual calculations
-    tables = list(worker(point_wrapper, locations.values()))
-
-    # add location name and occupance factor to the table for each row
-    location_names = locations.keys()
-    for loc_name, table in zip(location_names, tables):
-        table[ps.POINT_NAME] = loc_name
-        try:
-            occupancy = locations[loc_name][ps.OCCUPANCY_FACTOR]
-        except KeyError: # not defined set to 1 as default
-            occupancy = 1
-        
-        table[ps.OCCUPANCY_FACTOR] = occupancy
+    # split points in parts, at least one part for each cpu
+    n_points = len(locations)
+    n_parts = engine.ncores if engine.multi_cpu else 1
+    size = min(engine.chunk_size(n_points, len(scenario.barriers)),
+               int(np.ceil(n_points / n_parts)))
+    parts = [slice(start, start + size) for start in range(0, n_points, size)]
 
-    table = pd.concat(tables) # stitch rows together to create single table
+    # actual calculations
+    results = list(engine.map(points_wrapper, parts))
+
+    dose = np.concatenate([result[0] for result in results])
+    details = np.concatenate([result[1] for result in results])
+    shielding = ps.point_dose.merge_shielding(
+        [result[2] for result in results],
+        [len(result[0]) for result in results])
+
+    # occupance factor, 1 if not defined
+    occupancy = [location.get(ps.OCCUPANCY_FACTOR, 1) \
+                 for location in locations.values()]
+
+    # single table with a row for each point and source
+    table = ps.point_dose.point_table(list(locations.keys()),
+                                      [location[ps.LOCATION] for location \
+                                       in locations.values()],
+                                      dose, details, shielding, scenario,
+                                      occupancy)
     summary = summary_table(table) # use a pivot table to get summarized result
     
     ps.logger.info('\n-----Point calculations finished-----\n')
     
     return table, summary
 
-def grid_wrapper(source_items):
-    name, source = source_items
-    calc_func = ps.grid.calculate_dose_map_for_source
-    ps.logger.info('Calculate: {0}'.format(name))
-    result = calc_func(source)
-    ps.logger.info('{0} Finished!'.format(name))
-    return result
-
-def grid_calculations(worker):
+def tile_wrapper(job, scenario):
+    # calculate the dose for a tile of the grid points of a source, points
+    # are read from and doses written to the (shared) arrays
+    name, rows, tile, arrays, output = job
+    calc_func = ps.grid.calculate_dose_points
+
+    points = arrays[(ps.POINTS, name)][rows]
+    polar = None
+    if (ps.POLAR, name) in arrays.keys():
+        polar = (arrays[(ps.POLAR, name)][0, rows].astype(int),
+                 arrays[(ps.POLAR, name)][1, rows],
+                 arrays[('angles', name)])
+
+    output[(ps.DOSE_MAPS, name)][rows] = calc_func(scenario.sources[name],
+                                                  points, polar, scenario)
+    if isinstance(output, ps.shared.FileArrays):
+        # on disk before the tile is marked as finished
+        output.flush((ps.DOSE_MAPS, name))
+    return name, tile
+
+def grid_calculations(engine):
     """ Performs calculations for all points on a grid. grid type and grid
       sampling should by specified with the \'grid\', \'grid_size\' and
       \'number_of_angles\' option in run_with configuration.
 
+      If \'dose_map_cache\' is set, dose maps are stored in that folder and
+      only sources for which the source, barriers, settings or physics data
+      changed are calculated. With \'incremental\' only the grid points
+      affected by edited barriers are calculated again. With \'grid\':
+      adaptive the grid is refined where needed, see ps.adaptive.
+
+      If \'tile_size\' is set the grid points of each source are split in
+      tiles, the (source, tile) jobs are spread over all cpu's. Otherwise
+      there is one job per source, or cache sized tiles for threads
+      (multi_cpu: threads).
+
+      With \'stream_sum\' the sources are calculated a few at a time (one
+      per cpu) and each dose map is added to the summed dose map when it is
+      finished. Dose maps of the sources are not kept, or stored in
+      \'spill_folder\' and returned as read only memory maps.
+
+      With \'map_store\' the dose maps (and the summed dose map) are
+      stored in export_dir/dose_maps and returned as read only memory maps,
+      grid workers write to these files directly and an interrupted run
+      resumes with the finished tiles, see ps.map_store.
+
       Returns:
           dictionary with dose_maps (2D numpy arrays) as values for each
           source name (keys)."""
 
 
-    sources = ps.config.get_setting(ps.SOURCES)
+    scenario = engine.scenario
+    names = list(scenario.sources.keys())
 
     ps.logger.info('\n-----Starting grid calculations-----\n')
     
     start_time = timer()
 
-    # do calculations
-    results = tuple(worker(grid_wrapper, sources.items()))
-    
-    # sort calculations, dose map for each source
-    results = dict(zip(sources.keys(), [r[0] for r in results]))
+    stream = ps.config.get_setting(ps.STREAM_SUM)
+    spill = ps.config.get_setting(ps.SPILL_FOLDER) if stream else ''
+    if stream:
+        size = engine.ncores if engine.multi_cpu else 1
+        batches = [names[i:i + size] for i in range(0, len(names), size)]
+    else:
+        batches = [names]
+
+    store = ''
+    if ps.config.get_setting(ps.MAP_STORE):
+        store = ps.map_store.store_folder()
+
+    results = {}
+    summed = None
+    for batch in batches:
+        for name, dose_map in source_dose_maps(engine, batch, store).items():
+            if store and summed is None:
+                summed = ps.map_store.summed_map(store, np.shape(dose_map))
+            summed = ps.calculations.grid.add_dose_map(summed, dose_map)
+            if spill:
+                ps.map_cache.save_map(spill, _file_name(name), dose_map)
+                results[name] = ps.map_cache.load_map(spill, _file_name(name),
+                                                      mmap_mode='r')
+            elif store or not stream:
+                results[name] = dose_map
 
     end_time = timer()
     dtime = end_time - start_time
 
     ps.logger.info('It took {0} to complete the calculation'.format(dtime))
-    
-    # sum dose maps 
-    summed = ps.calculations.grid.sum_dose_maps(results.values())
+
+    if scenario.region is not None:
+        # no dose outside the region of interest
+        X, Y = ps.grid.cartesian_grid(scenario.area,
+                                      scenario.get(ps.GRIDSIZE))
+        summed[~ps.region.region_mask(scenario, X, Y)] = np.nan
+
+    if store:
+        summed = ps.map_store.finish_summed(store, summed)
+
     results[ps.SUM_SOURCES] = summed
     
     return results
 
-def _get_worker():
-    # Return the map function for either single core or multi core
-    # calculations based on the \'multi_cpu\' flag in run_with_configuration.
+def source_dose_maps(engine, names, store=''):
+    """ Dose maps of sources names, from the map store or the dose map
+    cache, patched after barrier edits (incremental) or calculated, see
+    grid_calculations. If store (folder of ps.map_store) is given all dose
+    maps are stored there and returned as read only memory maps.
 
-    # Note: Windows cannot perform multi core calculations.
+    Returns:
+        dictionary with the dose map of each source in names (same order)
+    """
+    scenario = engine.scenario
+    sources = scenario.sources
+
+    folder = ps.config.get_setting(ps.DOSE_MAP_CACHE)
+    if folder or store:
+        keys = dict([(name, ps.map_cache.source_key(sources[name],
+                                                    scenario)) \
+                     for name in names])
+
+    # finished dose maps of a previous (interrupted) run
+    stored = {}
+    if store:
+        for name, key in keys.items():
+            dose_map = ps.map_cache.load_map(store, key, mmap_mode='r')
+            if dose_map is not None:
+                stored[name] = dose_map
+        ps.logger.info('{0} of {1} dose maps from map store'.format(
+            len(stored), len(names)))
+
+    # dose maps of unchanged sources from the cache
+    cached = {}
+    if folder:
+        for name, key in keys.items():
+            if name in stored.keys():
+                continue
+            dose_map = ps.map_cache.load_map(folder, key)
+            if dose_map is not None:
+                cached[name] = dose_map
+        ps.logger.info('{0} of {1} dose maps from cache'.format(len(cached),
+                                                               len(names)))
+
+    new_names = [name for name in names \
+                 if name not in cached.keys() and name not in stored.keys()]
+
+    # patch dose maps of the previous run after barrier edits
+    calculated = {}
+    if ps.config.get_setting(ps.INCREMENTAL):
+        for name in new_names:
+            dose_map = ps.incremental.update_map(name, sources[name], scenario)
+            if dose_map is not None:
+                calculated[name] = dose_map
+        new_names = [name for name in new_names \
+                     if name not in calculated.keys()]
 
-    #    Returns:
-    #        map (builtin python map function) or
-    #        map (method from the multiprocessing.Pool object) """
+    # do calculations
+    if scenario.get(ps.GRID) == ps.ADAPTIVE:
+        calculated.update(adaptive_grid_calculations(engine, new_names))
+    else:
+        calculated.update(tiled_grid_calculations(
+            engine, new_names, store, keys if store else None))
+
+    if folder:
+        for name, dose_map in calculated.items():
+            ps.map_cache.save_map(folder, keys[name], dose_map)
+
+    if store:
+        for name, dose_map in {**cached, **calculated}.items():
+            stored[name] = ps.map_store.store_map(store, keys[name], dose_map)
+
+    # keep the order of the sources
+    dose_maps = {**cached, **calculated, **stored}
+    return dict([(name, dose_maps[name]) for name in names])
+
+def tiled_grid_calculations(engine, names=None, store='', keys=None):
+    """ Calculate the dose maps of sources (names, all sources if None) with
+    (source, tile) jobs. Jobs are started with the most expensive first and
+    handed out one at a time, so all cpu's stay busy when sources differ in
+    cost. The tiles are stitched back to a dose map per source.
+
+    Grid points and doses of all sources are stored in arrays shared with
+    the workers (Engine.share), jobs only contain the source name and the
+    rows of the tile. If store (folder of ps.map_store) and keys (source_key
+    of each source) are given, the doses are written to files in store
+    instead and finished tiles of a previous run are not calculated again.
+    """
+    scenario = engine.scenario
+    sources = scenario.sources
+    if names is None:
+        names = sources.keys()
+    if not names:
+        return {}
+
+    grids = dict([(name, ps.grid.source_grid(sources[name], scenario)) \
+                  for name in names])
+
+    files = None
+    if keys is not None:
+        files = dict([(name, ps.map_store.points_file(store, keys[name],
+                                                      len(grid[0]))) \
+                      for name, grid in grids.items()])
+
+    dose = calculate_points(engine,
+                            dict([(name, grid[0]) \
+                                  for name, grid in grids.items()]),
+                            dict([(name, grid[2]) \
+                                  for name, grid in grids.items()]),
+                            files)
+
+    results = {}
+    for name, (points, grid, _, resampler) in grids.items():
+        results[name] = ps.grid.dose_points_to_map(dose[name], points,
+                                                   grid, resampler, scenario)
+        if ps.config.get_setting(ps.INCREMENTAL):
+            ps.incremental.store_map(name, sources[name], scenario, points,
+                                     grid, resampler, dose[name])
+        ps.logger.info('{0} Finished!'.format(name))
 
-    if ps.config.get_setting(ps.MULTI_CPU):
-        if not(os.name == 'posix'):
-            raise RuntimeError('Multi processing not available in Windows')
+    return results
 
-        pool = multiprocessing.ProcessPool(NCORES)
-        worker = pool.map
+def adaptive_grid_calculations(engine, names=None):
+    """ Calculate the dose maps of sources (names, all sources if None) on
+    an adaptive grid (ps.adaptive.AdaptiveGrid). Each refinement step the
+    new points of all sources are calculated with (source, tile) jobs. """
+    scenario = engine.scenario
+    sources = scenario.sources
+    if names is None:
+        names = sources.keys()
+
+    grids = dict([(name, ps.adaptive.AdaptiveGrid(sources[name], scenario)) \
+                  for name in names])
+    points = dict([(name, grid.points()) for name, grid in grids.items()])
+
+    while points:
+        dose = calculate_points(engine, points)
+        points = {}
+        for name, dose_points in dose.items():
+            new_points = grids[name].update(dose_points)
+            if len(new_points):
+                points[name] = new_points
+
+    results = {}
+    for name, grid in grids.items():
+        results[name] = grid.dose_map()
+        msg = '{0} Finished! {1} of {2} grid points calculated'
+        ps.logger.info(msg.format(name, grid.evaluations, grid.values.size))
+    return results
+
+def calculate_points(engine, points, polar=None, files=None):
+    """ Dose on points for each source with (source, tile) jobs, see
+    tiled_grid_calculations.
+
+    Args:
+        points: dictionary with an array (N, 2) of points for source names
+        polar:  dictionary with the polar information of the points (see
+                ps.grid.source_grid) for source names, or None
+        files:  dictionary with the points file (see ps.map_store) in which
+                the dose is stored for source names, or None. Tiles that
+                are marked as finished in the file are not calculated.
+
+    Returns:
+        dictionary with the dose (N, ) on the points for each source name,
+        memory maps for sources in files
+    """
+    scenario = engine.scenario
+    sources = scenario.sources
+    polar = polar or {}
+    files = files or {}
+
+    inputs = {}
+    outputs = {}
+    for name, source_points in points.items():
+        inputs[(ps.POINTS, name)] = source_points
+        if polar.get(name) is not None:
+            ray_index, radius, angles = polar[name]
+            inputs[(ps.POLAR, name)] = np.stack((ray_index, radius))
+            inputs[('angles', name)] = angles
+        if name not in files.keys():
+            outputs[(ps.DOSE_MAPS, name)] = (len(source_points), float)
+
+    arrays = engine.share(inputs, outputs)
+    stored = ps.shared.FileArrays(dict([((ps.DOSE_MAPS, name), file) \
+                                        for name, file in files.items()]))
+
+    # sources and tiles where even the dose without barriers is below the
+    # dose floor of a source get that upper bound, without a job
+    dose_floor = ps.grid.source_floor(scenario)
+    def below_floor(source, source_points):
+        return dose_floor and len(source_points) and \
+               ps.grid.tile_bound(source, source_points, scenario) < dose_floor
+
+    jobs = []
+    culled = 0
+    finished = {}
+    resumed = 0
+    for name, source_points in points.items():
+        source = sources[name]
+        output = stored if name in files.keys() else arrays
+        dose = output[(ps.DOSE_MAPS, name)]
+        if below_floor(source, source_points):
+            dose[:] = ps.grid.dose_bound(source, source_points, scenario)
+            ps.logger.info('{0} below dose floor'.format(name))
+            continue
+
+        tile_size = scenario.get(ps.TILE_SIZE) or \
+                    engine.chunk_size(len(source_points),
+                                      len(scenario.barriers))
+        tiles = ps.grid.grid_tiles(source, source_points, polar.get(name),
+                                   scenario, tile_size)
+        if name in files.keys():
+            finished[name] = ps.map_store.finished_tiles(files[name],
+                                                         tile_size, len(tiles))
+        for tile, (rows, _, cost) in enumerate(tiles):
+            if name in finished.keys() and finished[name][tile]:
+                resumed += 1
+                continue
+            if below_floor(source, source_points[rows]):
+                dose[rows] = ps.grid.dose_bound(source, source_points[rows],
+                                                scenario)
+                culled += 1
+                continue
+            jobs += [(cost, (name, rows, tile, arrays, output))]
+
+    ps.logger.info('Grid calculations in %s tiles', len(jobs))
+    if culled:
+        ps.logger.info('%s tiles below dose floor', culled)
+    if resumed:
+        ps.logger.info('%s tiles finished in a previous run', resumed)
+
+    # most expensive jobs first
+    jobs = sorted(jobs, key=lambda job: job[0], reverse=True)
+    jobs = [job[1] for job in jobs]
+
+    # unordered map with one job per task, idle workers take the next job
+    for name, tile in engine.imap_unordered(tile_wrapper, jobs):
+        ps.logger.debug('{0} tile {1} finished'.format(name, tile))
+        if name in finished.keys():
+            finished[name][tile] = True
+            finished[name].flush()
+
+    stored.close()
+    dose = {}
+    for name in points.keys():
+        if name in files.keys():
+            dose[name] = np.load(files[name], mmap_mode='r')
+        else:
+            dose[name] = np.array(arrays[(ps.DOSE_MAPS, name)])
+
+    engine.release(arrays)
+    return dose
+
+def contour_calculations(engine):
+    """ Trace the isocontours of the summed dose for the dose_map lines in
+    the visualization settings (see ps.contours). The dose on the rays is
+    calculated with (source, tile) jobs.
+
+    Returns:
+        dictionary with a list of polylines (arrays (K, 2)) for each level
+    """
+    scenario = engine.scenario
+    names = list(scenario.sources.keys())
+
+    def dose(points):
+        dose_points = calculate_points(engine, dict([(name, points) \
+                                                     for name in names]))
+        return np.sum(list(dose_points.values()), axis=0)
+
+    start_time = timer()
+    contours = ps.contours.trace_contours(scenario=scenario, dose=dose)
+    msg = 'It took {0} to trace {1} contour lines'
+    ps.logger.info(msg.format(timer() - start_time,
+                              sum(len(lines) for lines in contours.values())))
+    return contours
+
+def _file_name(name):
+    # file name (without extension) for the dose map of source name
+    return re.sub(r'[^\w\-. ]', '_', str(name))
+
+def _compile_scenario():
+    # Compile the scenario for the current configuration, physics data is
+    # precomputed for all isotopes and materials in the sources, barriers
+    # and floor.
+    scenario = ps.scenario.compile_scenario()
+
+    if ps.config.get_setting(ps.VALIDATE_TRANSMISSION):
+        msg = 'Max deviation of transmission table for %s: %s'
+        for key, deviation in scenario.physics.validate_tables().items():
+            ps.logger.info(msg, key, deviation)
+    return scenario
+
+def _get_engine():
+    # Return the engine for either single core or multi core calculations
+    # based on the \'multi_cpu\' flag in run_with_configuration. multi_cpu
+    # can be True (processes) or \'threads\'.
+
+    # Note: Windows cannot use worker processes, use threads instead.
+
+    multi_cpu = ps.config.get_setting(ps.MULTI_CPU)
+    if multi_cpu == ps.THREADS:
+        msg = '---MULTI THREAD CALCULATIONS STARTED with {0} threads---\n'
+        ps.logger.info(msg.format(NCORES))
+    elif multi_cpu:
         msg = '---MULTI CPU CALCULATIONS STARTED with {0} cpu\'s---\n'
         ps.logger.info(msg.format(NCORES))
-
     else:
-        worker = map
-        pool = None
         ps.logger.info('---SINGLE CPU CALCULATIONS STARTED----')
-    return pool, worker
+    return ps.engine.get_engine(multi_cpu)
 
 if __name__ == '__main__':
     run_with_configuration()
@@ -101,4 +101,13 @@ def print_dose_report(result):
 
       msg =  output.format(name, dose, occupancy, corrected_dose)
 
-      print(color + msg  + end_color)
\ No newline at end of file
+      print(color + msg  + end_color)
+
+def export_contours(results):
+    """ Write the isocontour polylines to contours.yml, a list of polylines
+    with [x, y] points in cm for each dose level in mSv. """
+    export_dir = export_folder()
+    contours = dict([(level, [line.tolist() for line in lines]) \
+                     for level, lines in results[ps.CONTOURS].items()])
+    ps.io.write_yaml(os.path.join(export_dir, ps.CONTOURS + '.yml'),
+                     contours)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Numpy arrays in shared memory for multi cpu calculations.
+
+SharedArrays stores a set of named arrays in a single memory mapped file
+(in /dev/shm if available, so the file lives in memory). When pickled only
+the file name and the layout of the arrays are stored, a worker process
+maps the same file and reads or writes the arrays without copying.
+FileArrays does the same for arrays in .npy files (see ps.map_store), the
+workers write their results directly to disk.
+
+dump_shared and load_shared pickle an object (e.g. a Scenario) while moving
+all large numpy arrays it contains to shared memory.
+"""
+import mmap
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+import pyshield as ps
+
+# arrays smaller than this (bytes) are pickled as usual
+SHARED_MIN_BYTES = 2**14
+
+# alignment (bytes) of each array in a shared memory block
+ALIGNMENT = 64
+
+# folder for the memory mapped files, in memory if possible
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedArrays():
+    """ Named numpy arrays in one shared memory block (memory mapped file).
+
+    Args:
+        arrays: dictionary with arrays, the arrays are copied to shared memory
+        empty:  dictionary with (shape, dtype) for arrays that are created
+                filled with zeros
+    """
+    def __init__(self, arrays=None, empty=None):
+        arrays = arrays or {}
+        empty = empty or {}
+
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            layout[name] = (offset, array.shape, array.dtype.str)
+            offset += _aligned(array.nbytes)
+        for name, (shape, dtype) in empty.items():
+            dtype = np.dtype(dtype)
+            layout[name] = (offset, tuple(np.atleast_1d(shape)), dtype.str)
+            offset += _aligned(int(np.prod(shape)) * dtype.itemsize)
+
+        handle, self.name = tempfile.mkstemp(prefix='pyshield_',
+                                             suffix='.shm', dir=SHARED_DIR)
+        try:
+            os.ftruncate(handle, max(offset, 1))
+            self._memory = mmap.mmap(handle, max(offset, 1))
+        finally:
+            os.close(handle)
+        self._owner = True
+        self.layout = layout
+
+        for name, array in arrays.items():
+            self[name][...] = array
+        for name in empty.keys():
+            self[name][...] = 0
+
+    def __getitem__(self, name):
+        offset, shape, dtype = self.layout[name]
+        return np.ndarray(shape, dtype=np.dtype(dtype),
+                          buffer=self._memory, offset=offset)
+
+    def keys(self):
+        return self.layout.keys()
+
+    def __reduce__(self):
+        # pickle a reference to the shared memory, not the data
+        return (_attach, (self.name, self.layout))
+
+    def close(self):
+        """ Release the shared memory, the owner also removes the block """
+        try:
+            self._memory.close()
+        except BufferError:
+            # arrays still in use, memory is released when they are deleted
+            pass
+        if self._owner and os.path.exists(self.name):
+            os.remove(self.name)
+
+
+class FileArrays():
+    """ Named numpy arrays in .npy files, opened as memory maps when used.
+    When pickled only the file names are stored, a worker process maps the
+    same files.
+
+    Args:
+        files: dictionary with the .npy file of each array
+    """
+    def __init__(self, files):
+        self.files = dict(files)
+        self._arrays = {}
+
+    def __getitem__(self, name):
+        if name not in self._arrays.keys():
+            self._arrays[name] = np.load(self.files[name], mmap_mode='r+')
+        return self._arrays[name]
+
+    def keys(self):
+        return self.files.keys()
+
+    def __reduce__(self):
+        return (FileArrays, (self.files, ))
+
+    def flush(self, name):
+        """ Write the changes of array name to disk """
+        self[name].flush()
+
+    def close(self):
+        """ Write all changes to disk and unmap the files """
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays.clear()
+
+
+def _aligned(nbytes):
+    return int(np.ceil(nbytes / ALIGNMENT) * ALIGNMENT)
+
+
+def _attach(name, layout):
+    # attach to an existing block, the block is detached when the returned
+    # object is deleted
+    shared = SharedArrays.__new__(SharedArrays)
+    with open(name, 'r+b') as file:
+        shared._memory = mmap.mmap(file.fileno(), 0)
+    shared.name = name
+    shared._owner = False
+    shared.layout = layout
+    return shared
+
+
+def dump_shared(obj, file):
+    """ Pickle obj to file. Numpy arrays of at least SHARED_MIN_BYTES in obj
+    are placed in shared memory and pickled by reference. Returns the
+    SharedArrays, which must be kept open as long as the pickle is used. """
+    # first pass, find large arrays
+    large = {}
+    def find(item):
+        if isinstance(item, np.ndarray) and item.dtype != object and \
+           item.nbytes >= SHARED_MIN_BYTES:
+            large.setdefault(id(item), item)
+        return None
+
+    _Pickler(_NullFile(), find).dump(obj)
+
+    names = dict([(key, str(i)) for i, key in enumerate(large.keys())])
+    shared = SharedArrays(dict([(names[key], array) \
+                                for key, array in large.items()]))
+
+    # second pass, replace large arrays by a reference
+    def reference(item):
+        if isinstance(item, np.ndarray) and id(item) in names.keys():
+            return (names[id(item)], item.flags.writeable)
+        return None
+
+    pickle.dump(shared, file)
+    _Pickler(file, reference).dump(obj)
+    ps.logger.debug('%s arrays (%s bytes) in shared memory', len(large),
+                    sum(array.nbytes for array in large.values()))
+    return shared
+
+
+def load_shared(file):
+    """ Load an object pickled with dump_shared. Arrays in shared memory are
+    views on the shared memory. Returns the SharedArrays and the object. """
+    shared = pickle.load(file)
+
+    def load(reference):
+        name, writeable = reference
+        array = shared[name]
+        array.flags.writeable = writeable
+        return array
+
+    unpickler = pickle.Unpickler(file)
+    unpickler.persistent_load = load
+    return shared, unpickler.load()
+
+
+class _Pickler(pickle.Pickler):
+    # pickler with a persistent_id function
+    def __init__(self, file, persistent_id):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._persistent_id = persistent_id
+
+    def persistent_id(self, obj):
+        return self._persistent_id(obj)
+
+
+class _NullFile():
+    # file object that discards all data, large read only arrays are
+    # written as a PickleBuffer
+    def write(self, data):
+        return memoryview(data).nbytes
@@ -13,7 +13,6 @@ import pyshield
 import yaml
 from matplotlib import pyplot as plt
 from tkinter import messagebox
-import logging
 
 DEBUG = False
 
@@ -89,38 +88,87 @@ def source_style(source):
     return style
     
 
-def calc_dose_at_point(point):
-    """ Calculate the dose at a specific point """
+class DoseEvaluator():
+    """ Dose at single points for a compiled scenario. Geometry and physics
+    are compiled once, each query only calculates the shielding for the
+    point (milliseconds).
+
+    Args:
+        scenario: Scenario, by default the scenario of the last run or
+                  compiled from the current configuration.
+    """
+    def __init__(self, scenario=None):
+        if scenario is None:
+            scenario = getattr(pyshield, 'RUN_SCENARIO', None)
+        if scenario is None:
+            scenario = ps.scenario.compile_scenario()
+        self.scenario = scenario
+
+    def dose(self, point):
+        """ Total dose in mSv of all sources at point (x, y) """
+        return float(np.sum(self.doses(point)))
+
+    def doses(self, point):
+        """ Dose in mSv of each source at point (x, y), array (S, ) """
+        return ps.point_dose.dose_matrix([point], self.scenario)[0]
+
+    def result(self, point, name='double click'):
+        """ Result dictionary with the point table and summary for point, as
+        returned by a run with only point calculations. """
+        dose, details, shielding = ps.point_dose.dose_matrix(
+            [point], self.scenario, details=True)
+        table = ps.point_dose.point_table([name], [point], dose, details,
+                                          shielding, self.scenario)
+        return {ps.TABLE: table,
+                ps.SUM_TABLE: ps.execute.summary_table(table)}
+
+
+def calc_dose_at_point(point, evaluator=None):
+    """ Calculate the dose at a specific point, evaluator is a DoseEvaluator
+    (by default for the last run). """
 
     ps.logger.info('Calculate dose at point')
-    config = {}
-
-    if not hasattr(pyshield, 'RUN_CONFIGURATION'):
-        raise RuntimeError
-
-    config = pyshield.RUN_CONFIGURATION
-    config[ps.MULTI_CPU] = False
-    config[ps.LOG] = logging.ERROR
-    config[ps.CALCULATE] = ps.POINTS
-    config[ps.POINTS] = {'double click': {ps.LOCATION: point}}
-    config[ps.SHOW] = []
-    config[ps.EXPORT_EXCEL] = []
-    config[ps.EXPORT_IMAGES] = []
-    
-    # run all calculations
-    if DEBUG:
-        ps.logger.debug('Running with config %s', config)
-    result = pyshield.run(**config)
+
+    if evaluator is None:
+        evaluator = DoseEvaluator()
+
+    result = evaluator.result(point)
     ps.logger.info('Finished')
 
     return result
 
+
+def sample_dose_map(dose_map, x, y, extent):
+    """ Value of dose_map, shown with imshow over extent (origin lower), at
+    location (x, y). Bilinear interpolation between the pixel centers,
+    NaN outside the map. """
+    rows, columns = dose_map.shape
+    # pixel coordinates of (x, y)
+    j = (x - extent[0]) / (extent[1] - extent[0]) * columns - 0.5
+    i = (y - extent[2]) / (extent[3] - extent[2]) * rows - 0.5
+    if not(-0.5 <= j <= columns - 0.5 and -0.5 <= i <= rows - 0.5):
+        return np.nan
+
+    i = min(max(i, 0), rows - 1)
+    j = min(max(j, 0), columns - 1)
+    i0, j0 = int(i), int(j)
+    i1, j1 = min(i0 + 1, rows - 1), min(j0 + 1, columns - 1)
+    wi, wj = i - i0, j - j0
+
+    return (1 - wi) * ((1 - wj) * dose_map[i0, j0] + wj * dose_map[i0, j1]) \
+           + wi * ((1 - wj) * dose_map[i1, j0] + wj * dose_map[i1, j1])
+
 def show_floorplan(points = {}, sources = {}):
-    """ Show shielding barriers on top of floor plan. """
+    """ Show shielding barriers on top of floor plan. A double click on the
+    floor plan shows the dose at that location, calculated by a
+    DoseEvaluator held by the figure (fig.evaluator). """
     #get application data
     floor_plan = ps.config.get_setting(ps.FLOOR_PLAN)
     barriers  = ps.config.get_setting(ps.BARRIERS)
 
+    # compiled geometry and physics for point queries
+    evaluator = DoseEvaluator()
+
     #==========================================================================
     #   Functions to help plotting
     #==========================================================================
@@ -136,9 +184,7 @@ def show_floorplan(points = {}, sources = {}):
                 ps.logger.debug('double click')
                 ps.logger.debug(str(event))
        
-            result = calc_dose_at_point((event.xdata, event.ydata))
-           
-            dose = result[ps.SUM_TABLE][ps.DOSE_MSV][0]
+            dose = evaluator.dose((event.xdata, event.ydata))
             messagebox.showinfo(title='caclulation',
                                 message='Total Dose: {0}'.format(dose))
 
@@ -312,6 +358,7 @@ def show_floorplan(points = {}, sources = {}):
 
     fig.canvas.mpl_connect('pick_event', object_click)
     fig.canvas.mpl_connect('button_press_event', figure_click)
+    fig.evaluator = evaluator
     return fig
 
 
@@ -325,6 +372,13 @@ def plot_dose_map(dose_map=None, legend=None, title = ''):
 
     fig = show_floorplan()
 
+    # dose at the mouse position in the status bar, sampled from the map
+    def format_coord(x, y):
+        dose = sample_dose_map(dose_map, x, y, extent)
+        return 'x={0:.0f}, y={1:.0f}, dose={2:.3g} mSv'.format(x, y, dose)
+
+    plt.gca().format_coord = format_coord
+
     # show heatmap
     plt.imshow(dose_map,
                extent   = get_extent(floor_plan),
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed scenario for the equivalence tests of the grid engines and modes.
+
+The scenario has the cases where engines are most likely to differ:
+
+    - a room of four barriers that share their end points
+    - a barrier through a source (s1) and a source at a shared barrier end
+      point (s2)
+    - with grid_size 9.9 the pixels of the cartesian grid are on multiples
+      of 10 cm, pixels on the diagonals through s1 are in line with the
+      room corners (grazing rays) and pixel rows lie on barriers
+"""
+import copy
+
+import numpy as np
+import pytest
+
+import pyshield as ps
+
+BARRIERS = {
+    'r1': {ps.LOCATION: [50, 50, 250, 50], ps.MATERIAL: {'Lead': 0.1}},
+    'r2': {ps.LOCATION: [250, 50, 250, 250], ps.MATERIAL: {'Concrete': 10}},
+    'r3': {ps.LOCATION: [250, 250, 50, 250], ps.MATERIAL: {'Lead': 0.2}},
+    'r4': {ps.LOCATION: [50, 250, 50, 50],
+           ps.MATERIAL: {'Lead': 0.1, 'Brick': 10}},
+    'through': {ps.LOCATION: [100, 150, 200, 150], ps.MATERIAL: {'Lead': 0.5}},
+    'diagonal': {ps.LOCATION: [300, 20, 380, 280],
+                 ps.MATERIAL: {'Concrete': 5}}}
+
+SOURCES = {
+    's1': {ps.LOCATION: [150, 150], ps.ISOTOPE: 'I-131', ps.ACTIVITY_H: 1000,
+           ps.TYPE: ps.ISOTOPE},
+    's2': {ps.LOCATION: [250, 250], ps.ISOTOPE: 'F-18', ps.ACTIVITY_H: 500,
+           ps.TYPE: ps.ISOTOPE},
+    's3': {ps.LOCATION: [340, 120], ps.ISOTOPE: 'Lu-177', ps.ACTIVITY: 7400,
+           ps.DURATION: 48, ps.TYPE: ps.ISOTOPE,
+           ps.MATERIAL: {'Lead': 0.1}}}
+
+# settings of a reference run, every test sets all of them because
+# settings are kept between runs
+SETTINGS = dict(calculate=[ps.GRID], grid=ps.CARTESIAN, grid_size=9.9,
+                number_of_angles=72, grid_engine=ps.RAYS,
+                polar_interpolation=ps.BILINEAR, spatial_index=False,
+                multi_cpu=False, tile_size=0, incremental=False,
+                dose_floor=0, dose_map_cache='', map_store=False,
+                stream_sum=False, spill_folder='', region='',
+                transmission_tolerance=0, show=False, export_excel=False,
+                export_images=False, log='error')
+
+
+@pytest.fixture
+def run_scenario(tmp_path):
+    """ Function that runs pyshield for the fixed scenario with SETTINGS (and
+    barriers or sources) updated by its keyword arguments, returns the
+    results. """
+    def run(**settings):
+        config = dict(SETTINGS, barriers=BARRIERS, sources=SOURCES,
+                      floor_plan=np.zeros((300, 400)),
+                      export_dir=str(tmp_path / 'output'))
+        config.update(settings)
+        config = copy.deepcopy(config)
+        return ps.run(config='nonexistent.yml', **config)
+    yield run
+    ps.incremental.clear()
+    ps.engine.shutdown()
+
+
+@pytest.fixture
+def run_grid(run_scenario):
+    """ As run_scenario, returns the dose maps """
+    return lambda **settings: run_scenario(**settings)[ps.DOSE_MAPS]
+
+
+@pytest.fixture
+def tile_jobs(monkeypatch):
+    """ List with the (source name, rows, tile) of each calculated tile of
+    grid points, for calculations without worker processes. """
+    jobs = []
+    tile_wrapper = ps.execute.tile_wrapper
+
+    def recording(job, scenario):
+        jobs.append(job[0:3])
+        return tile_wrapper(job, scenario)
+
+    monkeypatch.setattr(ps.execute, 'tile_wrapper', recording)
+    return jobs
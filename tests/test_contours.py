@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Traced isocontours must lie where the summed dose of the rays engine crosses
+the level, for all grid engines and modes.
+"""
+import numpy as np
+import pytest
+
+import pyshield as ps
+from pyshield.calculations.scenario import compile_scenario
+
+# accuracy of the contour location in cm (default of trace_contours)
+TOLERANCE = 1
+
+
+def _summed_dose(points, scenario):
+    return sum(ps.grid._dose_points(source, points, None, scenario) \
+               for source in scenario.sources.values())
+
+
+def test_contours_on_level(run_scenario):
+    contours = run_scenario(calculate=[ps.CONTOURS])[ps.CONTOURS]
+    scenario = compile_scenario()
+    centers = scenario.sources.locations
+
+    assert len(contours)
+    for level, lines in contours.items():
+        assert len(lines)
+        points = np.concatenate(lines)
+
+        # the dose crosses the level on the ray from the nearest source
+        # within TOLERANCE of each point
+        distance = np.linalg.norm(points[:, np.newaxis] - centers, axis=2)
+        direction = points - centers[np.argmin(distance, axis=1)]
+        direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
+        inner = _summed_dose(points - TOLERANCE * direction, scenario)
+        outer = _summed_dose(points + TOLERANCE * direction, scenario)
+        assert np.all(np.minimum(inner, outer) <= level * (1 + 1e-12))
+        assert np.all(np.maximum(inner, outer) >= level * (1 - 1e-12))
+
+
+@pytest.mark.parametrize('settings', [{'grid_engine': ps.SWEEP},
+                                      {'spatial_index': True},
+                                      {'multi_cpu': ps.THREADS},
+                                      {'multi_cpu': True, 'tile_size': 97}])
+def test_contours_equal_rays(run_scenario, settings):
+    reference = run_scenario(calculate=[ps.CONTOURS])[ps.CONTOURS]
+    contours = run_scenario(calculate=[ps.CONTOURS], **settings)[ps.CONTOURS]
+    assert list(contours.keys()) == list(reference.keys())
+    for level in reference.keys():
+        assert len(contours[level]) == len(reference[level])
+        for line, reference_line in zip(contours[level], reference[level]):
+            np.testing.assert_allclose(line, reference_line, rtol=1e-12)
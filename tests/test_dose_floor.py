@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+The dose without barriers used for dose_floor must be an upper bound of the
+calculated dose, also when buildup makes thin barriers raise the dose.
+"""
+import numpy as np
+import pytest
+
+import pyshield as ps
+from pyshield.calculations.physics_cache import get_physics
+from pyshield.calculations.scenario import compile_scenario
+
+from conftest import SOURCES
+
+# thin barriers, with buildup the transmission is larger than 1
+BARRIERS = {
+    'w1': {ps.LOCATION: [0, 100, 400, 100], ps.MATERIAL: {'Concrete': 0.1}},
+    'w2': {ps.LOCATION: [200, 0, 200, 300], ps.MATERIAL: {'Lead': 0.01}},
+    'w3': {ps.LOCATION: [0, 200, 400, 200],
+           ps.MATERIAL: {'Concrete': 0.1, 'Lead': 0.1}}}
+
+
+@pytest.mark.parametrize('grid_engine', [ps.RAYS, ps.SWEEP])
+def test_bound_above_dose(run_grid, grid_engine):
+    exact = run_grid(barriers=BARRIERS, grid_engine=grid_engine)
+    floor = run_grid(barriers=BARRIERS, grid_engine=grid_engine,
+                     dose_floor=1e-3)
+
+    scenario = compile_scenario()
+    X, Y = np.meshgrid(np.arange(0, 401, 10.), np.arange(0, 301, 10.))
+    points = np.stack((X.ravel(), Y.ravel()), axis=1)
+    for name, source in scenario.sources.items():
+        dose = ps.grid._dose_points(source, points, None, scenario)
+        bound = ps.grid.dose_bound(source, points, scenario)
+        assert np.all(bound >= dose), name
+        assert ps.grid.tile_bound(source, points, scenario) >= np.max(dose)
+
+    # the dose is infinite in the pixel of a source
+    finite = np.isfinite(exact[ps.SUM_SOURCES])
+    difference = floor[ps.SUM_SOURCES][finite] - exact[ps.SUM_SOURCES][finite]
+    assert np.all(difference >= -1e-15)
+    assert np.all(difference <= 1e-3)
+
+
+def test_max_transmission():
+    physics = get_physics()
+    for source in SOURCES.values():
+        isotope = source[ps.ISOTOPE]
+        for material in ('Concrete', 'Lead'):
+            thickness = np.linspace(0, 20, 20001)
+            t = physics.exact_transmission(isotope, material, thickness)
+            maximum = physics.max_transmission(isotope, material)
+            assert np.all(t <= maximum * (1 + 1e-12))
+            assert np.all(physics.max_transmission(
+                isotope, material, disable_buildup=True) == \
+                1 + physics.tolerance)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Grid engines and calculation modes must give the same dose maps as the
+rays engine on the fixed scenario of conftest.
+"""
+import numpy as np
+import pytest
+
+import pyshield as ps
+from pyshield.calculations.barrier import sum_shielding_lines
+from pyshield.calculations.spatial_index import BarrierIndex
+
+from conftest import BARRIERS, SOURCES
+
+
+def _assert_equal(maps, reference, rtol=1e-12):
+    assert set(maps.keys()) == set(reference.keys())
+    for name in reference.keys():
+        np.testing.assert_allclose(maps[name], reference[name], rtol=rtol,
+                                   atol=0, err_msg=name)
+
+
+def _locations():
+    # pixels on multiples of 10 cm, many in line with barrier end points
+    X, Y = np.meshgrid(np.arange(0, 401, 10.), np.arange(0, 301, 10.))
+    return np.stack((X.ravel(), Y.ravel()), axis=1)
+
+
+@pytest.mark.parametrize('source', [[200, 150], [0, 150], [100, 150],
+                                    [120, 100]])
+def test_sweep_barrier_through_source(source):
+    # source on the barrier, at its end points and off the barrier
+    barriers = {'wall': {ps.LOCATION: [0, 150, 400, 150],
+                         ps.MATERIAL: {'Lead': 0.5}}}
+    rays = sum_shielding_lines(source, _locations(), barriers)
+    sweep = sum_shielding_lines(source, _locations(), barriers, sweep=True)
+    assert rays.keys() == sweep.keys()
+    for material in rays.keys():
+        np.testing.assert_allclose(sweep[material], rays[material],
+                                   rtol=1e-12)
+
+
+@pytest.mark.parametrize('grid', [ps.CARTESIAN, ps.POLAR])
+def test_sweep_equals_rays(run_grid, grid):
+    reference = run_grid(grid=grid)
+    _assert_equal(run_grid(grid=grid, grid_engine=ps.SWEEP), reference)
+
+
+@pytest.mark.parametrize('grid', [ps.CARTESIAN, ps.POLAR])
+def test_spatial_index_equals_rays(run_grid, grid):
+    reference = run_grid(grid=grid)
+    _assert_equal(run_grid(grid=grid, spatial_index=True), reference)
+
+
+@pytest.mark.parametrize('cell_size', [7, 50, 1000])
+def test_spatial_index_cell_size(cell_size):
+    # cells smaller than, similar to and larger than the barriers
+    segments = np.array([barrier[ps.LOCATION] for barrier in \
+                         BARRIERS.values()], dtype=float)
+    index = BarrierIndex(segments, cell_size=cell_size)
+    for source in SOURCES.values():
+        rays = sum_shielding_lines(source[ps.LOCATION], _locations(), BARRIERS)
+        indexed = sum_shielding_lines(source[ps.LOCATION], _locations(),
+                                      BARRIERS, index=index)
+        assert rays.keys() == indexed.keys()
+        for material in rays.keys():
+            np.testing.assert_allclose(indexed[material], rays[material],
+                                       rtol=1e-12)
+
+
+def test_polar_rays_equals_rays(run_grid):
+    reference = run_grid(grid=ps.POLAR)
+    _assert_equal(run_grid(grid=ps.POLAR, grid_engine=ps.POLAR_RAYS),
+                  reference)
+
+
+def test_polar_rays_cartesian_grid(run_grid):
+    # without a polar grid polar_rays falls back to the rays engine
+    reference = run_grid(grid=ps.CARTESIAN)
+    _assert_equal(run_grid(grid=ps.CARTESIAN, grid_engine=ps.POLAR_RAYS),
+                  reference)
+
+
+@pytest.mark.parametrize('multi_cpu', [False, ps.THREADS, True])
+@pytest.mark.parametrize('tile_size', [0, 97])
+@pytest.mark.parametrize('grid', [ps.CARTESIAN, ps.POLAR])
+def test_tiles_and_workers(run_grid, grid, tile_size, multi_cpu):
+    reference = run_grid(grid=grid)
+    _assert_equal(run_grid(grid=grid, tile_size=tile_size,
+                           multi_cpu=multi_cpu), reference)
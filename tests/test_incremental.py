@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental grid updates must give the same dose maps as a full run.
+"""
+import copy
+
+import numpy as np
+import pytest
+
+import pyshield as ps
+
+BARRIERS = {
+    'w1': {ps.LOCATION: [0, 0, 400, 0], ps.MATERIAL: {'Lead': 0.2}},
+    'w2': {ps.LOCATION: [400, 0, 400, 300], ps.MATERIAL: {'Concrete': 20}},
+    'w3': {ps.LOCATION: [0, 150, 250, 150],
+           ps.MATERIAL: {'Lead': 0.1, 'Brick': 10}},
+    'w4': {ps.LOCATION: [250, 150, 250, 300], ps.MATERIAL: {'Lead': 0.3}},
+    'w5': {ps.LOCATION: [50, 250, 350, 250], ps.MATERIAL: {'Concrete': 5}}}
+
+SOURCES = {
+    's1': {ps.LOCATION: [100, 100], ps.ISOTOPE: 'I-131', ps.ACTIVITY_H: 1000,
+           ps.TYPE: ps.ISOTOPE},
+    's2': {ps.LOCATION: [320, 220], ps.ISOTOPE: 'Lu-177', ps.ACTIVITY: 7400,
+           ps.DURATION: 48, ps.TYPE: ps.ISOTOPE,
+           ps.MATERIAL: {'Lead': 0.1}}}
+
+
+def _run(barriers, incremental, dose_floor=0):
+    config = dict(barriers=copy.deepcopy(barriers), sources=SOURCES,
+                  floor_plan=np.zeros((300, 400)), calculate=[ps.GRID],
+                  grid=ps.CARTESIAN, grid_size=10, incremental=incremental,
+                  dose_floor=dose_floor, multi_cpu=False, show=False,
+                  export_excel=False, export_images=False,
+                  dose_map_cache='', map_store=False, stream_sum=False,
+                  region='', tile_size=0, log='error')
+    return ps.run(config='nonexistent.yml', **config)[ps.DOSE_MAPS]
+
+
+def _edited(edit):
+    barriers = copy.deepcopy(BARRIERS)
+    if edit == 'move':
+        barriers['w3'][ps.LOCATION] = [0, 180, 250, 120]
+    elif edit == 'add':
+        barriers['w6'] = {ps.LOCATION: [150, 20, 150, 280],
+                          ps.MATERIAL: {'Lead': 0.5}}
+    elif edit == 'remove':
+        del barriers['w5']
+    elif edit == 'thickness':
+        barriers['w4'][ps.MATERIAL] = {'Lead': 0.6}
+    return barriers
+
+
+@pytest.mark.parametrize('dose_floor', [0, 0.05])
+@pytest.mark.parametrize('edit', ['move', 'add', 'remove', 'thickness'])
+def test_update_equals_full_run(edit, dose_floor):
+    ps.incremental.clear()
+    _run(BARRIERS, True, dose_floor)
+    patched = _run(_edited(edit), True, dose_floor)
+
+    ps.incremental.clear()
+    full = _run(_edited(edit), False, dose_floor)
+
+    for name in full.keys():
+        np.testing.assert_allclose(patched[name], full[name], rtol=1e-12)
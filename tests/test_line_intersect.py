@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+intersect_rays must follow the rules of intersect_line for each ray and
+barrier: parallel lines do not intersect, end points are included and each
+intersection point counts once (the first barrier wins).
+"""
+import math
+
+import numpy as np
+import pytest
+
+import pyshield as ps
+from pyshield.calculations.line_intersect import intersect_rays, sci_round, \
+                                                 PARALLEL_SINE
+
+from conftest import BARRIERS, SOURCES
+
+SEGMENTS = np.array([barrier[ps.LOCATION] for barrier in BARRIERS.values()],
+                    dtype=float)
+
+
+def _reference(origin, end, segments):
+    # hits and path length factors for one ray, one barrier at a time as
+    # sum_shielding_line does with intersect_line
+    points = []
+    hit = np.zeros(len(segments), dtype=bool)
+    factor = np.zeros(len(segments))
+    s1_x, s1_y = end[0] - origin[0], end[1] - origin[1]
+    for i, (x0, y0, x1, y1) in enumerate(segments):
+        s2_x, s2_y = x1 - x0, y1 - y0
+        den = -s2_x * s1_y + s1_x * s2_y
+        norm = math.hypot(s1_x, s1_y) * math.hypot(s2_x, s2_y)
+        if abs(den) <= PARALLEL_SINE * norm:
+            continue
+        s = (-s1_y * (origin[0] - x0) + s1_x * (origin[1] - y0)) / den
+        t = (s2_x * (origin[1] - y0) - s2_y * (origin[0] - x0)) / den
+        if not (0 <= s <= 1 and 0 <= t <= 1):
+            continue
+        p = (sci_round(origin[0] + t * s1_x), sci_round(origin[1] + t * s1_y))
+        if p in points:
+            continue
+        points.append(p)
+        hit[i] = True
+        factor[i] = norm / abs(den)
+    return hit, factor
+
+
+@pytest.mark.parametrize('source', sorted(SOURCES.keys()))
+def test_intersect_rays_equals_intersect_line(source):
+    origin = np.array(SOURCES[source][ps.LOCATION], dtype=float)
+    X, Y = np.meshgrid(np.arange(0, 401, 10.), np.arange(0, 301, 10.))
+    ends = np.stack((X.ravel(), Y.ravel()), axis=1)
+
+    hit, factor = intersect_rays(origin, ends, SEGMENTS)
+    for i, end in enumerate(ends):
+        ref_hit, ref_factor = _reference(origin, end, SEGMENTS)
+        np.testing.assert_array_equal(hit[i], ref_hit, err_msg=str(end))
+        np.testing.assert_allclose(factor[i], ref_factor, rtol=1e-12)
+
+
+@pytest.mark.parametrize('origin, end, expected', [
+    # parallel to barriers 0, 2 and 3, end point of barrier 1
+    ((0, 10), (20, 10), [False, True, False, False]),
+    # nearly parallel to barrier 2 (rounding error)
+    ((0, 5), (20, 5 + 1e-13), [False, True, False, False]),
+    # barriers 0, 1 and 3 meet in (10, 0), barrier 0 counts
+    ((0, 10), (20, -10), [True, False, True, False]),
+    # barriers 1 and 2 cross in (10, 5), barrier 1 counts
+    ((0, 10), (20, 0), [False, True, False, False]),
+    ((0, 10), (-5, 20), [False, False, False, False]),
+    # origin on barriers 0 and 3
+    ((5, 0), (5, 10), [True, False, True, False]),
+    ((5, 0), (20, 0), [False, True, False, False])])
+def test_intersect_rays_rules(origin, end, expected):
+    segments = np.array([[0, 0, 10, 0],
+                         [10, 0, 10, 10],
+                         [0, 5, 20, 5],
+                         [0, 0, 10, 0]], dtype=float)
+    hit, factor = intersect_rays(origin, [end], segments)
+    np.testing.assert_array_equal(hit[0], expected)
+    np.testing.assert_allclose(factor[0], _reference(origin, end, segments)[1],
+                               rtol=1e-12)
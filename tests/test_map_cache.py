@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Dose maps from the dose map cache must be bit identical to calculated maps,
+only sources whose key changed are calculated again.
+"""
+import copy
+import os
+
+import numpy as np
+
+import pyshield as ps
+
+from conftest import BARRIERS, SOURCES
+
+
+def _calculated(tile_jobs):
+    # names of the sources with calculated tiles, tile_jobs is cleared
+    names = set(job[0] for job in tile_jobs)
+    tile_jobs.clear()
+    return names
+
+
+def _assert_identical(maps, reference):
+    assert list(maps.keys()) == list(reference.keys())
+    for name in reference.keys():
+        np.testing.assert_array_equal(maps[name], reference[name],
+                                      err_msg=name)
+
+
+def test_second_run_from_cache(run_grid, tile_jobs, tmp_path):
+    reference = run_grid()
+    folder = str(tmp_path / 'cache')
+
+    tile_jobs.clear()
+    _assert_identical(run_grid(dose_map_cache=folder), reference)
+    assert _calculated(tile_jobs) == set(SOURCES.keys())
+    assert len(os.listdir(folder)) == len(SOURCES)
+
+    tile_jobs.clear()
+    _assert_identical(run_grid(dose_map_cache=folder), reference)
+    assert _calculated(tile_jobs) == set()
+
+
+def test_edits(run_grid, tile_jobs, tmp_path):
+    folder = str(tmp_path / 'cache')
+    run_grid(dose_map_cache=folder)
+
+    # a renamed source reuses its map, an edited source is calculated
+    sources = copy.deepcopy(SOURCES)
+    sources['renamed'] = sources.pop('s1')
+    sources['s3'][ps.MATERIAL] = {'Lead': 0.2}
+    tile_jobs.clear()
+    maps = run_grid(dose_map_cache=folder, sources=sources)
+    assert _calculated(tile_jobs) == {'s3'}
+    _assert_identical(maps, run_grid(sources=sources))
+
+    # edited barriers change all maps
+    barriers = copy.deepcopy(BARRIERS)
+    barriers['r2'][ps.MATERIAL] = {'Concrete': 20}
+    tile_jobs.clear()
+    maps = run_grid(dose_map_cache=folder, barriers=barriers)
+    assert _calculated(tile_jobs) == set(SOURCES.keys())
+    _assert_identical(maps, run_grid(barriers=barriers))
+
+
+def test_unreadable_map(run_grid, tile_jobs, tmp_path):
+    reference = run_grid()
+    folder = str(tmp_path / 'cache')
+    run_grid(dose_map_cache=folder)
+
+    file = os.path.join(folder, sorted(os.listdir(folder))[0])
+    with open(file, 'wb') as handle:
+        handle.write(b'not a dose map')
+
+    tile_jobs.clear()
+    _assert_identical(run_grid(dose_map_cache=folder), reference)
+    assert len(_calculated(tile_jobs)) == 1
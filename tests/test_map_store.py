@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Dose maps from the map store must be bit identical to calculated maps, an
+interrupted run resumes with the finished tiles.
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+import pyshield as ps
+from pyshield.calculations.scenario import compile_scenario
+
+from conftest import SOURCES
+
+TILE_SIZE = 97
+
+
+def _assert_identical(maps, reference):
+    assert list(maps.keys()) == list(reference.keys())
+    for name in reference.keys():
+        np.testing.assert_array_equal(maps[name], reference[name],
+                                      err_msg=name)
+
+
+@pytest.mark.parametrize('grid', [ps.CARTESIAN, ps.POLAR])
+def test_second_run_from_store(run_grid, tile_jobs, tmp_path, grid):
+    reference = run_grid(grid=grid)
+    folder = str(tmp_path / 'output' / 'dose_maps')
+
+    maps = run_grid(grid=grid, map_store=True)
+    _assert_identical(maps, reference)
+    assert all(isinstance(item, np.memmap) for item in maps.values())
+    assert len(glob.glob(os.path.join(folder, '*.npy'))) == len(SOURCES) + 1
+
+    tile_jobs.clear()
+    _assert_identical(run_grid(grid=grid, map_store=True), reference)
+    assert tile_jobs == []
+
+
+def test_resume(run_grid, tile_jobs, tmp_path, monkeypatch):
+    reference = run_grid(tile_size=TILE_SIZE)
+    n_tiles = len(tile_jobs)
+    folder = str(tmp_path / 'output' / 'dose_maps')
+
+    # interrupt after 5 tiles
+    tile_jobs.clear()
+    tile_wrapper = ps.execute.tile_wrapper
+
+    def interrupted(job, scenario):
+        if len(tile_jobs) == 5:
+            raise KeyboardInterrupt
+        return tile_wrapper(job, scenario)
+
+    monkeypatch.setattr(ps.execute, 'tile_wrapper', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run_grid(tile_size=TILE_SIZE, map_store=True)
+    monkeypatch.setattr(ps.execute, 'tile_wrapper', tile_wrapper)
+    finished = list(tile_jobs)
+    assert len(finished) == 5
+
+    # remove the marker of a finished tile and spoil its dose
+    name, rows, tile = finished[0]
+    scenario = compile_scenario()
+    key = ps.map_cache.source_key(scenario.sources[name], scenario)
+    points = np.load(os.path.join(folder, key + '.points.npy'), mmap_mode='r+')
+    points[rows] = -1
+    points.flush()
+    markers = np.load(os.path.join(folder, key + \
+                                   '.tiles{0}.npy'.format(TILE_SIZE)),
+                      mmap_mode='r+')
+    assert markers[tile]
+    markers[tile] = False
+    markers.flush()
+    del points, markers
+
+    tile_jobs.clear()
+    maps = run_grid(tile_size=TILE_SIZE, map_store=True)
+    _assert_identical(maps, reference)
+    resumed = [(job[0], job[2]) for job in tile_jobs]
+    assert len(resumed) == n_tiles - 4
+    assert (name, tile) in resumed
+    assert not set(resumed) & set((job[0], job[2]) for job in finished[1:])
+
+    # finished maps are used, points and tiles files are removed
+    assert sorted(os.listdir(folder)) == \
+        sorted([ps.map_cache.source_key(source, scenario) + '.npy' \
+                for source in scenario.sources.values()] + ['sum_sources.npy'])
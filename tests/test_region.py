@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Dose maps limited to a region of interest must equal the full dose maps in
+the region and be NaN outside.
+"""
+import numpy as np
+import pytest
+
+import pyshield as ps
+from pyshield.calculations.scenario import compile_scenario
+
+POLYGONS = [[[20, 20], [230, 40], [200, 180], [60, 140]],
+            [[280, 200], [390, 210], [330, 290]]]
+
+
+def _mask_image():
+    # rows from the bottom of the floor plan, one pixel per 10 cm
+    mask = np.zeros((30, 40))
+    mask[5:20, 12:35] = 1
+    return mask
+
+
+@pytest.mark.parametrize('region', ['polygons', 'mask'])
+@pytest.mark.parametrize('grid', [ps.CARTESIAN, ps.POLAR])
+def test_region_equals_full_run(run_grid, grid, region):
+    full = run_grid(grid=grid)
+    region = POLYGONS if region == 'polygons' else _mask_image()
+    maps = run_grid(grid=grid, region=region)
+
+    scenario = compile_scenario()
+    X, Y = ps.grid.cartesian_grid(scenario.area, scenario.get(ps.GRIDSIZE))
+    mask = ps.region.region_mask(scenario, X, Y)
+    assert 0 < mask.sum() < mask.size / 2
+
+    assert list(maps.keys()) == list(full.keys())
+    for name in full.keys():
+        np.testing.assert_array_equal(maps[name][mask], full[name][mask],
+                                      err_msg=name)
+        assert np.all(np.isnan(maps[name][~mask])), name
+
+
+def test_region_tiles_and_workers(run_grid):
+    reference = run_grid(region=POLYGONS)
+    for settings in ({'tile_size': 97}, {'multi_cpu': ps.THREADS},
+                     {'multi_cpu': True, 'tile_size': 97},
+                     {'grid_engine': ps.SWEEP}):
+        maps = run_grid(region=POLYGONS, **settings)
+        for name in reference.keys():
+            np.testing.assert_allclose(maps[name], reference[name],
+                                       rtol=1e-12, err_msg=name)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+The polar resampler must interpolate bilinearly in (angle, radius) like a
+regular grid interpolator with periodic angles.
+"""
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from pyshield.calculations.resample import PolarResampler, get_resampler
+
+OFFSET = (123.4, 56.7)
+RI = 9.9 * np.arange(1, 8) ** 2
+ANGLES = np.linspace(0, 2 * np.pi, 72, endpoint=False)
+
+
+def _grid():
+    return np.meshgrid(np.linspace(0, 400, 41), np.linspace(0, 300, 31))
+
+
+def test_constant():
+    X, Y = _grid()
+    resampler = PolarResampler(OFFSET, RI, ANGLES, X, Y)
+    result = resampler.resample(np.full(len(resampler.samples), 2.5))
+
+    inside = np.hypot(X - OFFSET[0], Y - OFFSET[1]) <= RI[-1]
+    np.testing.assert_allclose(result[inside], 2.5, rtol=1e-14)
+    assert np.all(np.isnan(result[~inside]))
+
+
+def test_equals_regular_grid_interpolator():
+    X, Y = _grid()
+    resampler = PolarResampler(OFFSET, RI, ANGLES, X, Y)
+    values = np.random.RandomState(0).uniform(size=(len(ANGLES), len(RI)))
+
+    # angle axis closed over 2 pi, radii within the first radius get the
+    # value of the first radius
+    interpolator = RegularGridInterpolator(
+        (np.append(ANGLES, 2 * np.pi), RI), np.vstack((values, values[0:1])))
+    dx, dy = X - OFFSET[0], Y - OFFSET[1]
+    r = np.hypot(dx, dy)
+    inside = r <= RI[-1]
+    theta = np.mod(np.arctan2(dx, dy), 2 * np.pi)
+    expected = interpolator(np.stack((theta[inside],
+                                      np.maximum(r[inside], RI[0])), axis=1))
+
+    result = resampler.resample(values.ravel()[resampler.samples])
+    np.testing.assert_allclose(result[inside], expected, rtol=1e-12)
+
+    # points are the locations of the samples
+    angles = ANGLES[resampler.ray_index]
+    np.testing.assert_allclose(
+        resampler.points(),
+        OFFSET + resampler.radius[:, np.newaxis] * \
+        np.stack((np.sin(angles), np.cos(angles)), axis=1))
+
+
+def test_mask():
+    X, Y = _grid()
+    resampler = PolarResampler(OFFSET, RI, ANGLES, X, Y)
+    values = np.random.RandomState(1).uniform(size=len(resampler.samples))
+    mask = (X > 100) & (X < 250) & (Y < 120)
+
+    full = resampler.resample(values)
+    masked = resampler.resample(values[resampler.used(mask)], mask)
+    np.testing.assert_array_equal(masked[mask], full[mask])
+    assert np.all(np.isnan(masked[~mask]))
+
+
+def test_cache():
+    X, Y = _grid()
+    resampler = get_resampler(OFFSET, RI, ANGLES, X, Y)
+    assert get_resampler(OFFSET, RI, ANGLES, X, Y) is resampler
+    assert get_resampler((123.4, 56.8), RI, ANGLES, X, Y) is not resampler
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Arrays in shared memory must survive pickling unchanged and without copies.
+"""
+import io
+import os
+import pickle
+
+import numpy as np
+
+from pyshield.shared import SharedArrays, dump_shared, load_shared, \
+                            SHARED_MIN_BYTES
+
+
+def test_shared_arrays_pickle():
+    shared = SharedArrays({'a': np.arange(10.), 'b': np.eye(3, dtype=int)},
+                          empty={'c': ((4, 2), float)})
+    try:
+        attached = pickle.loads(pickle.dumps(shared))
+        assert len(pickle.dumps(shared)) < 1000
+        np.testing.assert_array_equal(attached['a'], np.arange(10.))
+        np.testing.assert_array_equal(attached['b'], np.eye(3))
+        np.testing.assert_array_equal(attached['c'], np.zeros((4, 2)))
+        assert attached['b'].dtype == int
+
+        # both refer to the same memory
+        attached['c'][1, 1] = 5
+        assert shared['c'][1, 1] == 5
+
+        attached.close()
+        assert os.path.exists(shared.name)
+    finally:
+        shared.close()
+    assert not os.path.exists(shared.name)
+
+
+def test_dump_load_shared():
+    large = np.random.RandomState(0).uniform(size=SHARED_MIN_BYTES // 4)
+    large.flags.writeable = False
+    small = np.arange(5.)
+    obj = {'large': large, 'again': large, 'small': small,
+           'nested': [large[::2].copy(), 'text']}
+
+    file = io.BytesIO()
+    shared = dump_shared(obj, file)
+    try:
+        # only the large arrays are in shared memory, each once
+        assert len(shared.keys()) == 2
+        assert len(file.getvalue()) < large.nbytes
+
+        file.seek(0)
+        loaded_shared, loaded = load_shared(file)
+        np.testing.assert_array_equal(loaded['large'], large)
+        np.testing.assert_array_equal(loaded['again'], large)
+        np.testing.assert_array_equal(loaded['small'], small)
+        np.testing.assert_array_equal(loaded['nested'][0], large[::2])
+        assert loaded['nested'][1] == 'text'
+
+        assert not loaded['large'].flags.writeable
+        assert loaded['nested'][0].flags.writeable
+        assert loaded['large'].base is not None
+        loaded_shared.close()
+    finally:
+        shared.close()